@@ -1,22 +1,38 @@
-from flask import Flask, render_template, request, redirect, url_for
-import sqlite3
-import uuid
+from flask import Flask, render_template, request, redirect, url_for, Response, stream_with_context, current_app, jsonify
 import os
-from werkzeug.utils import secure_filename
+import sys
+
+# 後台以獨立腳本運行，需將專案根目錄加入搜尋路徑，才能與前台共用 app/found.py 的連線池
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import repository, importer, uploads, media_store, thumbnails
 
 app = Flask(__name__)
 
-DB_PATH = r"D:\vscode\project\instance\music_library.db"
 UPLOAD_FOLDER = r"D:\vscode\project\檔案"
 
 # 確保上傳資料夾存在，否則創建
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
-def db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+def save_upload(field, default=''):
+    """取得文件欄位的儲存路徑：優先使用已完成的分塊上傳會話，其次為表單中的文件，否則回傳 default"""
+    upload_path = uploads.completed_path(request.form.get(f'{field}_upload_id', ''))
+    if upload_path:
+        return upload_path
+    file = request.files.get(field)
+    if file and file.filename != '':
+        # 按內容存放：與已有文件相同時直接引用同一份
+        return media_store.store_stream(UPLOAD_FOLDER, file.stream, file.filename)
+    return default
+
+def pregenerate_thumbnails(img_path):
+    """歌曲寫入資料庫後在背景預先產生縮圖（已存在時略過）；失敗只記錄，頁面請求時會再生成"""
+    if not img_path:
+        return
+    try:
+        thumbnails.pregenerate(img_path)
+    except Exception:
+        current_app.logger.exception("預先產生縮圖失敗: %s", img_path)
 
 # 創建歌曲接口（文件上傳後自動生成路徑）
 @app.route('/create_song', methods=['GET', 'POST'])
@@ -33,46 +49,23 @@ def create_song():
         tempo_end = request.form['tempo_end']
         source = request.form['source']
 
-        # 處理文件上傳：文件、封面圖片、MP3文件
+        # 處理文件上傳：文件、封面圖片、MP3文件（分塊上傳或一般表單上傳）
         # 1. 文件上傳
-        file_upload = request.files.get('path')
-        if file_upload and file_upload.filename != '':
-            filename = secure_filename(file_upload.filename)
-            new_filename = f"{uuid.uuid4()}_{filename}"
-            file_path_full = os.path.join(UPLOAD_FOLDER, new_filename)
-            file_upload.save(file_path_full)
-        else:
-            file_path_full = ''
+        file_path_full = save_upload('path')
 
         # 2. 封面圖片上傳
-        img_file = request.files.get('img_url')
-        if img_file and img_file.filename != '':
-            filename = secure_filename(img_file.filename)
-            new_filename = f"{uuid.uuid4()}_{filename}"
-            img_path_full = os.path.join(UPLOAD_FOLDER, new_filename)
-            img_file.save(img_path_full)
-        else:
-            img_path_full = ''
+        img_path_full = save_upload('img_url')
 
         # 3. MP3 文件上傳
-        mp3_file = request.files.get('mp3_url')
-        if mp3_file and mp3_file.filename != '':
-            filename = secure_filename(mp3_file.filename)
-            new_filename = f"{uuid.uuid4()}_{filename}"
-            mp3_path_full = os.path.join(UPLOAD_FOLDER, new_filename)
-            mp3_file.save(mp3_path_full)
-        else:
-            mp3_path_full = ''
-
-        song_uuid = str(uuid.uuid4())
+        mp3_path_full = save_upload('mp3_url')
 
         # 將數據存入資料庫
-        conn = db_connection()
-        conn.execute("""
-            INSERT INTO songs (uuid, song_title, tags, music_key, author, lyrics, category, tempo_start, tempo_end, source, path, img_url, mp3_url)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (song_uuid, song_title, tags, music_key, author, lyrics, category, tempo_start, tempo_end, source, file_path_full, img_path_full, mp3_path_full))
-        conn.commit()
+        repository.create_song({
+            'song_title': song_title, 'tags': tags, 'music_key': music_key, 'author': author,
+            'lyrics': lyrics, 'category': category, 'tempo_start': tempo_start, 'tempo_end': tempo_end,
+            'source': source, 'path': file_path_full, 'img_url': img_path_full, 'mp3_url': mp3_path_full
+        })
+        pregenerate_thumbnails(img_path_full)
 
         return redirect(url_for('song_list'))
     
@@ -81,15 +74,101 @@ def create_song():
 # 歌曲列表頁面
 @app.route('/songs')
 def song_list():
-    conn = db_connection()
-    songs = conn.execute("SELECT * FROM songs").fetchall()
-    return render_template('song_list.html', songs=songs)
+    # 伺服器端篩選 / 排序，以游標分頁，每次只讀一頁的列表欄位
+    filters = {
+        'sort': request.args.get('sort', 'newest'),
+        'search': request.args.get('search', '').strip(),
+        'category': request.args.get('category', '').strip()
+    }
+    songs, next_cursor = repository.list_songs_page(
+        cursor=request.args.get('cursor'),
+        limit=request.args.get('limit', repository.SONG_LIST_PAGE_SIZE, type=int),
+        **filters
+    )
+    context = {
+        'songs': songs,
+        'next_cursor': next_cursor,
+        'filters': filters,
+        'sorts': repository.SONG_LIST_SORTS,
+        'categories': repository.list_song_categories()
+    }
+    current_app.update_template_context(context)
+    # 模板邊渲染邊輸出，不在記憶體中拼出整頁 HTML
+    template = current_app.jinja_env.get_template('song_list.html')
+    return Response(stream_with_context(template.generate(context)))
+
+# 批量導入歌曲（CSV / JSONL），回傳導入統計與被拒絕的行
+@app.route('/import_songs', methods=['POST'])
+def import_songs():
+    upload = request.files.get('file')
+    if not upload or upload.filename == '':
+        return jsonify({'success': False, 'message': '未選擇文件'}), 400
+    fmt = request.form.get('format') or importer.detect_format(upload.filename)
+    if fmt not in ('csv', 'jsonl'):
+        return jsonify({'success': False, 'message': '僅支援 CSV 或 JSONL 文件'}), 400
+
+    stats = importer.import_upload(upload, fmt)
+    return jsonify({'success': True, **stats.as_dict()})
+
+# 分塊上傳：建立會話、查詢進度（續傳用）、依偏移上傳分塊、完成並校驗
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    data = request.get_json(silent=True) or {}
+    try:
+        session = uploads.create_session(
+            UPLOAD_FOLDER, data.get('filename', ''), int(data.get('size', -1)), data.get('sha256')
+        )
+    except (TypeError, ValueError) as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return jsonify({'success': True, **session}), 201
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    session = uploads.get_session(upload_id)
+    if not session:
+        return jsonify({'success': False, 'message': '上傳會話不存在'}), 404
+    return jsonify({
+        'success': True,
+        'upload_id': upload_id,
+        'offset': session['received'],
+        'size': session['size'],
+        'status': session['status'],
+        'chunk_size': uploads.UPLOAD_CHUNK_SIZE
+    })
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    # 請求體即為分塊內容，直接從 request.stream 寫入文件，不經表單解析
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+        new_offset = uploads.write_chunk(
+            UPLOAD_FOLDER, upload_id, offset, request.stream, request.content_length or 0
+        )
+    except uploads.UploadOffsetMismatch as e:
+        return jsonify({'success': False, 'message': str(e), 'offset': e.offset}), 409
+    except LookupError as e:
+        return jsonify({'success': False, 'message': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return jsonify({'success': True, 'offset': new_offset})
+
+@app.route('/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    data = request.get_json(silent=True) or {}
+    try:
+        result = uploads.complete_session(UPLOAD_FOLDER, upload_id, data.get('sha256'))
+    except uploads.UploadOffsetMismatch as e:
+        return jsonify({'success': False, 'message': str(e), 'offset': e.offset}), 409
+    except LookupError as e:
+        return jsonify({'success': False, 'message': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return jsonify({'success': True, **result})
 
 # 編輯歌曲接口（支持更新文件上傳，如未上傳則保留原路徑）
 @app.route('/edit_song/<uuid>', methods=['GET', 'POST'])
 def edit_song(uuid):
-    conn = db_connection()
-    song = conn.execute("SELECT * FROM songs WHERE uuid = ?", (uuid,)).fetchone()
+    song = repository.get_song(uuid)
     if request.method == 'POST':
         song_title = request.form['song_title']
         tags = request.form['tags']
@@ -102,41 +181,21 @@ def edit_song(uuid):
         source = request.form['source']
 
         # 文件上傳處理：若有新文件則更新，否則使用隱藏欄位中的原始路徑
-        file_upload = request.files.get('path')
-        if file_upload and file_upload.filename != '':
-            filename = secure_filename(file_upload.filename)
-            new_filename = f"{uuid.uuid4()}_{filename}"
-            file_path_full = os.path.join(UPLOAD_FOLDER, new_filename)
-            file_upload.save(file_path_full)
-        else:
-            file_path_full = request.form.get('existing_path', song['path'])
+        file_path_full = save_upload('path', request.form.get('existing_path', song.path))
 
         # 封面圖片更新
-        img_file = request.files.get('img_url')
-        if img_file and img_file.filename != '':
-            filename = secure_filename(img_file.filename)
-            new_filename = f"{uuid.uuid4()}_{filename}"
-            img_path_full = os.path.join(UPLOAD_FOLDER, new_filename)
-            img_file.save(img_path_full)
-        else:
-            img_path_full = request.form.get('existing_img_url', song['img_url'])
+        img_path_full = save_upload('img_url', request.form.get('existing_img_url', song.img_url))
 
         # MP3 文件更新
-        mp3_file = request.files.get('mp3_url')
-        if mp3_file and mp3_file.filename != '':
-            filename = secure_filename(mp3_file.filename)
-            new_filename = f"{uuid.uuid4()}_{filename}"
-            mp3_path_full = os.path.join(UPLOAD_FOLDER, new_filename)
-            mp3_file.save(mp3_path_full)
-        else:
-            mp3_path_full = request.form.get('existing_mp3_url', song['mp3_url'])
-
-        conn.execute("""
-            UPDATE songs
-            SET song_title = ?, tags = ?, music_key = ?, author = ?, lyrics = ?, category = ?, tempo_start = ?, tempo_end = ?, source = ?, path = ?, img_url = ?, mp3_url = ?
-            WHERE uuid = ?
-        """, (song_title, tags, music_key, author, lyrics, category, tempo_start, tempo_end, source, file_path_full, img_path_full, mp3_path_full, uuid))
-        conn.commit()
+        mp3_path_full = save_upload('mp3_url', request.form.get('existing_mp3_url', song.mp3_url))
+
+        # 更新後會一併清除包含此歌曲的歌單匯出快取
+        repository.update_song(uuid, {
+            'song_title': song_title, 'tags': tags, 'music_key': music_key, 'author': author,
+            'lyrics': lyrics, 'category': category, 'tempo_start': tempo_start, 'tempo_end': tempo_end,
+            'source': source, 'path': file_path_full, 'img_url': img_path_full, 'mp3_url': mp3_path_full
+        })
+        pregenerate_thumbnails(img_path_full)
         
         return redirect(url_for('song_list'))
     
@@ -0,0 +1,123 @@
+// 分塊、可續傳上傳：表單送出前先把選擇的文件分塊上傳（同一首歌的多個文件並行），
+// 完成後以隱藏欄位 <欄位>_upload_id 帶入上傳會話 id，原文件欄位停用、不再隨表單送出。
+// 上傳中斷後重新送出表單，會依 localStorage 記錄的會話從伺服器已接收的偏移繼續。
+(function () {
+    const uploadUrl = document.currentScript.dataset.uploadUrl;
+    const MAX_CLIENT_HASH_SIZE = 256 * 1024 * 1024;  // 更大的文件由伺服器端計算校驗和
+    const MAX_RETRIES = 3;
+
+    async function sha256Hex(file) {
+        if (!window.crypto || !crypto.subtle || file.size > MAX_CLIENT_HASH_SIZE) {
+            return null;
+        }
+        const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+        return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+    }
+
+    async function requestJson(url, options) {
+        const response = await fetch(url, options);
+        return { status: response.status, ok: response.ok, data: await response.json() };
+    }
+
+    async function resumeSession(key) {
+        const uploadId = localStorage.getItem(key);
+        if (!uploadId) {
+            return null;
+        }
+        const result = await requestJson(`${uploadUrl}/${uploadId}`);
+        if (!result.ok) {
+            localStorage.removeItem(key);
+            return null;
+        }
+        return result.data;
+    }
+
+    async function sendChunk(uploadId, offset, chunk) {
+        for (let attempt = 0; ; attempt++) {
+            try {
+                return await requestJson(`${uploadUrl}/${uploadId}`, {
+                    method: 'PUT',
+                    headers: { 'Upload-Offset': String(offset), 'Content-Type': 'application/octet-stream' },
+                    body: chunk
+                });
+            } catch (error) {
+                if (attempt >= MAX_RETRIES) {
+                    throw error;
+                }
+                await new Promise(resolve => setTimeout(resolve, 1000 * (attempt + 1)));
+            }
+        }
+    }
+
+    async function uploadFile(file, onProgress) {
+        const key = `upload:${file.name}:${file.size}:${file.lastModified}`;
+        let session = await resumeSession(key);
+        if (!session) {
+            const created = await requestJson(uploadUrl, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ filename: file.name, size: file.size, sha256: await sha256Hex(file) })
+            });
+            if (!created.ok) {
+                throw new Error(created.data.message);
+            }
+            session = created.data;
+            localStorage.setItem(key, session.upload_id);
+        }
+
+        let offset = session.offset;
+        while (session.status !== 'done' && offset < file.size) {
+            const result = await sendChunk(session.upload_id, offset, file.slice(offset, offset + session.chunk_size));
+            if (!result.ok && result.status !== 409) {
+                throw new Error(result.data.message);
+            }
+            offset = result.data.offset;  // 409 時伺服器回傳正確的續傳位置
+            onProgress(offset / file.size);
+        }
+
+        const completed = await requestJson(`${uploadUrl}/${session.upload_id}/complete`, { method: 'POST' });
+        if (!completed.ok) {
+            localStorage.removeItem(key);
+            throw new Error(completed.data.message);
+        }
+        localStorage.removeItem(key);
+        onProgress(1);
+        return session.upload_id;
+    }
+
+    document.querySelectorAll('form[data-chunked-upload]').forEach(form => {
+        form.addEventListener('submit', async event => {
+            const inputs = Array.from(form.querySelectorAll('input[type=file]')).filter(input => input.files.length);
+            if (!inputs.length) {
+                return;
+            }
+            event.preventDefault();
+            const button = form.querySelector('button[type=submit]');
+            button.disabled = true;
+
+            try {
+                const uploadIds = await Promise.all(inputs.map(input => {
+                    let progress = input.nextElementSibling;
+                    if (!progress || progress.tagName !== 'PROGRESS') {
+                        progress = document.createElement('progress');
+                        progress.max = 1;
+                        input.after(progress);
+                    }
+                    return uploadFile(input.files[0], value => { progress.value = value; });
+                }));
+                inputs.forEach((input, index) => {
+                    const hidden = document.createElement('input');
+                    hidden.type = 'hidden';
+                    hidden.name = `${input.name}_upload_id`;
+                    hidden.value = uploadIds[index];
+                    form.appendChild(hidden);
+                    input.disabled = true;
+                });
+                form.submit();
+            } catch (error) {
+                alert(`上傳失敗：${error.message}。重新送出即可從中斷處繼續。`);
+                button.disabled = false;
+            }
+        });
+    });
+})();
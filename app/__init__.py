@@ -6,22 +6,31 @@ import os
 # 只創建一個 SQLAlchemy 物件
 db = SQLAlchemy()
 login_manager = LoginManager()
-
-app = Flask(__name__)
+login_manager.login_view = 'auth.login'
 
 
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///music_library.db'  # 用戶 & 歌曲資料放在同一個 DB
+def create_app():
+    """
+    建立前台應用。匯入 app 套件本身不會建立應用或載入路由，
+    後台（admin/app.py）只匯入其中的資料存取模組（found、repository 等）。
+    """
+    app = Flask(__name__)
 
-app.config['SECRET_KEY'] = os.urandom(24)  # 生成一個隨機的 24 字節密鑰
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///music_library.db'  # 用戶 & 歌曲資料放在同一個 DB
 
+    app.config['SECRET_KEY'] = os.urandom(24)  # 生成一個隨機的 24 字節密鑰
 
-# 只初始化一次 SQLAlchemy
-db.init_app(app)
-login_manager.init_app(app)
+    # 部署於 nginx / Apache 之後時設為 1，媒體檔案改由代理伺服器以 X-Sendfile 直接傳送
+    app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE') == '1'
 
-login_manager.login_view = 'auth.login'
+    # 只初始化一次 SQLAlchemy
+    db.init_app(app)
+    login_manager.init_app(app)
 
-# 註冊藍圖
-from app.routes import auth, playlists
-app.register_blueprint(auth.bp)
-app.register_blueprint(playlists.bp)
+    # 註冊藍圖
+    from app.routes import auth, playlists, media, songs
+    app.register_blueprint(auth.bp)
+    app.register_blueprint(playlists.bp)
+    app.register_blueprint(media.bp)
+    app.register_blueprint(songs.bp)
+    return app
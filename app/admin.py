@@ -1,17 +1,8 @@
-from flask import Flask, render_template, request, redirect, url_for
-import sqlite3
-import uuid
+from flask import render_template, request, redirect, url_for, Response, stream_with_context, current_app, jsonify
 from flask import Blueprint
+from app import repository, importer  # 与前台共用同一个数据访问层（同一个连接池）
 bp = Blueprint('admin', __name__, url_prefix='/admin')
 
-DB_PATH = r"D:\vscode\project\instance\music_library.db"
-
-# 数据库连接
-def db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
-
 # 歌曲創建接口
 @bp.route('/')
 @bp.route('/create_song', methods=['GET', 'POST'])
@@ -30,15 +21,12 @@ def create_song():
         img_url = request.form['img_url']
         mp3_url = request.form['mp3_url']
         
-        song_uuid = str(uuid.uuid4())
-
         # 插入到数据库
-        conn = db_connection()
-        conn.execute("""
-            INSERT INTO songs (uuid, song_title, tags, music_key, author, lyrics, category, tempo_start, tempo_end, source, path, img_url, mp3_url)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (song_uuid, song_title, tags, music_key, author, lyrics, category, tempo_start, tempo_end, source, path, img_url, mp3_url))
-        conn.commit()
+        repository.create_song({
+            'song_title': song_title, 'tags': tags, 'music_key': music_key, 'author': author,
+            'lyrics': lyrics, 'category': category, 'tempo_start': tempo_start, 'tempo_end': tempo_end,
+            'source': source, 'path': path, 'img_url': img_url, 'mp3_url': mp3_url
+        })
         
         return redirect(url_for('song_list'))
     
@@ -47,15 +35,45 @@ def create_song():
 # 歌曲列表頁面
 @bp.route('/songs')
 def song_list():
-    conn = db_connection()
-    songs = conn.execute("SELECT * FROM songs").fetchall()
-    return render_template('song_list.html', songs=songs)
+    # 伺服器端篩選 / 排序，以游標分頁，每次只讀一頁的列表欄位
+    filters = {
+        'sort': request.args.get('sort', 'newest'),
+        'search': request.args.get('search', '').strip(),
+        'category': request.args.get('category', '').strip()
+    }
+    songs, next_cursor = repository.list_songs_page(
+        cursor=request.args.get('cursor'),
+        limit=request.args.get('limit', repository.SONG_LIST_PAGE_SIZE, type=int),
+        **filters
+    )
+    context = {
+        'songs': songs,
+        'next_cursor': next_cursor,
+        'filters': filters,
+        'sorts': repository.SONG_LIST_SORTS,
+        'categories': repository.list_song_categories()
+    }
+    current_app.update_template_context(context)
+    # 模板邊渲染邊輸出，不在記憶體中拼出整頁 HTML
+    template = current_app.jinja_env.get_template('song_list.html')
+    return Response(stream_with_context(template.generate(context)))
+
+# 批量導入歌曲（CSV / JSONL），回傳導入統計與被拒絕的行
+@bp.route('/import_songs', methods=['POST'])
+def import_songs():
+    upload = request.files.get('file')
+    if not upload or upload.filename == '':
+        return jsonify({'success': False, 'message': '未選擇文件'}), 400
+    fmt = request.form.get('format') or importer.detect_format(upload.filename)
+    if fmt not in ('csv', 'jsonl'):
+        return jsonify({'success': False, 'message': '僅支援 CSV 或 JSONL 文件'}), 400
+
+    stats = importer.import_upload(upload, fmt)
+    return jsonify({'success': True, **stats.as_dict()})
 
 # 編輯歌曲頁面
 @bp.route('/edit_song/<uuid>', methods=['GET', 'POST'])
 def edit_song(uuid):
-    conn = db_connection()
-    
     if request.method == 'POST':
         song_title = request.form['song_title']
         tags = request.form['tags']
@@ -70,14 +88,14 @@ def edit_song(uuid):
         img_url = request.form['img_url']
         mp3_url = request.form['mp3_url']
 
-        conn.execute("""
-            UPDATE songs
-            SET song_title = ?, tags = ?, music_key = ?, author = ?, lyrics = ?, category = ?, tempo_start = ?, tempo_end = ?, source = ?, path = ?, img_url = ?, mp3_url = ?
-            WHERE uuid = ?
-        """, (song_title, tags, music_key, author, lyrics, category, tempo_start, tempo_end, source, path, img_url, mp3_url, uuid))
-        conn.commit()
+        # 更新後會一併清除包含此歌曲的歌單匯出快取
+        repository.update_song(uuid, {
+            'song_title': song_title, 'tags': tags, 'music_key': music_key, 'author': author,
+            'lyrics': lyrics, 'category': category, 'tempo_start': tempo_start, 'tempo_end': tempo_end,
+            'source': source, 'path': path, 'img_url': img_url, 'mp3_url': mp3_url
+        })
         
         return redirect(url_for('song_list'))
     
-    song = conn.execute("SELECT * FROM songs WHERE uuid = ?", (uuid,)).fetchone()
+    song = repository.get_song(uuid)
     return render_template('edit_song.html', song=song)
@@ -0,0 +1,269 @@
+import re
+import json
+import time
+import heapq
+import bisect
+import threading
+import sqlite3
+import unicodedata
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    from pypinyin import lazy_pinyin, Style
+except ImportError:  # 未安装 pypinyin 时中文只能按字前缀匹配，没有拼音 / 注音键
+    lazy_pinyin = None
+
+from app import found
+
+# ========================
+# 输入即搜的前缀补全索引
+# ========================
+# 内存中按键排序的条目数组 (键, uuid, 字段, 显示文本)，前缀查询用二分查找定出范围，
+# 范围内按歌曲的 query_count 加权汇总同一显示文本。键来自 song_title、author 与逗号分隔的 tags：
+# 规范化后的全文、每个词开头的后缀（"queen" 可找到 "Dancing Queen"），中文另加拼音、拼音首字母与注音首字母。
+# 范围超过 AUTOCOMPLETE_SCAN_LIMIT 的短前缀把排序结果缓存起来，保证每次查询只做有限的工作。
+# 每次查询先按数据库的歌曲变更日志（found.song_changes_since）追上任何进程的写入，增量更新条目并重算受影响的
+# 缓存前缀；本进程的写入经 found.songs_changed 立即追上，耗时留在写入端。
+# 全量建立在后台线程进行，首次建立完成前查询返回空列表；query_count 由定期的后台全量重建刷新。
+AUTOCOMPLETE_LIMIT = 8
+AUTOCOMPLETE_MAX_LIMIT = 20
+AUTOCOMPLETE_SCAN_LIMIT = 2000          # 前缀范围内的条目数超过该值时缓存排序结果
+AUTOCOMPLETE_REFRESH_INTERVAL = 600.0   # 全量重建（刷新查询次数权重）的间隔（秒）
+AUTOCOMPLETE_INCREMENTAL_MAX = 1000     # 一次变更的歌曲数超过该值时改为后台全量重建
+AUTOCOMPLETE_KEY_CACHE = 65536          # 缓存索引键的文本数（作者、标签大量重复）
+AUTOCOMPLETE_FIELDS = ('song_title', 'author', 'tags')
+
+TAG_SEPARATOR = re.compile(r'[,，、]')
+CJK_CHAR = re.compile(r'[\u3400-\u9fff\uf900-\ufaff]')
+ZHUYIN_TONES = str.maketrans('', '', 'ˊˇˋ˙')
+KEY_END = '\U0010ffff'
+
+
+def available_romanization() -> bool:
+    return lazy_pinyin is not None
+
+
+def normalize(text: Optional[str]) -> str:
+    """NFKC（全角转半角）、小写、合并空白"""
+    return ' '.join(unicodedata.normalize('NFKC', text or '').lower().split())
+
+
+@lru_cache(maxsize=None)
+def romanize_char(char: str) -> Tuple[str, str]:
+    """单个汉字的 (拼音, 注音)，不含声调"""
+    return lazy_pinyin(char)[0], lazy_pinyin(char, style=Style.BOPOMOFO)[0].translate(ZHUYIN_TONES)
+
+
+@lru_cache(maxsize=AUTOCOMPLETE_KEY_CACHE)
+def index_keys(text: str) -> Tuple[str, ...]:
+    """一段文本的所有索引键"""
+    norm = normalize(text)
+    if not norm:
+        return ()
+    words = norm.split(' ')
+    keys = [' '.join(words[i:]) for i in range(len(words))]
+    if lazy_pinyin is not None and CJK_CHAR.search(norm):
+        # 逐字转换并缓存（整句转换每个标题约 0.5 ms，全量重建时太慢）；多音字取常用读音
+        pinyin, zhuyin = [], []
+        for char in norm.replace(' ', ''):
+            if CJK_CHAR.match(char):
+                char_pinyin, char_zhuyin = romanize_char(char)
+            else:
+                char_pinyin = char_zhuyin = char
+            pinyin.append(char_pinyin)
+            zhuyin.append(char_zhuyin)
+        keys.append(''.join(pinyin))
+        keys.append(''.join(syllable[0] for syllable in pinyin))
+        keys.append(''.join(zhuyin))
+        keys.append(''.join(syllable[0] for syllable in zhuyin))
+    return tuple(dict.fromkeys(keys))
+
+
+def song_entries(row: Any) -> List[tuple]:
+    """一首歌的条目 (键, uuid, 字段, 显示文本)"""
+    labels = []
+    for field in AUTOCOMPLETE_FIELDS:
+        value = row[field]
+        if not value:
+            continue
+        parts = TAG_SEPARATOR.split(value) if field == 'tags' else [value]
+        labels.extend((field, part.strip()) for part in parts if part.strip())
+    return [
+        (key, row['uuid'], field, label)
+        for field, label in dict.fromkeys(labels)
+        for key in index_keys(label)
+    ]
+
+
+class AutocompleteIndex:
+    def __init__(self):
+        self._entries: List[tuple] = []
+        self._by_song: Dict[str, List[tuple]] = {}
+        self._weights: Dict[str, int] = {}
+        self._prefix_cache: Dict[str, List[tuple]] = {}
+        self._lock = threading.Lock()
+        self._built_at: Optional[float] = None
+        self._rebuilding = False
+        self._seq = 0     # 已反映到索引中的歌曲变更序号
+        self._build = 0   # 全量重建的次数，增量更新据此丢弃重建前取得的行
+
+    def _load(self) -> Tuple[List[tuple], Dict[str, List[tuple]], Dict[str, int]]:
+        entries, by_song, weights = [], {}, {}
+        with found.db_connection() as conn:
+            for row in conn.execute("SELECT uuid, song_title, author, tags, query_count FROM songs"):
+                by_song[row['uuid']] = song_entries(row)
+                entries.extend(by_song[row['uuid']])
+                weights[row['uuid']] = row['query_count'] or 0
+        entries.sort()
+        return entries, by_song, weights
+
+    def rebuild(self) -> int:
+        """全量重建，返回条目数；读取期间发生的变更由之后的 refresh 补上"""
+        with self._lock:
+            self._rebuilding = True
+        try:
+            seq = found.song_change_seq()  # 先取序号再读取，之后的变更必定在日志中
+            entries, by_song, weights = self._load()
+        except BaseException:
+            with self._lock:
+                self._rebuilding = False
+            raise
+        with self._lock:
+            self._entries, self._by_song, self._weights = entries, by_song, weights
+            self._prefix_cache.clear()
+            self._built_at = time.monotonic()
+            self._rebuilding = False
+            self._seq = seq
+            self._build += 1
+        return len(entries)
+
+    def _schedule_rebuild(self) -> None:
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True  # 占位，避免重复启动
+        threading.Thread(target=self._background_rebuild, name="autocomplete-rebuild", daemon=True).start()
+
+    def _background_rebuild(self) -> None:
+        try:
+            self.rebuild()
+        except sqlite3.Error:
+            pass  # 数据库暂时不可用，下次到期时再重建
+
+    def refresh(self) -> None:
+        """按歌曲变更日志追上自上次以来（任何进程）的写入；变更过多或日志已剪掉时改为后台全量重建"""
+        with self._lock:
+            if self._built_at is None or self._rebuilding:
+                return  # 建立完成后再追
+            seq = self._seq
+        latest, song_uuids = found.song_changes_since(seq)
+        if latest == seq:
+            return
+        if song_uuids is None or len(song_uuids) > AUTOCOMPLETE_INCREMENTAL_MAX:
+            self._schedule_rebuild()
+            return
+        self._update_songs(song_uuids, latest)
+
+    def _update_songs(self, song_uuids: List[str], seq: int) -> None:
+        """增量更新指定歌曲的条目（新增、编辑；查不到的歌曲视为已删除），完成后索引反映到 seq"""
+        with self._lock:
+            build = self._build
+        with found.db_connection() as conn:
+            rows = conn.execute("""
+                SELECT uuid, song_title, author, tags, query_count FROM songs
+                WHERE uuid IN (SELECT value FROM json_each(?))
+            """, (json.dumps(song_uuids),)).fetchall()
+        rows_by_uuid = {row['uuid']: row for row in rows}
+
+        with self._lock:
+            if build != self._build or seq <= self._seq:
+                return  # 期间已全量重建或已被其他线程追上
+            self._seq = seq
+            changed_keys = set()
+            for song_uuid in song_uuids:
+                for entry in self._by_song.pop(song_uuid, []):
+                    i = bisect.bisect_left(self._entries, entry)
+                    if i < len(self._entries) and self._entries[i] == entry:
+                        del self._entries[i]
+                    changed_keys.add(entry[0])
+                self._weights.pop(song_uuid, None)
+                row = rows_by_uuid.get(song_uuid)
+                if row is None:
+                    continue
+                self._by_song[song_uuid] = song_entries(row)
+                self._weights[song_uuid] = row['query_count'] or 0
+                for entry in self._by_song[song_uuid]:
+                    bisect.insort(self._entries, entry)
+                    changed_keys.add(entry[0])
+            # 重算受影响的缓存前缀（缓存的都是短前缀，数量有限），之后的查询仍只读缓存
+            for prefix in [p for p in self._prefix_cache if any(key.startswith(p) for key in changed_keys)]:
+                lo, hi = self._range(prefix)
+                if hi - lo > AUTOCOMPLETE_SCAN_LIMIT:
+                    self._prefix_cache[prefix] = self._rank(lo, hi, AUTOCOMPLETE_MAX_LIMIT)
+                else:
+                    del self._prefix_cache[prefix]
+
+    def _range(self, prefix: str) -> Tuple[int, int]:
+        return (
+            bisect.bisect_left(self._entries, (prefix,)),
+            bisect.bisect_left(self._entries, (prefix + KEY_END,))
+        )
+
+    def _rank(self, lo: int, hi: int, limit: int) -> List[tuple]:
+        """范围内按显示文本汇总权重（每首歌计一次），返回 [((字段, 文本), 分数)]"""
+        scores: Dict[tuple, int] = {}
+        seen = set()
+        for _, song_uuid, field, label in self._entries[lo:hi]:
+            if (song_uuid, field, label) in seen:
+                continue
+            seen.add((song_uuid, field, label))
+            scores[(field, label)] = scores.get((field, label), 0) + self._weights.get(song_uuid, 0) + 1
+        return heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], item[0][1]))
+
+    def suggest(self, prefix: str, limit: int = AUTOCOMPLETE_LIMIT) -> List[Dict[str, Any]]:
+        """前缀补全：[{"text", "field", "weight"}]，按加权查询次数由高到低"""
+        prefix = normalize(prefix)
+        limit = max(1, min(int(limit), AUTOCOMPLETE_MAX_LIMIT))
+        if not prefix:
+            return []
+        if self._built_at is None:
+            self._schedule_rebuild()
+            return []
+        if time.monotonic() - self._built_at > AUTOCOMPLETE_REFRESH_INTERVAL:
+            self._schedule_rebuild()
+        self.refresh()
+
+        with self._lock:
+            lo, hi = self._range(prefix)
+            if hi - lo <= AUTOCOMPLETE_SCAN_LIMIT:
+                ranked = self._rank(lo, hi, limit)
+            else:
+                ranked = self._prefix_cache.get(prefix)
+                if ranked is None:
+                    ranked = self._prefix_cache[prefix] = self._rank(lo, hi, AUTOCOMPLETE_MAX_LIMIT)
+        return [
+            {"text": label, "field": field, "weight": score}
+            for (field, label), score in ranked[:limit]
+        ]
+
+    def warm(self) -> None:
+        """尚未建立时在后台开始建立（打开搜索页时调用，输入前就绪）"""
+        if self._built_at is None:
+            self._schedule_rebuild()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "songs": len(self._by_song),
+                "cached_prefixes": len(self._prefix_cache),
+                "romanization": available_romanization(),
+            }
+
+
+index = AutocompleteIndex()
+
+
+def suggest(prefix: str, limit: int = AUTOCOMPLETE_LIMIT) -> List[Dict[str, Any]]:
+    return index.suggest(prefix, limit)
@@ -0,0 +1,546 @@
+import os
+import stat
+import json
+import time
+import uuid
+import zlib
+import struct
+import hashlib
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# ========================
+# 歌单导出 (流式 ZIP)
+# ========================
+EXPORT_CHUNK_SIZE = 64 * 1024  # 每次读取 / 输出的字节数
+
+# 已压缩的音频格式直接存储，再压缩只会浪费 CPU；文本与图片使用 DEFLATE
+STORED_EXTENSIONS = {'.mp3', '.flac', '.ogg', '.oga', '.opus', '.m4a', '.aac', '.wma'}
+DEFLATED_EXTENSIONS = {
+    '.txt', '.lrc', '.md', '.csv', '.json', '.xml', '.html', '.musicxml',
+    '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.svg', '.tif', '.tiff',
+}
+
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+
+def compress_type_for(file_path: str) -> int:
+    """按扩展名选择压缩方式：文本与图片 DEFLATE，其余（含已压缩音频）STORED"""
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext in DEFLATED_EXTENSIONS:
+        return ZIP_DEFLATED
+    return ZIP_STORED
+
+
+# ========================
+# 只追加的 ZIP 写入器
+# ========================
+# 输出是一次性的字节流（HTTP 响应 / 文件），不能回头改写本地文件头：
+# 大小与 CRC 已知的条目直接写在本地文件头中；边读边压缩的条目在数据后附加数据描述符。
+# 单个条目、偏移或条目数超过限制时使用 Zip64（门槛与标准库 zipfile 相同，取有符号 32 位上限）。
+ZIP64_LIMIT = (1 << 31) - 1
+ZIP_MAX_ENTRIES = 0xFFFF
+ZIP_FLAG_DATA_DESCRIPTOR = 0x08
+ZIP_FLAG_UTF8 = 0x800
+ZIP_VERSION = 20
+ZIP64_VERSION = 45
+
+_LOCAL_HEADER = struct.Struct('<4sHHHHHLLLHH')
+_CENTRAL_HEADER = struct.Struct('<4sHHHHHHLLLHHHHHLL')
+_END_RECORD = struct.Struct('<4sHHHHLLH')
+_ZIP64_END_RECORD = struct.Struct('<4sQHHLLQQQQ')
+_ZIP64_END_LOCATOR = struct.Struct('<4sLQL')
+
+
+def _dos_datetime(timestamp: float) -> Tuple[int, int]:
+    """ZIP 使用的 MS-DOS (时间, 日期)；早于 1980 年的按 1980-01-01 记录"""
+    year, month, day, hour, minute, second = time.localtime(timestamp)[:6]
+    if year < 1980:
+        year, month, day, hour, minute, second = 1980, 1, 1, 0, 0, 0
+    return (hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day
+
+
+def _zip64_extra(*values: int) -> bytes:
+    return struct.pack(f'<HH{len(values)}Q', 0x0001, 8 * len(values), *values) if values else b''
+
+
+class _ZipEntry:
+    """已写出的条目，写中央目录时使用"""
+
+    def __init__(self, name: bytes, flags: int, method: int, dos_time: Tuple[int, int],
+                 external_attr: int, offset: int):
+        self.name = name
+        self.flags = flags
+        self.method = method
+        self.dos_time = dos_time
+        self.external_attr = external_attr
+        self.offset = offset
+        self.crc = 0
+        self.compress_size = 0
+        self.file_size = 0
+        self.zip64 = False
+
+
+class _ZipEntryStream:
+    """边读边写的条目：write() 返回压缩后的数据，close() 返回数据描述符"""
+
+    def __init__(self, writer: '_ZipWriter', entry: _ZipEntry):
+        self._writer = writer
+        self._entry = entry
+        self._compressor = (
+            zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+            if entry.method == ZIP_DEFLATED else None
+        )
+
+    def write(self, data: bytes) -> bytes:
+        entry = self._entry
+        entry.crc = zlib.crc32(data, entry.crc)
+        entry.file_size += len(data)
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        entry.compress_size += len(data)
+        self._writer.offset += len(data)
+        return data
+
+    def close(self) -> bytes:
+        entry = self._entry
+        data = self._compressor.flush() if self._compressor is not None else b''
+        entry.compress_size += len(data)
+        if not entry.zip64 and (entry.file_size > ZIP64_LIMIT or entry.compress_size > ZIP64_LIMIT):
+            raise RuntimeError(f"{entry.name.decode('utf-8')} 读取期间变大，超过了非 Zip64 条目的上限")
+        if entry.zip64:
+            data += struct.pack('<4sLQQ', b'PK\x07\x08', entry.crc, entry.compress_size, entry.file_size)
+        else:
+            data += struct.pack('<4sLLL', b'PK\x07\x08', entry.crc, entry.compress_size, entry.file_size)
+        self._writer.offset += len(data)
+        return data
+
+
+class _ZipWriter:
+    """
+    只追加的 ZIP 写入器：各方法返回应输出的字节，由调用方依序写出。
+    add() 写入大小与 CRC 已知（数据已压缩好）的条目；open() 开始一个边读边写的条目；finish() 返回中央目录。
+    """
+
+    def __init__(self):
+        self.offset = 0
+        self._entries: List[_ZipEntry] = []
+
+    def _begin(self, arcname: str, method: int, mtime: float, mode: int, flags: int) -> _ZipEntry:
+        # 与 zipfile 相同：统一使用 / 分隔，去掉盘符与开头的 /，非 ASCII 文件名以 UTF-8 编码并设置标志位
+        name = os.path.splitdrive(arcname)[1].replace(os.sep, '/').lstrip('/')
+        try:
+            encoded = name.encode('ascii')
+        except UnicodeEncodeError:
+            encoded = name.encode('utf-8')
+            flags |= ZIP_FLAG_UTF8
+        entry = _ZipEntry(encoded, flags, method, _dos_datetime(mtime), (mode & 0xFFFF) << 16, self.offset)
+        self._entries.append(entry)
+        return entry
+
+    def _local_header(self, entry: _ZipEntry, crc: int, compress_size: int, file_size: int) -> bytes:
+        extra = b''
+        if entry.zip64:
+            extra = _zip64_extra(file_size, compress_size)
+            compress_size = file_size = 0xFFFFFFFF
+        header = _LOCAL_HEADER.pack(
+            b'PK\x03\x04', ZIP64_VERSION if entry.zip64 else ZIP_VERSION, entry.flags, entry.method,
+            entry.dos_time[0], entry.dos_time[1], crc, compress_size, file_size, len(entry.name), len(extra)
+        ) + entry.name + extra
+        self.offset += len(header)
+        return header
+
+    def add(self, arcname: str, payload: bytes, method: int, crc: int, file_size: int,
+            mtime: float, mode: int = 0o600) -> bytes:
+        entry = self._begin(arcname, method, mtime, mode, 0)
+        entry.crc, entry.compress_size, entry.file_size = crc, len(payload), file_size
+        entry.zip64 = file_size > ZIP64_LIMIT or len(payload) > ZIP64_LIMIT
+        header = self._local_header(entry, crc, len(payload), file_size)
+        self.offset += len(payload)
+        return header + payload
+
+    def open(self, arcname: str, method: int, mtime: float, mode: int,
+             size_hint: int) -> Tuple[bytes, _ZipEntryStream]:
+        """开始边读边写的条目，返回 (本地文件头, 条目写入器)；size_hint 为文件大小，决定是否预先启用 Zip64"""
+        entry = self._begin(arcname, method, mtime, mode, ZIP_FLAG_DATA_DESCRIPTOR)
+        entry.zip64 = size_hint * 1.05 > ZIP64_LIMIT  # 与 zipfile 相同，为不可压缩数据的膨胀留余量
+        header = self._local_header(entry, 0, 0, 0)
+        return header, _ZipEntryStream(self, entry)
+
+    def finish(self) -> bytes:
+        """中央目录与目录结束记录"""
+        parts = []
+        start = self.offset
+        for entry in self._entries:
+            zip64_values = []
+            file_size, compress_size, offset = entry.file_size, entry.compress_size, entry.offset
+            if file_size > ZIP64_LIMIT or compress_size > ZIP64_LIMIT:
+                zip64_values += [file_size, compress_size]
+                file_size = compress_size = 0xFFFFFFFF
+            if offset > ZIP64_LIMIT:
+                zip64_values.append(offset)
+                offset = 0xFFFFFFFF
+            extra = _zip64_extra(*zip64_values)
+            version = ZIP64_VERSION if extra or entry.zip64 else ZIP_VERSION
+            parts.append(_CENTRAL_HEADER.pack(
+                b'PK\x01\x02', (3 << 8) | version, version, entry.flags, entry.method,
+                entry.dos_time[0], entry.dos_time[1], entry.crc, compress_size, file_size,
+                len(entry.name), len(extra), 0, 0, 0, entry.external_attr, offset
+            ) + entry.name + extra)
+        size = sum(len(part) for part in parts)
+        count = len(self._entries)
+        if count > ZIP_MAX_ENTRIES or size > ZIP64_LIMIT or start > ZIP64_LIMIT:
+            parts.append(_ZIP64_END_RECORD.pack(
+                b'PK\x06\x06', _ZIP64_END_RECORD.size - 12, ZIP64_VERSION, ZIP64_VERSION,
+                0, 0, count, count, size, start
+            ))
+            parts.append(_ZIP64_END_LOCATOR.pack(b'PK\x06\x07', 0, start + size, 1))
+        parts.append(_END_RECORD.pack(
+            b'PK\x05\x06', 0, 0, min(count, ZIP_MAX_ENTRIES), min(count, ZIP_MAX_ENTRIES),
+            min(size, 0xFFFFFFFF), min(start, 0xFFFFFFFF), 0
+        ))
+        data = b''.join(parts)
+        self.offset += len(data)
+        return data
+
+
+class ExportStats:
+    """单次导出的统计：文件数、缺失数、字节数以及各阶段累计耗时（秒）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.files = 0
+        self.missing = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.stat_time = 0.0
+        self.read_time = 0.0
+        self.compress_time = 0.0
+        self.total_time = 0.0
+
+    def add(self, **values) -> None:
+        with self._lock:
+            for name, value in values.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "files": self.files,
+                "missing": self.missing,
+                "bytes_read": self.bytes_read,
+                "bytes_written": self.bytes_written,
+                "stat_time": round(self.stat_time, 4),
+                "read_time": round(self.read_time, 4),
+                "compress_time": round(self.compress_time, 4),
+                "total_time": round(self.total_time, 4),
+            }
+
+
+# ========================
+# 并行预读与压缩
+# ========================
+# 线程池预先完成 stat / 读取 / CRC / DEFLATE，主线程按原顺序写入压缩包，
+# 保证输出顺序固定。超过 EXPORT_PREFETCH_MAX_BYTES 的大文件不进内存，仍在主线程流式写入；
+# 同时在途的文件数不超过 EXPORT_PREFETCH_WINDOW，每个导出的预读内存约为两者之积（默认 16 MB），
+# 与流式导出的常量内存目标一致。
+EXPORT_WORKERS = 4
+EXPORT_PREFETCH_WINDOW = EXPORT_WORKERS * 2
+EXPORT_PREFETCH_MAX_BYTES = 2 * 1024 * 1024
+MISSING_MANIFEST_NAME = 'missing_files.txt'
+
+_export_executor: Optional[ThreadPoolExecutor] = None
+_export_executor_lock = threading.Lock()
+
+
+def get_export_executor() -> ThreadPoolExecutor:
+    """获取常驻的导出线程池（首次使用时创建）"""
+    global _export_executor
+    with _export_executor_lock:
+        if _export_executor is None:
+            _export_executor = ThreadPoolExecutor(
+                max_workers=EXPORT_WORKERS, thread_name_prefix='playlist-export'
+            )
+        return _export_executor
+
+
+class _PreparedMember:
+    """线程池处理后的条目：缺失 / 大文件（待流式写入）/ 已压缩好的数据"""
+
+    def __init__(self, file_path: str, arcname: str):
+        self.file_path = file_path
+        self.arcname = arcname
+        self.method = ZIP_STORED
+        self.mtime = 0.0
+        self.mode = 0
+        self.crc = 0
+        self.file_size = 0
+        self.payload: Optional[bytes] = None
+        self.missing = False
+
+
+def _prepare_member(file_path: str, arcname: str, stats: ExportStats) -> _PreparedMember:
+    member = _PreparedMember(file_path, arcname)
+    start = time.perf_counter()
+    try:
+        st = os.stat(file_path) if file_path else None
+    except OSError:
+        st = None
+    stat_done = time.perf_counter()
+    stats.add(stat_time=stat_done - start)
+    if st is None or stat.S_ISDIR(st.st_mode):
+        member.missing = True
+        return member
+    member.method = compress_type_for(file_path)
+    member.mtime = st.st_mtime
+    member.mode = st.st_mode
+    member.file_size = st.st_size  # 大文件据此决定是否启用 Zip64
+    if st.st_size > EXPORT_PREFETCH_MAX_BYTES:
+        return member
+
+    try:
+        with open(file_path, 'rb') as src:
+            data = src.read()
+    except OSError:
+        member.missing = True
+        return member
+    read_done = time.perf_counter()
+
+    # zlib 在压缩 / 计算 CRC 时会释放 GIL，多线程可真正并行
+    member.crc = zlib.crc32(data)
+    member.file_size = len(data)
+    if member.method == ZIP_DEFLATED:
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        member.payload = compressor.compress(data) + compressor.flush()
+    else:
+        member.payload = data
+    stats.add(
+        read_time=read_done - stat_done,
+        compress_time=time.perf_counter() - read_done,
+        bytes_read=len(data)
+    )
+    return member
+
+
+def _prepared_members(
+    members: Iterable[Tuple[str, str]],
+    stats: ExportStats
+) -> Iterator[_PreparedMember]:
+    """在线程池中预处理条目，按提交顺序产出，同时在途数量不超过预读窗口"""
+    executor = get_export_executor()
+    window = deque()
+    for file_path, arcname in members:
+        window.append(executor.submit(_prepare_member, file_path, arcname, stats))
+        if len(window) >= EXPORT_PREFETCH_WINDOW:
+            yield window.popleft().result()
+    while window:
+        yield window.popleft().result()
+
+
+def stream_zip(
+    members: Iterable[Tuple[str, str]],
+    chunk_size: int = EXPORT_CHUNK_SIZE,
+    stats: Optional[ExportStats] = None,
+    manifest_dir: str = ''
+) -> Iterator[bytes]:
+    """
+    逐块生成 ZIP 内容，members 为 (文件路径, 压缩包内路径)。
+    内存占用有上限；单个文件或整个压缩包超过 4GB 时自动使用 Zip64。
+    找不到的文件会记录在 manifest_dir 下的 missing_files.txt 中，而不是静默略过。
+    """
+    if stats is None:
+        stats = ExportStats()
+    started = time.perf_counter()
+    missing = []
+    writer = _ZipWriter()
+    for member in _prepared_members(members, stats):
+        if member.missing:
+            missing.append(member)
+            stats.add(missing=1)
+            continue
+        if member.payload is not None:
+            data = writer.add(
+                member.arcname, member.payload, member.method, member.crc,
+                member.file_size, member.mtime, member.mode
+            )
+            stats.add(bytes_written=len(data))
+            yield data
+        else:
+            # 大文件：边读边压缩写入。先打开文件再写本地文件头，
+            # stat 之后才被删除的文件与其他缺失文件一样记入清单，不会留下写了一半的条目
+            try:
+                src = open(member.file_path, 'rb')
+            except OSError:
+                missing.append(member)
+                stats.add(missing=1)
+                continue
+            with src:
+                header, entry = writer.open(
+                    member.arcname, member.method, member.mtime, member.mode, member.file_size
+                )
+                stats.add(bytes_written=len(header))
+                yield header
+                while True:
+                    read_start = time.perf_counter()
+                    chunk = src.read(chunk_size)
+                    compress_start = time.perf_counter()
+                    if not chunk:
+                        break
+                    data = entry.write(chunk)
+                    stats.add(
+                        read_time=compress_start - read_start,
+                        compress_time=time.perf_counter() - compress_start,
+                        bytes_read=len(chunk)
+                    )
+                    if data:
+                        stats.add(bytes_written=len(data))
+                        yield data
+            data = entry.close()
+            stats.add(bytes_written=len(data))
+            yield data
+        stats.add(files=1)
+
+    if missing:
+        lines = [f"{m.arcname}\t{m.file_path or ''}" for m in missing]
+        text = ("\n".join(lines) + "\n").encode('utf-8')
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        data = writer.add(
+            os.path.join(manifest_dir, MISSING_MANIFEST_NAME),
+            compressor.compress(text) + compressor.flush(), ZIP_DEFLATED,
+            zlib.crc32(text), len(text), time.time()
+        )
+        stats.add(bytes_written=len(data))
+        yield data
+    # 写出中央目录
+    data = writer.finish()
+    stats.add(bytes_written=len(data))
+    yield data
+    stats.add(total_time=time.perf_counter() - started)
+
+
+def playlist_members(playlist_name: str, songs: Iterable[dict]) -> Iterator[Tuple[str, str]]:
+    """列出歌单中的歌曲文件，放入以歌单名称命名的资料夹（缺失的文件由 stream_zip 记录）"""
+    for song in songs:
+        file_path = song.get('path') or ''
+        file_name = os.path.basename(file_path) if file_path else (song.get('song_title') or song.get('uuid'))
+        yield file_path, os.path.join(playlist_name, file_name)
+
+
+# ========================
+# 导出缓存 (按内容寻址)
+# ========================
+# 缓存键由歌单 id、名称、有序歌曲 uuid 及各文件的路径 / 大小 / 修改时间计算得出，
+# 内容一变键就变，因此命中的缓存一定是最新的；失效操作只是提早回收磁盘空间。
+EXPORT_CACHE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance', 'export_cache'
+)
+EXPORT_CACHE_MAX_BYTES = 2 * 1024 ** 3  # 超过后按最近使用时间淘汰
+
+_cache_lock = threading.Lock()
+
+
+def export_cache_key(playlist_id: int, playlist_name: str, songs: Iterable[dict]) -> str:
+    """计算导出内容的哈希，作为缓存文件名与 ETag"""
+    entries = []
+    for song in songs:
+        file_path = song.get('path')
+        try:
+            st = os.stat(file_path) if file_path else None
+        except OSError:
+            st = None
+        entries.append([
+            song.get('uuid'), file_path,
+            st.st_size if st else None, st.st_mtime_ns if st else None
+        ])
+    payload = json.dumps([playlist_id, playlist_name, entries], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _cache_file(playlist_id: int, key: str) -> str:
+    return os.path.join(EXPORT_CACHE_DIR, f"{playlist_id}_{key}.zip")
+
+
+def cached_export_path(playlist_id: int, key: str) -> Optional[str]:
+    """返回已缓存的压缩包路径并刷新其使用时间；未命中返回 None"""
+    path = _cache_file(playlist_id, key)
+    try:
+        os.utime(path)  # 以 mtime 记录最近使用时间，供 LRU 淘汰
+    except OSError:
+        return None
+    return path
+
+
+def cache_stream(playlist_id: int, key: str, chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    边输出边写入缓存临时文件，完整输出后再原子改名为正式缓存；
+    客户端中途断开时丢弃临时文件。
+    """
+    os.makedirs(EXPORT_CACHE_DIR, exist_ok=True)
+    tmp_path = os.path.join(EXPORT_CACHE_DIR, f".{uuid.uuid4().hex}.tmp")
+    completed = False
+    try:
+        with open(tmp_path, 'wb') as cache_file:
+            for chunk in chunks:
+                cache_file.write(chunk)
+                yield chunk
+        invalidate_playlist_exports(playlist_id)
+        os.replace(tmp_path, _cache_file(playlist_id, key))
+        completed = True
+        enforce_export_cache_limit()
+    finally:
+        if not completed:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+
+def invalidate_playlist_exports(playlist_id: int) -> int:
+    """删除某个歌单的所有缓存压缩包，返回删除的文件数"""
+    removed = 0
+    prefix = f"{playlist_id}_"
+    with _cache_lock:
+        try:
+            names = os.listdir(EXPORT_CACHE_DIR)
+        except OSError:
+            return 0
+        for name in names:
+            if name.startswith(prefix) and name.endswith('.zip'):
+                try:
+                    os.remove(os.path.join(EXPORT_CACHE_DIR, name))
+                    removed += 1
+                except OSError:
+                    pass
+    return removed
+
+
+def enforce_export_cache_limit(max_bytes: Optional[int] = None) -> None:
+    """缓存总量超过上限（默认 EXPORT_CACHE_MAX_BYTES）时，从最久未使用的压缩包开始删除"""
+    if max_bytes is None:
+        max_bytes = EXPORT_CACHE_MAX_BYTES
+    with _cache_lock:
+        try:
+            names = [n for n in os.listdir(EXPORT_CACHE_DIR) if n.endswith('.zip')]
+        except OSError:
+            return
+        entries: List[Tuple[float, int, str]] = []
+        for name in names:
+            path = os.path.join(EXPORT_CACHE_DIR, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
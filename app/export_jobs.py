@@ -0,0 +1,271 @@
+import os
+import time
+import uuid
+import socket
+import threading
+import sqlite3
+from typing import Any, Dict, Optional
+
+from app import found
+from app import export
+
+# ========================
+# 异步导出任务
+# ========================
+# 任务记录在 SQLite 的 export_jobs 表中，每个进程的后台线程依序领取执行（多个 gunicorn 进程共用一张表）。
+# 领取时写入 owner（主机名:pid），执行期间由心跳线程定期刷新 updated_at；
+# 心跳超过 EXPORT_JOB_STALE_AFTER 未更新的 running 任务视为所属进程已退出，重新排队。
+# 领取用 BEGIN IMMEDIATE + SELECT + UPDATE，不依赖 UPDATE ... RETURNING（SQLite 3.35+）。
+EXPORT_JOB_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance', 'export_jobs'
+)
+EXPORT_JOB_POLL_INTERVAL = 5.0        # 没有新任务通知时的轮询间隔（秒）
+EXPORT_JOB_PROGRESS_INTERVAL = 0.5    # 进度写回数据库的最小间隔（秒）
+EXPORT_JOB_TTL = 24 * 3600            # 已结束任务及其压缩包的保留时间（秒）
+EXPORT_JOB_HEARTBEAT_INTERVAL = 30.0  # 执行中任务刷新 updated_at 的间隔（秒）
+EXPORT_JOB_STALE_AFTER = 120.0        # running 任务心跳超过该时间未更新即重新排队（秒）
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+_worker: Optional[threading.Thread] = None
+_worker_lock = threading.Lock()
+_wakeup = threading.Event()
+_tables_ready = False
+
+
+def ensure_job_table(conn: sqlite3.Connection) -> None:
+    global _tables_ready
+    if _tables_ready:
+        return
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS export_jobs (
+            job_id TEXT PRIMARY KEY,
+            playlist_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued'
+                CHECK(status IN ('queued', 'running', 'done', 'failed')),
+            files_total INTEGER NOT NULL DEFAULT 0,
+            files_done INTEGER NOT NULL DEFAULT 0,
+            bytes_written INTEGER NOT NULL DEFAULT 0,
+            artifact_path TEXT,
+            download_name TEXT,
+            error TEXT,
+            owner TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    """)
+    columns = {row['name'] for row in conn.execute("PRAGMA table_info(export_jobs)")}
+    if 'owner' not in columns:  # 旧版本建立的表
+        conn.execute("ALTER TABLE export_jobs ADD COLUMN owner TEXT")
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_export_jobs_status
+        ON export_jobs(status, created_at)
+    """)
+    conn.commit()
+    _tables_ready = True
+
+
+def enqueue_export(playlist_id: int, user_id: int) -> str:
+    """建立导出任务并唤醒后台线程，返回任务 id（调用方需先完成歌单所有权验证）"""
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    with found.db_connection() as conn:
+        ensure_job_table(conn)
+        conn.execute("""
+            INSERT INTO export_jobs (job_id, playlist_id, user_id, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, (job_id, playlist_id, user_id, now, now))
+    start_worker()
+    _wakeup.set()
+    return job_id
+
+
+def get_job(job_id: str, user_id: int) -> Optional[Dict[str, Any]]:
+    """查询任务进度；只返回属于该用户的任务"""
+    start_worker()  # 进程重启后，第一次轮询即恢复未完成的任务
+    with found.db_connection() as conn:
+        ensure_job_table(conn)
+        row = conn.execute(
+            "SELECT * FROM export_jobs WHERE job_id = ? AND user_id = ?",
+            (job_id, user_id)
+        ).fetchone()
+    return dict(row) if row else None
+
+
+def _update_job(job_id: str, **fields) -> bool:
+    """更新本进程领取的任务；任务已被重新排队、转给其他进程时不做修改并返回 False"""
+    fields['updated_at'] = time.time()
+    set_clause = ", ".join(f"{k} = ?" for k in fields)
+    with found.db_connection() as conn:
+        cursor = conn.execute(
+            f"UPDATE export_jobs SET {set_clause} WHERE job_id = ? AND owner = ?",
+            list(fields.values()) + [job_id, WORKER_ID]
+        )
+    return cursor.rowcount > 0
+
+
+def _claim_next_job() -> Optional[Dict[str, Any]]:
+    """原子地取出最早排队的任务，标记为 running 并记下本进程为 owner"""
+    with found.db_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")  # 先取得写锁，其他进程无法在 SELECT 与 UPDATE 之间领走同一任务
+        row = conn.execute("""
+            SELECT * FROM export_jobs
+            WHERE status = 'queued'
+            ORDER BY created_at
+            LIMIT 1
+        """).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        conn.execute(
+            "UPDATE export_jobs SET status = 'running', owner = ?, updated_at = ? WHERE job_id = ?",
+            (WORKER_ID, now, row['job_id'])
+        )
+    job = dict(row)
+    job.update(status='running', owner=WORKER_ID, updated_at=now)
+    return job
+
+
+def _requeue_stale_jobs() -> None:
+    """把心跳过期（所属进程已退出）的 running 任务重新排队"""
+    with found.db_connection() as conn:
+        conn.execute("""
+            UPDATE export_jobs SET status = 'queued', owner = NULL
+            WHERE status = 'running' AND updated_at < ?
+        """, (time.time() - EXPORT_JOB_STALE_AFTER,))
+
+
+def _heartbeat(job_id: str, stop: threading.Event) -> None:
+    """执行期间定期刷新 updated_at，单个文件读取很慢时任务也不会被判为过期"""
+    while not stop.wait(EXPORT_JOB_HEARTBEAT_INTERVAL):
+        try:
+            _update_job(job_id)
+        except sqlite3.Error:
+            pass
+
+
+def _run_job(job: Dict[str, Any]) -> None:
+    job_id = job['job_id']
+    stop = threading.Event()
+    heartbeat = threading.Thread(
+        target=_heartbeat, args=(job_id, stop), name=f'export-job-{job_id[:8]}', daemon=True
+    )
+    heartbeat.start()
+    try:
+        _export_playlist(job)
+    finally:
+        stop.set()
+
+
+def _export_playlist(job: Dict[str, Any]) -> None:
+    job_id = job['job_id']
+    with found.db_connection() as conn:
+        playlist = conn.execute(
+            "SELECT name FROM playlists WHERE playlist_id = ? AND user_id = ?",
+            (job['playlist_id'], job['user_id'])
+        ).fetchone()
+    if not playlist:
+        _update_job(job_id, status='failed', error='歌單不存在或無權訪問')
+        return
+    playlist_name = playlist['name']
+    songs = found.get_songs(playlist_id=job['playlist_id'], limit=None)
+    if not songs:
+        _update_job(job_id, status='failed', error='歌單中沒有歌曲')
+        return
+
+    _update_job(job_id, files_total=len(songs), files_done=0, bytes_written=0)
+    os.makedirs(EXPORT_JOB_DIR, exist_ok=True)
+    artifact_path = os.path.join(EXPORT_JOB_DIR, f"{job_id}.zip")
+    tmp_path = f"{artifact_path}.{os.getpid()}.tmp"  # 任务被重新排队时，原进程与接手的进程不会写同一个文件
+    stats = export.ExportStats()
+    last_report = 0.0
+    try:
+        with open(tmp_path, 'wb') as out:
+            chunks = export.stream_zip(
+                export.playlist_members(playlist_name, songs),
+                stats=stats,
+                manifest_dir=playlist_name
+            )
+            for chunk in chunks:
+                out.write(chunk)
+                now = time.monotonic()
+                if now - last_report >= EXPORT_JOB_PROGRESS_INTERVAL:
+                    last_report = now
+                    _update_job(
+                        job_id,
+                        files_done=stats.files + stats.missing,
+                        bytes_written=stats.bytes_written
+                    )
+        os.replace(tmp_path, artifact_path)
+    except OSError as e:
+        _update_job(job_id, status='failed', error=str(e))
+        return
+    finally:
+        # 任何异常（含非 OSError）都不留下半成品；成功时已改名，这里找不到文件
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+    _update_job(
+        job_id,
+        status='done',
+        files_done=stats.files + stats.missing,
+        bytes_written=stats.bytes_written,
+        artifact_path=artifact_path,
+        download_name=f"{playlist_name}.zip"
+    )
+
+
+def _purge_expired_jobs() -> None:
+    """删除过期的已结束任务及其压缩包"""
+    cutoff = time.time() - EXPORT_JOB_TTL
+    with found.db_connection() as conn:
+        rows = conn.execute("""
+            SELECT job_id, artifact_path FROM export_jobs
+            WHERE status IN ('done', 'failed') AND updated_at < ?
+        """, (cutoff,)).fetchall()
+        for row in rows:
+            if row['artifact_path']:
+                try:
+                    os.remove(row['artifact_path'])
+                except OSError:
+                    pass
+        conn.executemany(
+            "DELETE FROM export_jobs WHERE job_id = ?",
+            [(row['job_id'],) for row in rows]
+        )
+
+
+def _worker_loop() -> None:
+    while True:
+        try:
+            _purge_expired_jobs()
+            _requeue_stale_jobs()
+            job = _claim_next_job()
+        except sqlite3.Error:
+            job = None
+        if job is None:
+            _wakeup.wait(EXPORT_JOB_POLL_INTERVAL)
+            _wakeup.clear()
+            continue
+        try:
+            _run_job(job)
+        except Exception as e:  # 单个任务失败不应让后台线程退出
+            try:
+                _update_job(job['job_id'], status='failed', error=str(e))
+            except sqlite3.Error:
+                pass
+
+
+def start_worker() -> None:
+    """启动后台导出线程；其他进程正在执行的任务不受影响，已退出进程遗留的任务由心跳过期判定后重新排队"""
+    global _worker
+    with _worker_lock:
+        if _worker is not None:
+            return
+        with found.db_connection() as conn:
+            ensure_job_table(conn)
+        _requeue_stale_jobs()
+        _worker = threading.Thread(target=_worker_loop, name='export-jobs', daemon=True)
+        _worker.start()
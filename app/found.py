@@ -1,10 +1,21 @@
 import sqlite3
 from typing import Optional, List, Dict, Any, Generator
 import os
+import json
 import uuid
+import html
 import hashlib
+import hmac
+import threading
+import time
+import heapq
+import atexit
+from collections import OrderedDict
 from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
 from difflib import SequenceMatcher
+from app import export
 
 # 数据库路径（当第二个参数为绝对路径时，os.path.join会返回该绝对路径）
 DB_PATH = os.path.join(os.path.dirname(__file__), r"D:\vscode\project\instance\music_library.db")
@@ -12,64 +23,672 @@ DB_PATH = os.path.join(os.path.dirname(__file__), r"D:\vscode\project\instance\m
 # ========================
 # 安全增强模块
 # ========================
+# 存储格式带版本前缀，便于日后升级算法：
+#   $scrypt$n=16384,r=8,p=1$<salt>$<hash>
+#   $pbkdf2-sha256$i=100000$<salt>$<hash>
+# 旧格式（无前缀，{hash}{salt} 各 64 个十六进制字符，PBKDF2-SHA256 100000 次）仍可验证，
+# 登录成功后会自动以 PASSWORD_SCHEME 重新哈希。
+PASSWORD_SCHEME = 'scrypt'  # 新密码使用的算法：'scrypt' 或 'pbkdf2-sha256'
+PBKDF2_ITERATIONS = 100000
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+PASSWORD_HASH_WORKERS = 2        # 专用于密码哈希的进程数
+PASSWORD_HASH_MAX_PENDING = 16   # 同时排队的哈希任务上限，超出时等待
+PASSWORD_HASH_TIMEOUT = 10.0     # 等待排队位置 / 结果的最长秒数
+
 class Security:
     @staticmethod
-    def hash_password(password: str, salt: Optional[bytes] = None) -> str:
-        """使用PBKDF2进行安全密码哈希，返回格式为：{hash}{salt}，各64字符"""
+    def hash_password(
+        password: str,
+        salt: Optional[bytes] = None,
+        scheme: Optional[str] = None,
+        n: Optional[int] = None,
+        r: Optional[int] = None,
+        p: Optional[int] = None,
+        iterations: Optional[int] = None
+    ) -> str:
+        """按 scheme（默认 PASSWORD_SCHEME）哈希密码，返回带版本前缀的字符串；未指定的参数取模块设置"""
         if salt is None:
             salt = os.urandom(32)
-        return hashlib.pbkdf2_hmac(
-            'sha256',
-            password.encode('utf-8'),
-            salt,
-            100000
-        ).hex() + salt.hex()
+        scheme = scheme or PASSWORD_SCHEME
+        if scheme == 'scrypt':
+            n, r, p = n or SCRYPT_N, r or SCRYPT_R, p or SCRYPT_P
+            digest = hashlib.scrypt(
+                password.encode('utf-8'), salt=salt, n=n, r=r, p=p, dklen=32
+            )
+            params = f"n={n},r={r},p={p}"
+        elif scheme == 'pbkdf2-sha256':
+            iterations = iterations or PBKDF2_ITERATIONS
+            digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+            params = f"i={iterations}"
+        else:
+            raise ValueError(f"不支持的密码哈希算法: {scheme}")
+        return f"${scheme}${params}${salt.hex()}${digest.hex()}"
 
     @staticmethod
     def verify_password(stored_hash: str, password: str) -> bool:
-        """验证密码与存储哈希是否匹配"""
+        """验证密码与存储哈希是否匹配（支持旧版无前缀格式）"""
         try:
-            hash_part = bytes.fromhex(stored_hash[:64])
-            salt = bytes.fromhex(stored_hash[64:])
-            new_hash = hashlib.pbkdf2_hmac(
-                'sha256',
-                password.encode('utf-8'),
-                salt,
-                100000
-            )
-            return hash_part == new_hash
+            if not stored_hash.startswith('$'):
+                hash_part = bytes.fromhex(stored_hash[:64])
+                salt = bytes.fromhex(stored_hash[64:])
+                new_hash = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, 100000)
+                return hmac.compare_digest(hash_part, new_hash)
+
+            _, scheme, params, salt_hex, hash_hex = stored_hash.split('$')
+            options = dict(item.split('=') for item in params.split(','))
+            salt = bytes.fromhex(salt_hex)
+            expected = bytes.fromhex(hash_hex)
+            if scheme == 'scrypt':
+                new_hash = hashlib.scrypt(
+                    password.encode('utf-8'), salt=salt,
+                    n=int(options['n']), r=int(options['r']), p=int(options['p']),
+                    dklen=len(expected)
+                )
+            elif scheme == 'pbkdf2-sha256':
+                new_hash = hashlib.pbkdf2_hmac(
+                    'sha256', password.encode('utf-8'), salt, int(options['i'])
+                )
+            else:
+                return False
+            return hmac.compare_digest(expected, new_hash)
         except Exception:
             return False
 
+    @staticmethod
+    def needs_rehash(stored_hash: str) -> bool:
+        """存储的哈希是否与当前配置的算法 / 参数不同"""
+        if PASSWORD_SCHEME == 'scrypt':
+            current = f"$scrypt$n={SCRYPT_N},r={SCRYPT_R},p={SCRYPT_P}$"
+        else:
+            current = f"$pbkdf2-sha256$i={PBKDF2_ITERATIONS}$"
+        return not stored_hash.startswith(current)
+
+
+# 哈希运算交给专用进程池，避免 CPU 密集的计算占住处理请求的线程
+_password_executor: Optional[ProcessPoolExecutor] = None
+_password_executor_lock = threading.Lock()
+_password_slots = threading.BoundedSemaphore(PASSWORD_HASH_MAX_PENDING)
+
+
+def _get_password_executor() -> ProcessPoolExecutor:
+    global _password_executor
+    with _password_executor_lock:
+        if _password_executor is None:
+            _password_executor = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS)
+        return _password_executor
+
+
+def _discard_password_executor(executor: ProcessPoolExecutor) -> None:
+    """丢弃损坏 / 卡住的进程池，下次使用时重建"""
+    global _password_executor
+    with _password_executor_lock:
+        if _password_executor is executor:
+            _password_executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _run_password_task(func, *args, **kwargs):
+    """在进程池中执行哈希任务；排队已满时等待，进程池损坏或超时时重建进程池并退回本线程计算"""
+    if not _password_slots.acquire(timeout=PASSWORD_HASH_TIMEOUT):
+        raise TimeoutError("密码验证请求过多，请稍后再试")
+    try:
+        executor = _get_password_executor()
+        try:
+            return executor.submit(func, *args, **kwargs).result(timeout=PASSWORD_HASH_TIMEOUT)
+        except (BrokenProcessPool, RuntimeError, FutureTimeout):
+            # BrokenProcessPool：工作进程被杀；RuntimeError：进程池已关闭；
+            # FutureTimeout：Python 3.10 的 concurrent.futures.TimeoutError 不是内置 TimeoutError
+            _discard_password_executor(executor)
+            return func(*args, **kwargs)
+    finally:
+        _password_slots.release()
+
+
+def hash_password_offloaded(password: str) -> str:
+    # 算法与参数在本进程读取后显式传入：spawn 方式启动的工作进程（如 Windows）
+    # 会重新导入本模块，读不到运行时修改过的设置
+    return _run_password_task(
+        Security.hash_password, password,
+        scheme=PASSWORD_SCHEME, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P, iterations=PBKDF2_ITERATIONS
+    )
+
+
+def verify_password_offloaded(stored_hash: str, password: str) -> bool:
+    return _run_password_task(Security.verify_password, stored_hash, password)
+
+
+@atexit.register
+def shutdown_password_executor() -> None:
+    global _password_executor
+    with _password_executor_lock:
+        if _password_executor is not None:
+            _password_executor.shutdown(wait=False, cancel_futures=True)
+            _password_executor = None
+
+
 # ========================
-# 数据库连接管理 (增强版)
+# 登录 / 注册限流
+# ========================
+LOGIN_LIMIT_PER_USERNAME = 10   # 每个用户名在时间窗口内允许的失败次数
+LOGIN_LIMIT_PER_IP = 30         # 每个 IP 在时间窗口内允许的登录失败次数（成功的登录不计，教室 / 办公室共用 NAT 也不受影响）
+REGISTER_LIMIT_PER_IP = 200     # 每个 IP 在时间窗口内允许的注册次数
+LOGIN_LIMIT_WINDOW = 300.0      # 时间窗口（秒）
+RATE_LIMIT_MAX_KEYS = 100000    # 记录的键数上限，超过时清理过期记录
+
+
+class RateLimiter:
+    """滑动窗口计数器：限制某个键在 window 秒内的次数"""
+
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+        self._hits: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def _recent(self, key: str, now: float) -> List[float]:
+        hits = [t for t in self._hits.get(key, []) if now - t < self.window]
+        if hits:
+            self._hits[key] = hits
+        else:
+            self._hits.pop(key, None)
+        return hits
+
+    def is_limited(self, key: str) -> bool:
+        with self._lock:
+            return len(self._recent(key, time.monotonic())) >= self.limit
+
+    def hit(self, key: str) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if len(self._hits) >= RATE_LIMIT_MAX_KEYS:
+                for stale in list(self._hits):
+                    self._recent(stale, now)
+            self._recent(key, now)
+            self._hits.setdefault(key, []).append(now)
+
+    def reset(self, key: str) -> None:
+        with self._lock:
+            self._hits.pop(key, None)
+
+
+username_limiter = RateLimiter(LOGIN_LIMIT_PER_USERNAME, LOGIN_LIMIT_WINDOW)
+ip_limiter = RateLimiter(LOGIN_LIMIT_PER_IP, LOGIN_LIMIT_WINDOW)
+register_limiter = RateLimiter(REGISTER_LIMIT_PER_IP, LOGIN_LIMIT_WINDOW)
+RATE_LIMITED_MESSAGE = "嘗試次數過多，請稍後再試"
+
 # ========================
+# 数据库连接管理 (连接池版)
+# ========================
+# 连接池参数：每个连接只在创建时配置一次 PRAGMA
+POOL_MAX_SIZE = 8            # 同时打开的最大连接数
+POOL_IDLE_TIMEOUT = 300.0    # 空闲超过该秒数的连接会被回收
+POOL_CHECKOUT_TIMEOUT = 10.0 # 连接池耗尽时的最长等待秒数
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024  # 256MB 内存映射
+SQLITE_CACHE_SIZE = -64000            # 负数表示 KiB，约 64MB 页缓存
+SQLITE_BUSY_TIMEOUT = 5000            # 毫秒
+SQLITE_STATEMENT_CACHE = 256          # 每条连接缓存的预编译语句数（按 SQL 文本命中）
+
+
+class ConnectionPool:
+    """
+    线程感知的 SQLite 连接池。
+    - 优先把线程上次归还的连接交还给同一线程（per-thread reuse）
+    - 连接总数受 max_size 限制，耗尽时阻塞等待
+    - 取出时做健康检查，空闲过久的连接会被回收
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        max_size: int = POOL_MAX_SIZE,
+        idle_timeout: float = POOL_IDLE_TIMEOUT,
+        checkout_timeout: float = POOL_CHECKOUT_TIMEOUT
+    ):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self._cond = threading.Condition()
+        self._idle: Dict[int, List[tuple]] = {}  # 线程 id -> [(conn, 归还时间)]
+        self._open = 0
+        self._in_use = 0
+        self._closed = False
+        # 统计指标
+        self._checkouts = 0
+        self._wait_time = 0.0
+        self._created = 0
+        self._evicted = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        """创建新连接并一次性完成 PRAGMA 配置"""
+        conn = sqlite3.connect(
+            self.db_path, check_same_thread=False, cached_statements=SQLITE_STATEMENT_CACHE
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA mmap_size = {int(SQLITE_MMAP_SIZE)}")
+        conn.execute(f"PRAGMA cache_size = {int(SQLITE_CACHE_SIZE)}")
+        conn.execute(f"PRAGMA busy_timeout = {int(SQLITE_BUSY_TIMEOUT)}")
+        conn.execute("PRAGMA foreign_keys = ON")  # 启用外键约束
+        return conn
+
+    @staticmethod
+    def _is_healthy(conn: sqlite3.Connection) -> bool:
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, conn: sqlite3.Connection) -> None:
+        """关闭连接并更新计数（调用方需持有锁）"""
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        self._open -= 1
+        self._cond.notify()
+
+    def _evict_idle(self, now: float) -> None:
+        """回收空闲超时的连接（调用方需持有锁）"""
+        for tid in list(self._idle):
+            kept = []
+            for conn, released_at in self._idle[tid]:
+                if now - released_at > self.idle_timeout:
+                    self._discard(conn)
+                    self._evicted += 1
+                else:
+                    kept.append((conn, released_at))
+            if kept:
+                self._idle[tid] = kept
+            else:
+                del self._idle[tid]
+
+    def _take_idle(self, tid: int) -> Optional[sqlite3.Connection]:
+        """优先取本线程的空闲连接，其次取其他线程的（调用方需持有锁）"""
+        if tid in self._idle:
+            owner = tid
+        elif self._idle:
+            owner = next(iter(self._idle))
+        else:
+            return None
+        conn, _ = self._idle[owner].pop()
+        if not self._idle[owner]:
+            del self._idle[owner]
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        tid = threading.get_ident()
+        start = time.monotonic()
+        deadline = start + self.checkout_timeout
+        with self._cond:
+            if self._closed:
+                raise sqlite3.OperationalError("连接池已关闭")
+            while True:
+                self._evict_idle(time.monotonic())
+                conn = self._take_idle(tid)
+                if conn is not None:
+                    if self._is_healthy(conn):
+                        break
+                    self._discard(conn)
+                    continue
+                if self._open < self.max_size:
+                    # 先占位再建连接，避免超出上限
+                    self._open += 1
+                    try:
+                        conn = self._connect()
+                    except sqlite3.Error:
+                        self._open -= 1
+                        self._cond.notify()
+                        raise
+                    self._created += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise sqlite3.OperationalError("连接池已耗尽，等待超时")
+                self._cond.wait(remaining)
+            self._in_use += 1
+            self._checkouts += 1
+            self._wait_time += time.monotonic() - start
+            return conn
+
+    def release(self, conn: sqlite3.Connection, discard: bool = False) -> None:
+        tid = threading.get_ident()
+        with self._cond:
+            self._in_use -= 1
+            if discard or self._closed:
+                self._discard(conn)
+                return
+            self._idle.setdefault(tid, []).append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def close(self) -> None:
+        """关闭所有空闲连接，借出中的连接在归还时关闭"""
+        with self._cond:
+            self._closed = True
+            for conns in self._idle.values():
+                for conn, _ in conns:
+                    self._discard(conn)
+            self._idle.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """连接池指标：借出次数、累计/平均等待时间、打开连接数"""
+        with self._cond:
+            return {
+                "checkouts": self._checkouts,
+                "wait_time_total": self._wait_time,
+                "wait_time_avg": self._wait_time / self._checkouts if self._checkouts else 0.0,
+                "open": self._open,
+                "in_use": self._in_use,
+                "idle": sum(len(c) for c in self._idle.values()),
+                "created": self._created,
+                "evicted": self._evicted,
+            }
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """获取全局连接池；DB_PATH 变更后自动重建"""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.db_path != DB_PATH:
+            if _pool is not None:
+                _pool.close()
+            _pool = ConnectionPool(DB_PATH)
+        return _pool
+
+
 @contextmanager
 def db_connection() -> Generator[sqlite3.Connection, None, None]:
     """
-    建立支持外键与事务管理的数据库连接。
-    退出时自动提交事务（若无异常），否则回滚。
+    从连接池借出支持外键与事务管理的数据库连接。
+    退出时自动提交事务（若无异常），否则回滚；连接归还连接池而非关闭。
     """
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = ON")  # 启用外键约束
+    pool = get_pool()
+    conn = pool.acquire()
+    broken = False
     try:
         yield conn
         conn.commit()  # 自动提交事务
-    except sqlite3.Error as e:
-        conn.rollback()
-        raise e
+    except BaseException:
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            broken = True
+        raise
     finally:
-        conn.close()
+        pool.release(conn, discard=broken)
+
+
+
+# ========================
+# 查询计数写回缓冲 (write-behind)
+# ========================
+QUERY_COUNT_FLUSH_INTERVAL = 5.0  # 定时写回间隔（秒）
+QUERY_COUNT_FLUSH_THRESHOLD = 500  # 待写回歌曲数达到该值时提前写回
+
+
+class QueryCountBuffer:
+    """
+    在内存中累积每首歌的查询次数增量，定时或达到阈值时用一个事务批量写回，
+    让搜索路径保持只读，避免每次搜索都抢 SQLite 写锁。热门排行因此是最终一致的。
+    """
+
+    def __init__(
+        self,
+        flush_interval: float = QUERY_COUNT_FLUSH_INTERVAL,
+        flush_threshold: int = QUERY_COUNT_FLUSH_THRESHOLD
+    ):
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self._pending: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # 保证同一时间只有一个写回事务
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def record(self, song_uuids: List[str]) -> None:
+        """累加查询次数；首次调用时启动后台写回线程"""
+        if not song_uuids:
+            return
+        with self._lock:
+            for song_uuid in song_uuids:
+                self._pending[song_uuid] = self._pending.get(song_uuid, 0) + 1
+            full = len(self._pending) >= self.flush_threshold
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="query-count-flusher", daemon=True
+                )
+                self._thread.start()
+        if full:
+            self._wakeup.set()
+
+    def pending(self) -> Dict[str, int]:
+        """尚未写回的增量快照"""
+        with self._lock:
+            return dict(self._pending)
+
+    def flush(self) -> int:
+        """把累积的增量写回数据库，返回写回的歌曲数；失败时增量合并回缓冲区"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+            try:
+                with db_connection() as conn:
+                    ensure_trending_tables(conn)
+                    conn.executemany(
+                        "UPDATE songs SET query_count = query_count + ? WHERE uuid = ?",
+                        [(count, song_uuid) for song_uuid, count in batch.items()]
+                    )
+                    record_query_stats(conn, batch)  # 写入滚动时间桶
+                    trending.apply_increments(conn, batch)
+            except sqlite3.Error:
+                with self._lock:
+                    for song_uuid, count in batch.items():
+                        self._pending[song_uuid] = self._pending.get(song_uuid, 0) + count
+                raise
+            return len(batch)
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except sqlite3.Error:
+                pass  # 数据库暂时不可用（如被锁），下一轮重试
+
+
+query_counter = QueryCountBuffer()
+
+
+@atexit.register
+def flush_query_counts() -> None:
+    """进程退出前写回剩余的查询计数"""
+    try:
+        query_counter.flush()
+    except sqlite3.Error:
+        pass
+
+
+# ========================
+# 热门歌曲排行
+# ========================
+# 全站热门：内存中维护 TRENDING_CACHE_SIZE 首歌的排行，随查询计数写回增量更新，
+# 并按 TRENDING_TTL 定期从数据库重新加载以纠正漂移。
+# 时段热门：song_query_stats 以 TRENDING_BUCKET_SECONDS 为粒度记录每首歌的查询次数，
+# 只保留 TRENDING_RETENTION 秒，按窗口求和排序。
+TRENDING_CACHE_SIZE = 50
+TRENDING_TTL = 60.0
+TRENDING_BUCKET_SECONDS = 600
+TRENDING_RETENTION = 7 * 24 * 3600
+TRENDING_WINDOWS = {'hour': 3600, 'day': 24 * 3600, 'week': 7 * 24 * 3600}
+
+_trending_tables_ready = False
+
+
+def ensure_trending_tables(conn: sqlite3.Connection) -> None:
+    """确保滚动计数表与 query_count 索引存在"""
+    global _trending_tables_ready
+    if _trending_tables_ready:
+        return
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS song_query_stats (
+            bucket INTEGER NOT NULL,
+            song_uuid TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (bucket, song_uuid)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_songs_query_count
+        ON songs(query_count DESC)
+    """)
+    conn.commit()
+    _trending_tables_ready = True
+
+
+def record_query_stats(conn: sqlite3.Connection, increments: Dict[str, int]) -> None:
+    """把查询增量累加到当前时间桶，并清理超出保留期的旧桶"""
+    bucket = int(time.time()) // TRENDING_BUCKET_SECONDS
+    conn.executemany("""
+        INSERT INTO song_query_stats (bucket, song_uuid, count) VALUES (?, ?, ?)
+        ON CONFLICT (bucket, song_uuid) DO UPDATE SET count = count + excluded.count
+    """, [(bucket, song_uuid, count) for song_uuid, count in increments.items()])
+    conn.execute(
+        "DELETE FROM song_query_stats WHERE bucket < ?",
+        (bucket - TRENDING_RETENTION // TRENDING_BUCKET_SECONDS,)
+    )
+
+
+class TrendingCache:
+    """热门歌曲的内存排行（全站 + 时段窗口）"""
+
+    def __init__(self, size: int = TRENDING_CACHE_SIZE, ttl: float = TRENDING_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._all_time: Dict[str, Dict[str, Any]] = {}
+        self._loaded_at: Optional[float] = None
+        self._windows: Dict[str, tuple] = {}  # 窗口名 -> (加载时间, 行列表)
+
+    def _ranked(self) -> List[Dict[str, Any]]:
+        return sorted(self._all_time.values(), key=lambda song: song['query_count'], reverse=True)
+
+    def _load_all_time(self, conn: sqlite3.Connection) -> None:
+        cursor = conn.execute("""
+            SELECT * FROM songs
+            ORDER BY query_count DESC
+            LIMIT ?
+        """, (self.size,))
+        self._all_time = {row['uuid']: dict(row) for row in cursor.fetchall()}
+        self._loaded_at = time.monotonic()
+
+    def _load_window(self, conn: sqlite3.Connection, window: str) -> List[Dict[str, Any]]:
+        since = (int(time.time()) - TRENDING_WINDOWS[window]) // TRENDING_BUCKET_SECONDS
+        cursor = conn.execute("""
+            SELECT s.*, w.window_count
+            FROM (
+                SELECT song_uuid, SUM(count) AS window_count
+                FROM song_query_stats
+                WHERE bucket > ?
+                GROUP BY song_uuid
+                ORDER BY window_count DESC
+                LIMIT ?
+            ) w
+            JOIN songs s ON s.uuid = w.song_uuid
+            ORDER BY w.window_count DESC
+        """, (since, self.size))
+        return [dict(row) for row in cursor.fetchall()]
+
+    def top(self, limit: int, window: Optional[str] = None) -> List[Dict[str, Any]]:
+        """取前 limit 首热门歌曲；window 为 None 时为全站排行"""
+        if window is not None and window not in TRENDING_WINDOWS:
+            raise ValueError(f"未知的时间窗口: {window}")
+        if limit > self.size:
+            # 超出缓存容量的请求直接查库
+            with db_connection() as conn:
+                ensure_trending_tables(conn)
+                if window is None:
+                    return [dict(row) for row in conn.execute(
+                        "SELECT * FROM songs ORDER BY query_count DESC LIMIT ?", (limit,)
+                    ).fetchall()]
+                return TrendingCache(size=limit)._load_window(conn, window)
+
+        now = time.monotonic()
+        with self._lock:
+            if window is None:
+                if self._loaded_at is None or now - self._loaded_at > self.ttl:
+                    with db_connection() as conn:
+                        ensure_trending_tables(conn)
+                        self._load_all_time(conn)
+                return [dict(song) for song in self._ranked()[:limit]]
+
+            cached = self._windows.get(window)
+            if cached is None or now - cached[0] > self.ttl:
+                with db_connection() as conn:
+                    ensure_trending_tables(conn)
+                    cached = (now, self._load_window(conn, window))
+                self._windows[window] = cached
+            return [dict(song) for song in cached[1][:limit]]
+
+    def apply_increments(self, conn: sqlite3.Connection, increments: Dict[str, int]) -> None:
+        """用刚写回的查询增量更新全站排行，只为可能挤进排行的歌曲查库"""
+        with self._lock:
+            if self._loaded_at is None:
+                return  # 尚未加载，下次读取时会从数据库加载
+            outsiders = []
+            for song_uuid, count in increments.items():
+                if song_uuid in self._all_time:
+                    self._all_time[song_uuid]['query_count'] += count
+                else:
+                    outsiders.append(song_uuid)
+            if outsiders:
+                floor = 0
+                if len(self._all_time) >= self.size:
+                    floor = min(song['query_count'] for song in self._all_time.values())
+                cursor = conn.execute("""
+                    SELECT * FROM songs
+                    WHERE uuid IN (SELECT value FROM json_each(?))
+                      AND query_count > ?
+                """, (json.dumps(outsiders), floor))
+                for row in cursor.fetchall():
+                    self._all_time[row['uuid']] = dict(row)
+            if len(self._all_time) > self.size:
+                self._all_time = {song['uuid']: song for song in self._ranked()[:self.size]}
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._loaded_at = None
+            self._windows.clear()
+
+
+trending = TrendingCache()
+
 
 # ========================
 # 用户管理系统 (增强安全)
 # ========================
-def register_user(username: str, password: str) -> Dict[str, str]:
+def register_user(username: str, password: str, ip: Optional[str] = None) -> Dict[str, str]:
     """安全用户注册接口"""
+    if ip and register_limiter.is_limited(ip):
+        return {"status": "error", "message": RATE_LIMITED_MESSAGE}
+    if ip:
+        register_limiter.hit(ip)
+    try:
+        password_hash = hash_password_offloaded(password)
+    except TimeoutError as e:
+        return {"status": "error", "message": str(e)}
     with db_connection() as conn:
         try:
-            password_hash = Security.hash_password(password)
             conn.execute("""
                 INSERT INTO users (username, password_hash)
                 VALUES (?, ?)
@@ -79,8 +698,17 @@ def register_user(username: str, password: str) -> Dict[str, str]:
         except sqlite3.IntegrityError:
             return {"status": "error", "message": "用戶名已被使用"}
 
-def login_user(username: str, password: str) -> Dict[str, str]:
-    """安全用户登录接口"""
+def _login_failed(username: str, ip: Optional[str]) -> None:
+    """只有失败的登录计入限流"""
+    username_limiter.hit(username)
+    if ip:
+        ip_limiter.hit(ip)
+
+def login_user(username: str, password: str, ip: Optional[str] = None) -> Dict[str, str]:
+    """安全用户登录接口（先限流再做哈希运算，防止被用来放大 CPU 消耗）"""
+    if username_limiter.is_limited(username) or (ip and ip_limiter.is_limited(ip)):
+        return {"status": "error", "message": RATE_LIMITED_MESSAGE}
+
     with db_connection() as conn:
         cursor = conn.execute(
             "SELECT password_hash FROM users WHERE username = ?",
@@ -88,16 +716,128 @@ def login_user(username: str, password: str) -> Dict[str, str]:
         )
         row = cursor.fetchone()
         
-        if row is None:
-            return {"status": "error", "message": "用戶名或密碼錯誤"}
-        
-        password_hash = row["password_hash"]  # 使用字典風格存取
-        
-        if Security.verify_password(password_hash, password):
-            return {"status": "success", "message": "登入成功"}
-        
+    if row is None:
+        _login_failed(username, ip)
+        return {"status": "error", "message": "用戶名或密碼錯誤"}
+    
+    password_hash = row["password_hash"]  # 使用字典風格存取
+    
+    try:
+        verified = verify_password_offloaded(password_hash, password)
+    except TimeoutError as e:
+        return {"status": "error", "message": str(e)}
+    if not verified:
+        _login_failed(username, ip)
         return {"status": "error", "message": "用戶名或密碼錯誤"}
 
+    username_limiter.reset(username)
+    if Security.needs_rehash(password_hash):
+        # 舊格式或舊參數：趁有明文密碼時升級為目前設定的算法
+        try:
+            new_hash = hash_password_offloaded(password)
+        except TimeoutError:
+            new_hash = None
+        if new_hash:
+            with db_connection() as conn:
+                conn.execute(
+                    "UPDATE users SET password_hash = ? WHERE username = ? AND password_hash = ?",
+                    (new_hash, username, password_hash)
+                )
+    return {"status": "success", "message": "登入成功"}
+
+
+# ========================
+# 用户缓存
+# ========================
+USER_CACHE_SIZE = 1024      # 缓存的用户数上限（LRU 淘汰）
+USER_CACHE_TTL = 300.0      # 用户记录的有效期（秒）
+PLAYLIST_CACHE_TTL = 60.0   # 用户歌单列表的有效期（秒）
+
+
+class TTLCache:
+    """带过期时间的 LRU 缓存，记录命中 / 未命中次数"""
+
+    def __init__(self, size: int, ttl: float):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Any) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Any, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key: Any = None) -> None:
+        """删除单个键；key 为 None 时清空"""
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+user_playlists_cache = TTLCache(USER_CACHE_SIZE, PLAYLIST_CACHE_TTL)
+
+
+def get_user(user_id: int) -> Optional[Dict[str, Any]]:
+    """按 user_id 取用户记录（带缓存）；不含 password_hash，密码只在 login_user 中直接从数据库读取"""
+    user = user_cache.get(user_id)
+    if user is None:
+        with db_connection() as conn:
+            row = conn.execute(
+                "SELECT user_id, username FROM users WHERE user_id = ?",
+                (user_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        user = dict(row)
+        user_cache.set(user_id, user)
+    return dict(user)
+
+
+def get_user_playlists(user_id: int) -> List[Dict[str, Any]]:
+    """取用户的歌单列表（带缓存）"""
+    playlists = user_playlists_cache.get(user_id)
+    if playlists is None:
+        with db_connection() as conn:
+            playlists = [dict(row) for row in conn.execute(
+                "SELECT playlist_id, name FROM playlists WHERE user_id = ?",
+                (user_id,)
+            ).fetchall()]
+        user_playlists_cache.set(user_id, playlists)
+    return [dict(playlist) for playlist in playlists]
+
+
+def invalidate_user(user_id: int) -> None:
+    user_cache.invalidate(user_id)
+    user_playlists_cache.invalidate(user_id)
+
+
+def user_cache_stats() -> Dict[str, Dict[str, int]]:
+    return {"users": user_cache.stats(), "playlists": user_playlists_cache.stats()}
+
 
 # ========================
 # 数据库初始化 (优化结构)
@@ -146,11 +886,7 @@ def initialize_database():
             )
         """)
 
-        # 索引创建
-        cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_songs_full_text 
-            ON songs(full_text_search)
-        """)
+        # 索引创建（全文检索由 songs_fts 负责，见 ensure_search_index）
         cursor.execute("""
             CREATE INDEX IF NOT EXISTS idx_songs_tempo 
             ON songs(tempo_start, tempo_end)
@@ -179,9 +915,481 @@ def initialize_database():
             )
         """)
 
+        ensure_search_index(conn)
+        ensure_trending_tables(conn)
+
+# ========================
+# 全文检索索引 (FTS5)
+# ========================
+# trigram 分词器按字符三元组切分，不依赖空格分词，适用于中文歌名与歌词
+FTS_MIN_TERM_LENGTH = 3  # trigram 要求检索词至少 3 个字符，更短的词回退到 LIKE
+FTS_WEIGHTS = (3.0, 2.0, 1.5, 1.0)  # song_title / lyrics / author / tags，与原 LIKE 评分权重一致
+SEARCH_MAX_SIMILARITY = sum(FTS_WEIGHTS)  # LIKE 评分的上限（四列全部命中），bm25 按本次结果缩放到同一范围
+
+FTS_SUSPENDED_MARKER = 'songs_fts_suspended'
+
+# songs_fts 的同步触发器；批量导入期间由 suspend_search_sync 暂时移除
+SONGS_FTS_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS songs_fts_ai AFTER INSERT ON songs BEGIN
+        INSERT INTO songs_fts (rowid, song_title, lyrics, author, tags)
+        VALUES (new.rowid, new.song_title, new.lyrics, new.author, new.tags);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS songs_fts_ad AFTER DELETE ON songs BEGIN
+        INSERT INTO songs_fts (songs_fts, rowid, song_title, lyrics, author, tags)
+        VALUES ('delete', old.rowid, old.song_title, old.lyrics, old.author, old.tags);
+    END
+    """,
+    # 仅在检索相关列变更时同步，query_count 等更新不会触碰索引
+    """
+    CREATE TRIGGER IF NOT EXISTS songs_fts_au
+    AFTER UPDATE OF song_title, lyrics, author, tags ON songs BEGIN
+        INSERT INTO songs_fts (songs_fts, rowid, song_title, lyrics, author, tags)
+        VALUES ('delete', old.rowid, old.song_title, old.lyrics, old.author, old.tags);
+        INSERT INTO songs_fts (rowid, song_title, lyrics, author, tags)
+        VALUES (new.rowid, new.song_title, new.lyrics, new.author, new.tags);
+    END
+    """,
+)
+
+_fts_ready: Optional[bool] = None
+_fts_lock = threading.Lock()
+
+
+def _ensure_maintenance_markers(conn: sqlite3.Connection) -> None:
+    """maintenance_markers 记录进行中的结构维护，进程中途退出时由下次启动据此修复"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS maintenance_markers (
+            name TEXT PRIMARY KEY,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def ensure_search_index(conn: sqlite3.Connection) -> bool:
+    """
+    确保 songs_fts 虚拟表与同步触发器存在，返回 FTS5 是否可用。
+    songs_fts 是 songs 的外部内容表（以 rowid 对应），首次创建时会全量重建；
+    上次批量导入未能恢复同步（留有 songs_fts_suspended 标记）时同样重建。
+    """
+    global _fts_ready
+    if _fts_ready is not None:
+        return _fts_ready
+    with _fts_lock:
+        if _fts_ready is not None:
+            return _fts_ready
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'songs_fts'"
+        ).fetchone()
+        try:
+            conn.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS songs_fts USING fts5(
+                    song_title, lyrics, author, tags,
+                    content='songs', content_rowid='rowid',
+                    tokenize='trigram'
+                )
+            """)
+        except sqlite3.OperationalError:
+            # SQLite 未编译 FTS5 或版本过旧（trigram 需要 3.34+），退回 LIKE 搜索
+            _fts_ready = False
+            return _fts_ready
+
+        _ensure_maintenance_markers(conn)
+        suspended = conn.execute(
+            "SELECT 1 FROM maintenance_markers WHERE name = ?", (FTS_SUSPENDED_MARKER,)
+        ).fetchone()
+        # 生成列上的普通索引无法服务 LIKE '%...%'，只会放大写入，直接移除
+        conn.execute("DROP INDEX IF EXISTS idx_songs_full_text")
+        if not exists or suspended:
+            _resume_search_sync(conn)
+        else:
+            for sql in SONGS_FTS_TRIGGERS:
+                conn.execute(sql)
+        conn.commit()
+        _fts_ready = True
+        return _fts_ready
+
+
+def _resume_search_sync(conn: sqlite3.Connection) -> None:
+    """重建同步触发器与 songs_fts 并清除暂停标记（不提交，由调用方在同一事务中提交）"""
+    for sql in SONGS_FTS_TRIGGERS:
+        conn.execute(sql)
+    conn.execute("INSERT INTO songs_fts (songs_fts) VALUES ('rebuild')")
+    conn.execute("DELETE FROM maintenance_markers WHERE name = ?", (FTS_SUSPENDED_MARKER,))
+
+
+def suspend_search_sync(conn: sqlite3.Connection) -> bool:
+    """
+    批量写入前移除 songs_fts 的同步触发器，返回是否已暂停（FTS5 不可用时为 False）。
+    与暂停标记在同一事务中提交：进程中途退出时，下次启动的 ensure_search_index 会恢复触发器并重建。
+    暂停期间 songs 的二级索引照常维护，其他连接的查询不受影响，只是全文检索暂时看不到新写入的内容。
+    """
+    if not ensure_search_index(conn):
+        return False
+    conn.execute(
+        "INSERT OR REPLACE INTO maintenance_markers (name) VALUES (?)", (FTS_SUSPENDED_MARKER,)
+    )
+    for name in ('songs_fts_ai', 'songs_fts_ad', 'songs_fts_au'):
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+    conn.commit()
+    return True
+
+
+def resume_search_sync(conn: sqlite3.Connection) -> None:
+    """恢复 suspend_search_sync 移除的触发器，并全量重建 songs_fts"""
+    _resume_search_sync(conn)
+    conn.commit()
+
+
+def rebuild_search_index() -> None:
+    """
+    全量重建 songs_fts。
+    songs 没有 INTEGER PRIMARY KEY，VACUUM 可能重排 rowid，执行 VACUUM 后需调用本函数。
+    """
+    with db_connection() as conn:
+        if ensure_search_index(conn):
+            conn.execute("INSERT INTO songs_fts (songs_fts) VALUES ('rebuild')")
+
+# ========================
+# 歌词相似度索引 (字符 n-gram 倒排)
+# ========================
+# lyric_grams 保存每首歌歌词（小写）去重后的字符 n-gram，lyric_index 保存歌词长度。
+# 歌曲写入时由触发器把 uuid 放入 lyric_index_queue，sync_lyric_index 再增量重建对应条目，
+# 因此不论从哪个入口（found / 后台 / 直接 SQL）改歌词，索引都能跟上。
+# 队列在写入端（create_song、批量更新、导入、后台编辑）处理；其余遗留由后台线程定期处理，
+# 搜索路径只读现有索引，不会为补建索引抢写锁。
+LYRIC_NGRAM = 2                 # 中文歌词以双字组召回效果较好
+LYRIC_RERANK_CANDIDATES = 200   # 进入 SequenceMatcher 精排的候选上限
+LYRIC_SCORE_THRESHOLD = 0.4     # 最低得分阈值（与原逻辑一致）
+# 得分 = ratio * 0.8 + 至多 0.2 的加分，要超过阈值需 ratio > 0.25；
+# 而 ratio <= 2 * min(a, b) / (a + b)，故歌词长度必须落在 (a / 7, 7a) 之间才可能入选
+LYRIC_LENGTH_FACTOR = 2 / ((LYRIC_SCORE_THRESHOLD - 0.2) / 0.8) - 1
+LYRIC_INDEX_SYNC_INTERVAL = 30.0  # 后台线程处理遗留队列的间隔（秒）
+
+_lyric_index_ready: Optional[bool] = None
+_lyric_index_lock = threading.Lock()
+
+
+def _lyric_grams(text: str) -> set:
+    """提取小写文本的去重字符 n-gram（忽略纯空白片段）"""
+    n = LYRIC_NGRAM
+    return {
+        text[i:i + n] for i in range(len(text) - n + 1)
+        if not text[i:i + n].isspace()
+    }
+
+
+def lyric_score(query_lower: str, lyric_lower: str) -> float:
+    """歌词相似度评分：SequenceMatcher 相似度 + 子串 / 前缀加分"""
+    matcher = SequenceMatcher(None, query_lower, lyric_lower)
+    score = matcher.ratio() * 0.8  # 主要相似度
+
+    # 添加附加评分因素
+    if query_lower in lyric_lower:
+        score += 0.15
+    if lyric_lower.startswith(query_lower):
+        score += 0.05
+    return score
+
+
+# ========================
+# 歌词并行评分 (可选模式)
+# ========================
+# 需要全量扫描时（查询过短或索引不可用），可把候选分块交给常驻进程池评分。
+# 默认关闭：进程间传输歌词有固定开销，只有大曲库才划算。
+LYRIC_PARALLEL_ENABLED = False
+LYRIC_PARALLEL_WORKERS = os.cpu_count() or 1
+LYRIC_PARALLEL_CHUNK_SIZE = 2000  # 每个任务的歌词数，候选不足一块时直接在本进程评分
+
+_lyric_executor: Optional[ProcessPoolExecutor] = None
+_lyric_executor_lock = threading.Lock()
+
+
+def _score_lyric_chunk(query_lower: str, chunk: List[tuple], k: int) -> List[tuple]:
+    """工作进程：对一块 (uuid, lyrics) 评分，用大小为 k 的最小堆保留最高分"""
+    heap: List[tuple] = []
+    for song_uuid, lyrics in chunk:
+        score = lyric_score(query_lower, lyrics.lower())
+        if score <= LYRIC_SCORE_THRESHOLD:
+            continue
+        if len(heap) < k:
+            heapq.heappush(heap, (score, song_uuid))
+        elif score > heap[0][0]:
+            heapq.heapreplace(heap, (score, song_uuid))
+    return heap
+
+
+def get_lyric_executor() -> ProcessPoolExecutor:
+    """获取常驻的歌词评分进程池（首次使用时创建）"""
+    global _lyric_executor
+    with _lyric_executor_lock:
+        if _lyric_executor is None:
+            _lyric_executor = ProcessPoolExecutor(max_workers=LYRIC_PARALLEL_WORKERS)
+        return _lyric_executor
+
+
+def _discard_lyric_executor(executor: ProcessPoolExecutor) -> None:
+    """丢弃损坏的进程池（工作进程被杀等），下次使用时重建"""
+    global _lyric_executor
+    with _lyric_executor_lock:
+        if _lyric_executor is executor:
+            _lyric_executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+@atexit.register
+def shutdown_lyric_executor() -> None:
+    global _lyric_executor
+    with _lyric_executor_lock:
+        if _lyric_executor is not None:
+            _lyric_executor.shutdown(wait=False, cancel_futures=True)
+            _lyric_executor = None
+
+
+def _parallel_top_k(query_lower: str, candidates: List[Dict[str, Any]], k: int) -> List[tuple]:
+    """分块并行评分，各进程返回局部 top-k，父进程再合并；进程池损坏时重建进程池并退回本线程评分"""
+    rows = [(song['uuid'], song['lyrics']) for song in candidates]
+    size = LYRIC_PARALLEL_CHUNK_SIZE
+    executor = get_lyric_executor()
+    try:
+        futures = [
+            executor.submit(_score_lyric_chunk, query_lower, rows[i:i + size], k)
+            for i in range(0, len(rows), size)
+        ]
+        partial = [item for future in futures for item in future.result()]
+    except (BrokenProcessPool, RuntimeError):
+        # BrokenProcessPool：工作进程被杀；RuntimeError：进程池已关闭
+        _discard_lyric_executor(executor)
+        partial = _score_lyric_chunk(query_lower, rows, k)
+    return heapq.nlargest(k, partial, key=lambda x: x[0])
+
+
+def ensure_lyric_index(conn: sqlite3.Connection) -> bool:
+    """确保歌词 n-gram 索引表与触发器存在；首次创建时把所有有歌词的歌曲加入待建队列"""
+    global _lyric_index_ready
+    if _lyric_index_ready is not None:
+        return _lyric_index_ready
+    with _lyric_index_lock:
+        if _lyric_index_ready is not None:
+            return _lyric_index_ready
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'lyric_index'"
+        ).fetchone()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS lyric_index (
+                song_uuid TEXT PRIMARY KEY,
+                lyric_length INTEGER NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS lyric_grams (
+                gram TEXT NOT NULL,
+                song_uuid TEXT NOT NULL,
+                PRIMARY KEY (gram, song_uuid)
+            ) WITHOUT ROWID
+        """)
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_lyric_grams_song
+            ON lyric_grams(song_uuid)
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS lyric_index_queue (
+                song_uuid TEXT PRIMARY KEY
+            )
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS lyric_index_ai AFTER INSERT ON songs BEGIN
+                INSERT OR IGNORE INTO lyric_index_queue (song_uuid) VALUES (new.uuid);
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS lyric_index_au AFTER UPDATE OF lyrics, uuid ON songs BEGIN
+                INSERT OR IGNORE INTO lyric_index_queue (song_uuid) VALUES (old.uuid);
+                INSERT OR IGNORE INTO lyric_index_queue (song_uuid) VALUES (new.uuid);
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS lyric_index_ad AFTER DELETE ON songs BEGIN
+                INSERT OR IGNORE INTO lyric_index_queue (song_uuid) VALUES (old.uuid);
+            END
+        """)
+        if not exists:
+            conn.execute("""
+                INSERT OR IGNORE INTO lyric_index_queue (song_uuid)
+                SELECT uuid FROM songs WHERE lyrics IS NOT NULL
+            """)
+        conn.commit()
+        _lyric_index_ready = True
+        return _lyric_index_ready
+
+
+def sync_lyric_index(conn: sqlite3.Connection, batch_size: int = 500) -> int:
+    """处理待建队列，增量重建变更歌曲的 n-gram 条目，返回处理的歌曲数"""
+    if not ensure_lyric_index(conn):
+        return 0
+    processed = 0
+    while True:
+        pending = [row[0] for row in conn.execute(
+            "SELECT song_uuid FROM lyric_index_queue LIMIT ?", (batch_size,)
+        ).fetchall()]
+        if not pending:
+            break
+        with conn:
+            for song_uuid in pending:
+                conn.execute("DELETE FROM lyric_grams WHERE song_uuid = ?", (song_uuid,))
+                conn.execute("DELETE FROM lyric_index WHERE song_uuid = ?", (song_uuid,))
+                row = conn.execute(
+                    "SELECT lyrics FROM songs WHERE uuid = ? AND lyrics IS NOT NULL",
+                    (song_uuid,)
+                ).fetchone()
+                if row is None:
+                    continue
+                lyric = row['lyrics'].lower()
+                conn.execute(
+                    "INSERT INTO lyric_index (song_uuid, lyric_length) VALUES (?, ?)",
+                    (song_uuid, len(lyric))
+                )
+                conn.executemany(
+                    "INSERT INTO lyric_grams (gram, song_uuid) VALUES (?, ?)",
+                    [(gram, song_uuid) for gram in _lyric_grams(lyric)]
+                )
+            conn.executemany(
+                "DELETE FROM lyric_index_queue WHERE song_uuid = ?",
+                [(uid,) for uid in pending]
+            )
+        processed += len(pending)
+    return processed
+
+
+class LyricIndexSyncer:
+    """后台处理 lyric_index_queue：搜索时唤醒、并定期检查，每批一个短事务"""
+
+    def __init__(self, interval: float = LYRIC_INDEX_SYNC_INTERVAL):
+        self.interval = interval
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def wake(self) -> None:
+        """请求尽快处理队列；首次调用时启动后台线程，本身不访问数据库"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="lyric-index-sync", daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                with db_connection() as conn:
+                    sync_lyric_index(conn)
+            except sqlite3.Error:
+                pass  # 数据库暂时被锁，下一轮重试
+
+
+lyric_index_syncer = LyricIndexSyncer()
+
+
+def _lyric_candidates(conn: sqlite3.Connection, query_lower: str) -> Optional[List[Dict[str, Any]]]:
+    """
+    通过 n-gram 倒排召回候选歌词：只看长度可能过阈值的歌曲，按共享 n-gram 数取前若干首。
+    查询过短无法切出 n-gram 时返回 None，由调用方回退到全量扫描。
+    """
+    grams = _lyric_grams(query_lower)
+    if not grams:
+        return None
+    length = len(query_lower)
+    cursor = conn.execute("""
+        SELECT s.uuid, s.lyrics
+        FROM (
+            SELECT g.song_uuid, COUNT(*) AS hits
+            FROM lyric_grams g
+            JOIN lyric_index i ON i.song_uuid = g.song_uuid
+            WHERE g.gram IN (SELECT value FROM json_each(?))
+              AND i.lyric_length > ? AND i.lyric_length < ?
+            GROUP BY g.song_uuid
+            ORDER BY hits DESC
+            LIMIT ?
+        ) c
+        JOIN songs s ON s.uuid = c.song_uuid
+        WHERE s.lyrics IS NOT NULL
+    """, (
+        json.dumps(sorted(grams), ensure_ascii=False),
+        length / LYRIC_LENGTH_FACTOR,
+        length * LYRIC_LENGTH_FACTOR,
+        LYRIC_RERANK_CANDIDATES
+    ))
+    return [dict(row) for row in cursor.fetchall()]
+
 # ========================
 # 辅助查询模块
 # ========================
+# 搜索结果只取列表需要的列（不含完整歌词、路径与 full_text_search），
+# 另附一段高亮命中处的歌词片段；完整歌词与媒体由详情接口按需加载。
+SEARCH_LIST_COLUMNS = (
+    'uuid', 'song_title', 'author', 'music_key', 'category', 'tags',
+    'tempo_start', 'tempo_end', 'tempo_range', 'query_count'
+)
+LYRIC_SNIPPET_CONTEXT = 30  # 命中处前后保留的字符数；未命中时取歌词开头 2 倍长度
+
+
+def _snippet_html(text: str, start: int, length: int, head: bool, tail: bool) -> str:
+    """转义歌词片段，并以 <mark> 包住 text[start:start + length]；head / tail 表示前后还有内容"""
+    parts = [html.escape(text[:start])]
+    if length:
+        parts.append('<mark>' + html.escape(text[start:start + length]) + '</mark>')
+    parts.append(html.escape(text[start + length:]))
+    return ('…' if head else '') + ' / '.join(''.join(parts).splitlines()) + ('…' if tail else '')
+
+
+def _attach_lyric_snippets(conn: sqlite3.Connection, songs: List[Dict[str, Any]], term: Optional[str]) -> None:
+    """为结果附加 lyric_snippet：只在 SQLite 内截取命中处附近的一小段，不把整段歌词取回"""
+    if not songs:
+        return
+    cursor = conn.execute("""
+        SELECT uuid, length(lyrics) AS total, pos,
+               substr(lyrics, max(1, pos - :context), :width) AS snippet
+        FROM (
+            SELECT uuid, lyrics,
+                   CASE WHEN :term = '' THEN 0 ELSE instr(lower(lyrics), lower(:term)) END AS pos
+            FROM songs
+            WHERE uuid IN (SELECT value FROM json_each(:uuids)) AND lyrics IS NOT NULL
+        )
+    """, {
+        "term": term or '',
+        "context": LYRIC_SNIPPET_CONTEXT,
+        "width": LYRIC_SNIPPET_CONTEXT * 2 + len(term or ''),
+        "uuids": json.dumps([song['uuid'] for song in songs]),
+    })
+    snippets = {}
+    for row in cursor:
+        first = max(1, row['pos'] - LYRIC_SNIPPET_CONTEXT)  # 片段第一个字符在歌词中的位置（从 1 起）
+        snippets[row['uuid']] = _snippet_html(
+            row['snippet'],
+            row['pos'] - first if row['pos'] else 0,
+            len(term) if row['pos'] else 0,
+            first > 1,
+            first - 1 + len(row['snippet']) < row['total']
+        )
+    for song in songs:
+        song['lyric_snippet'] = snippets.get(song['uuid'])
+
+
+def _lyric_match_snippet(query_lower: str, lyrics: str) -> str:
+    """相似度搜索的片段：以 SequenceMatcher 找出与查询最长的相同片段并高亮"""
+    lyric_lower = lyrics.lower()
+    match = SequenceMatcher(None, query_lower, lyric_lower, autojunk=False).find_longest_match(
+        0, len(query_lower), 0, len(lyric_lower)
+    )
+    first = max(0, match.b - LYRIC_SNIPPET_CONTEXT)
+    end = match.b + match.size + LYRIC_SNIPPET_CONTEXT
+    return _snippet_html(lyrics[first:end], match.b - first, match.size, first > 0, end < len(lyrics))
+
+
 class SongSearch:
     @staticmethod
     def build_search_query(
@@ -190,18 +1398,28 @@ class SongSearch:
         max_tempo: Optional[int] = None,
         category: Optional[str] = None,
         author: Optional[str] = None,
-        music_key: Optional[str] = None
+        music_key: Optional[str] = None,
+        use_fts: bool = False
     ) -> tuple[str, list]:
-        """动态构建搜索查询"""
+        """
+        动态构建搜索查询。
+        use_fts 为 True 且检索词足够长时走 songs_fts 的 MATCH + bm25 评分，
+        否则回退到 LIKE 评分；两种方式都只返回命中检索词的歌曲。
+        bm25 的原始值比 LIKE 评分（0 ~ SEARCH_MAX_SIMILARITY）小几个数量级，
+        因此按本次结果中的最佳分数缩放到同一范围，与 query_count 的权重关系和 LIKE 路径一致。
+        """
         base_query = """
             SELECT *, 
                    (query_count * 0.3 + similarity * 0.7) AS relevance
             FROM (
-                SELECT *,
-                       {similarity_clause}
-                FROM songs
-                WHERE 1=1
-                {conditions}
+                SELECT *, {similarity_expr} AS similarity
+                FROM (
+                    SELECT {columns},
+                           {score_clause} AS raw_score
+                    FROM {source}
+                    WHERE 1=1
+                    {conditions}
+                )
             )
             ORDER BY relevance DESC, query_count DESC
             LIMIT ?
@@ -209,36 +1427,49 @@ class SongSearch:
 
         params = []
         conditions = []
-        similarity_clause = "0 AS similarity"
+        source = "songs s"
+        score_clause = "0"
+        similarity_expr = "raw_score"
 
         # 处理搜索词
-        if search_term:
-            similarity_clause = """
-                ((song_title LIKE ?) * 3 +
-                 (lyrics LIKE ?) * 2 +
-                 (author LIKE ?) * 1.5 +
-                 (tags LIKE ?) * 1) AS similarity
+        if search_term and use_fts and len(search_term) >= FTS_MIN_TERM_LENGTH:
+            # bm25 越小越相关，取负值；短语查询等价于子串匹配。最佳结果缩放为 SEARCH_MAX_SIMILARITY
+            source = "songs_fts JOIN songs s ON s.rowid = songs_fts.rowid"
+            score_clause = "-bm25(songs_fts, {}, {}, {}, {})".format(*FTS_WEIGHTS)
+            similarity_expr = f"IFNULL(raw_score * {SEARCH_MAX_SIMILARITY} / NULLIF(MAX(raw_score) OVER (), 0), 0)"
+            conditions.append("songs_fts MATCH ?")
+            params.append('"' + search_term.replace('"', '""') + '"')
+        elif search_term:
+            score_clause = """
+                (IFNULL(s.song_title LIKE ?, 0) * 3 +
+                 IFNULL(s.lyrics LIKE ?, 0) * 2 +
+                 IFNULL(s.author LIKE ?, 0) * 1.5 +
+                 IFNULL(s.tags LIKE ?, 0) * 1)
             """
             search_pattern = f"%{search_term}%"
             params.extend([search_pattern] * 4)
+            conditions.append(
+                "(s.song_title LIKE ? OR s.lyrics LIKE ? OR s.author LIKE ? OR s.tags LIKE ?)"
+            )
+            params.extend([search_pattern] * 4)
 
         # 处理节奏范围
         if min_tempo is not None:
-            conditions.append("tempo_end >= ?")
+            conditions.append("s.tempo_end >= ?")
             params.append(min_tempo)
         if max_tempo is not None:
-            conditions.append("tempo_start <= ?")
+            conditions.append("s.tempo_start <= ?")
             params.append(max_tempo)
 
         # 处理其他字段
         if category:
-            conditions.append("category = ?")
+            conditions.append("s.category = ?")
             params.append(category)
         if author:
-            conditions.append("author = ?")
+            conditions.append("s.author = ?")
             params.append(author)
         if music_key:
-            conditions.append("music_key = ?")
+            conditions.append("s.music_key = ?")
             params.append(music_key)
 
         # 组合条件
@@ -247,7 +1478,10 @@ class SongSearch:
             conditions_str = "AND " + " AND ".join(conditions)
 
         return base_query.format(
-            similarity_clause=similarity_clause,
+            columns=', '.join(f's.{name}' for name in SEARCH_LIST_COLUMNS),
+            score_clause=score_clause,
+            similarity_expr=similarity_expr,
+            source=source,
             conditions=conditions_str
         ), params
 
@@ -272,17 +1506,17 @@ def create_song(**song_data) -> str:
             """,
             values
         )
+        conn.commit()
+        sync_lyric_index(conn)  # 增量建立歌词索引
+    songs_changed([song_uuid])
     return song_uuid
 
-def get_trending_songs(limit: int = 10) -> List[Dict[str, Any]]:
-    """獲取熱門歌曲，按照查詢次數排序"""
-    with db_connection() as conn:
-        cursor = conn.execute("""
-            SELECT * FROM songs
-            ORDER BY query_count DESC
-            LIMIT ?
-        """, (limit,))
-        return [dict(row) for row in cursor.fetchall()]
+def get_trending_songs(limit: int = 10, window: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    獲取熱門歌曲。window 為 None 時按累計查詢次數排序，
+    為 'hour' / 'day' / 'week' 時按該時段內的查詢次數排序。
+    """
+    return trending.top(limit, window)
 
 def get_songs(
     search_term: Optional[str] = None,
@@ -294,6 +1528,10 @@ def get_songs(
     limit: Optional[int] = 20,
     playlist_id: Optional[int] = None
 ) -> List[Dict[str, Any]]:
+    """
+    指定 playlist_id 时返回该歌单的完整歌曲行（供导出等使用）；
+    否则为搜索，只返回 SEARCH_LIST_COLUMNS 与 lyric_snippet，完整信息见 repository.get_song。
+    """
     if playlist_id is not None:
         # 从特定歌单中查询歌曲
         query = """
@@ -312,30 +1550,50 @@ def get_songs(
             return [dict(row) for row in cursor.fetchall()]
     else:
         # 通用搜索逻辑
-        query_builder = SongSearch()
-        query, params = query_builder.build_search_query(
-            search_term=search_term,
-            min_tempo=min_tempo,
-            max_tempo=max_tempo,
-            category=category,
-            author=author,
-            music_key=music_key
-        )
-        # 添加 limit 参数
-        params.append(limit)
         with db_connection() as conn:
-            cursor = conn.execute(query, params)
-            results = [dict(row) for row in cursor.fetchall()]
-            if results:
-                uuids = [song['uuid'] for song in results]
-                conn.executemany(
-                    "UPDATE songs SET query_count = query_count + 1 WHERE uuid = ?",
-                    [(uid,) for uid in uuids]
-                )
+            results = _search_rows(conn, search_term, min_tempo, max_tempo, category, author, music_key, limit)
+        # 查询次数交给写回缓冲，搜索本身不再写库
+        query_counter.record([song['uuid'] for song in results])
         return results
 
+def _search_rows(
+    conn: sqlite3.Connection,
+    search_term: Optional[str],
+    min_tempo: Optional[int],
+    max_tempo: Optional[int],
+    category: Optional[str],
+    author: Optional[str],
+    music_key: Optional[str],
+    limit: Optional[int]
+) -> List[Dict[str, Any]]:
+    """执行搜索并附加歌词片段（不记录查询次数）"""
+    query_builder = SongSearch()
+    query, params = query_builder.build_search_query(
+        search_term=search_term,
+        min_tempo=min_tempo,
+        max_tempo=max_tempo,
+        category=category,
+        author=author,
+        music_key=music_key,
+        use_fts=ensure_search_index(conn)
+    )
+    # 添加 limit 参数
+    params.append(limit)
+    cursor = conn.execute(query, params)
+    results = [dict(row) for row in cursor.fetchall()]
+    _attach_lyric_snippets(conn, results, search_term)
+    return results
+
 def get_recommendations(song_uuid: str, limit: int = 5) -> List[Dict[str, Any]]:
-    """基于歌曲特征的推荐系统，排除目标歌曲并根据匹配分数排序"""
+    """
+    基于歌曲特征的推荐系统，排除目标歌曲并根据匹配分数排序，score 越大越相似。
+    安装了 NumPy 时使用特征向量引擎（score 为余弦相似度），
+    否则在同类别或同调性的歌曲中按节奏差排序（score 为 1 / (1 + 节奏差)）。
+    """
+    from app import recommend  # 延迟导入：recommend 依赖本模块
+    if recommend.available():
+        return recommend.recommend(song_uuid, limit)
+
     with db_connection() as conn:
         target = conn.execute("""
             SELECT category, music_key, tempo_start, tempo_end 
@@ -347,12 +1605,12 @@ def get_recommendations(song_uuid: str, limit: int = 5) -> List[Dict[str, Any]]:
 
         cursor = conn.execute("""
             SELECT *, 
-                   ABS(tempo_start - ?) * 0.5 +
-                   ABS(tempo_end - ?) * 0.5 AS score
+                   1.0 / (1.0 + ABS(tempo_start - ?) * 0.5 +
+                                ABS(tempo_end - ?) * 0.5) AS score
             FROM songs
             WHERE uuid != ?
               AND (category = ? OR music_key = ?)
-            ORDER BY score ASC
+            ORDER BY score DESC
             LIMIT ?
         """, (
             target['tempo_start'], target['tempo_end'],
@@ -360,72 +1618,295 @@ def get_recommendations(song_uuid: str, limit: int = 5) -> List[Dict[str, Any]]:
         ))
         return [dict(row) for row in cursor.fetchall()]
 
-def batch_update_songs(updates: List[Dict[str, Any]]) -> int:
-    """批量更新歌曲信息，返回成功更新的记录数"""
+def get_recommendations_batch(song_uuids: List[str], limit: int = 5) -> Dict[str, List[Dict[str, Any]]]:
+    """批量推荐：{种子 uuid: 推荐列表}"""
+    from app import recommend
+    if recommend.available():
+        return recommend.recommend_batch(song_uuids, limit)
+    return {uid: get_recommendations(uid, limit) for uid in song_uuids}
+
+BATCH_UPDATE_PROTECTED_COLUMNS = {'uuid', 'created_at'}  # 不允许经批量更新修改的列
+_song_update_columns: Optional[frozenset] = None
+
+
+def song_update_columns(conn: sqlite3.Connection) -> frozenset:
+    """按表结构得出可更新的歌曲列（排除生成列与受保护列），结果缓存"""
+    global _song_update_columns
+    if _song_update_columns is None:
+        # table_xinfo 的 hidden 为 2 / 3 表示生成列
+        _song_update_columns = frozenset(
+            row['name'] for row in conn.execute("PRAGMA table_xinfo(songs)")
+            if row['hidden'] == 0 and row['name'] not in BATCH_UPDATE_PROTECTED_COLUMNS
+        )
+    return _song_update_columns
+
+
+def batch_update_songs(updates: List[Dict[str, Any]], chunk_size: Optional[int] = None) -> Dict[str, Any]:
+    """批量更新歌曲信息
+
+    按列集合分组，每组一条 UPDATE 语句以 executemany 执行。返回
+    {"updated": 实际更新的行数, "failed": [{"index", "uuid", "reason"}, ...]}。
+    指定 chunk_size 时每处理 chunk_size 行提交一次，避免超大批次长时间占用写锁。
+    """
+    failed: List[Dict[str, Any]] = []
     updated_count = 0
+    updated_uuids: List[str] = []
+
     with db_connection() as conn:
-        for data in updates:
+        allowed = song_update_columns(conn)
+        rows = []  # (原始序号, uuid, 列元组, 值)
+        for index, data in enumerate(updates):
             song_uuid = data.get('uuid')
+            columns = tuple(sorted(k for k in data if k != 'uuid'))
+            unknown = [k for k in columns if k not in allowed]
             if not song_uuid:
-                continue
-            # 避免直接修改原始数据
-            update_data = {k: v for k, v in data.items() if k != 'uuid'}
-            if not update_data:
-                continue
-            set_clause = ", ".join(f"{k} = ?" for k in update_data)
-            values = list(update_data.values()) + [song_uuid]
-            try:
-                conn.execute(
-                    f"UPDATE songs SET {set_clause} WHERE uuid = ?",
-                    values
-                )
-                updated_count += 1
-            except sqlite3.Error:
-                continue
-    return updated_count
+                failed.append({"index": index, "uuid": None, "reason": "缺少 uuid"})
+            elif not columns:
+                failed.append({"index": index, "uuid": song_uuid, "reason": "没有要更新的列"})
+            elif unknown:
+                failed.append({"index": index, "uuid": song_uuid, "reason": f"不可更新的列: {', '.join(unknown)}"})
+            else:
+                rows.append((index, song_uuid, columns, [data[k] for k in columns] + [song_uuid]))
 
-def similarity_search(query: str, limit: int = 5) -> List[Dict[str, Any]]:
-    """基于歌词相似度的深度搜索"""
-    with db_connection() as conn:
-        cursor = conn.execute("SELECT uuid, lyrics FROM songs WHERE lyrics IS NOT NULL")
-        candidates = [dict(row) for row in cursor.fetchall()]
+        step = chunk_size or len(rows) or 1
+        for start in range(0, len(rows), step):
+            chunk = rows[start:start + step]
+            existing = {row[0] for row in conn.execute(
+                "SELECT uuid FROM songs WHERE uuid IN (SELECT value FROM json_each(?))",
+                (json.dumps([row[1] for row in chunk]),)
+            )}
+            groups: Dict[tuple, List[tuple]] = {}
+            for row in chunk:
+                if row[1] in existing:
+                    groups.setdefault(row[2], []).append(row)
+                else:
+                    failed.append({"index": row[0], "uuid": row[1], "reason": "歌曲不存在"})
 
-    # 使用 SequenceMatcher 计算相似度
+            for columns, group in groups.items():
+                sql = f"UPDATE songs SET {', '.join(f'{k} = ?' for k in columns)} WHERE uuid = ?"
+                conn.execute("SAVEPOINT batch_update")
+                try:
+                    updated_count += conn.executemany(sql, [row[3] for row in group]).rowcount
+                    updated_uuids.extend(row[1] for row in group)
+                except sqlite3.Error:
+                    # 整组回滚后逐行执行，找出违反约束的行
+                    conn.execute("ROLLBACK TO batch_update")
+                    for row in group:
+                        try:
+                            updated_count += conn.execute(sql, row[3]).rowcount
+                            updated_uuids.append(row[1])
+                        except sqlite3.Error as e:
+                            failed.append({"index": row[0], "uuid": row[1], "reason": str(e)})
+                conn.execute("RELEASE batch_update")
+            conn.commit()
+        sync_lyric_index(conn)  # 增量更新歌词索引
+
+    invalidate_song_exports(list(dict.fromkeys(updated_uuids)))
+    songs_changed(list(dict.fromkeys(updated_uuids)))
+    failed.sort(key=lambda item: item["index"])
+    return {"updated": updated_count, "failed": failed}
+
+def similarity_search(query: str, limit: int = 5, parallel: Optional[bool] = None) -> List[Dict[str, Any]]:
+    """
+    基于歌词相似度的深度搜索：n-gram 索引召回候选，再用 SequenceMatcher 精排。
+    返回的行与 get_songs 的搜索结果相同（列表列 + lyric_snippet）。
+    parallel 为 None 时取 LYRIC_PARALLEL_ENABLED；候选超过一块时交给进程池评分。
+    """
+    if parallel is None:
+        parallel = LYRIC_PARALLEL_ENABLED
     query_lower = query.lower()
-    scored_songs = []
-    for song in candidates:
-        lyric = song['lyrics'].lower()
-        matcher = SequenceMatcher(None, query_lower, lyric)
-        score = matcher.ratio() * 0.8  # 主要相似度
-
-        # 添加附加评分因素
-        if query_lower in lyric:
-            score += 0.15
-        if lyric.startswith(query_lower):
-            score += 0.05
-
-        if score > 0.4:  # 设置最低阈值
-            scored_songs.append((score, song['uuid']))
-
-    # 选取得分最高的歌曲
-    sorted_songs = sorted(scored_songs, key=lambda x: x[0], reverse=True)[:limit]
+    with db_connection() as conn:
+        candidates = None
+        if ensure_lyric_index(conn):
+            # 只读现有索引；未经 found 写入的歌词变更交给后台线程补建
+            lyric_index_syncer.wake()
+            candidates = _lyric_candidates(conn, query_lower)
+        if candidates is None:
+            cursor = conn.execute("SELECT uuid, lyrics FROM songs WHERE lyrics IS NOT NULL")
+            candidates = [dict(row) for row in cursor.fetchall()]
+
+    lyrics_by_uuid = {song['uuid']: song['lyrics'] for song in candidates}
+    if parallel and len(candidates) > LYRIC_PARALLEL_CHUNK_SIZE:
+        sorted_songs = _parallel_top_k(query_lower, candidates, limit)
+    else:
+        # 使用 SequenceMatcher 计算相似度
+        scored_songs = []
+        for song in candidates:
+            score = lyric_score(query_lower, song['lyrics'].lower())
+            if score > LYRIC_SCORE_THRESHOLD:  # 设置最低阈值
+                scored_songs.append((score, song['uuid']))
+
+        # 选取得分最高的歌曲
+        sorted_songs = sorted(scored_songs, key=lambda x: x[0], reverse=True)[:limit]
     uuids = [uid for _, uid in sorted_songs]
     if not uuids:
         return []
 
-    # 根据排序后的 uuid 列表获取完整歌曲信息
+    # 根据排序后的 uuid 列表获取列表列，歌词片段直接从已取回的候选歌词截取
     placeholders = ','.join('?' for _ in uuids)
     order_case = ' '.join(f'WHEN uuid = ? THEN {i}' for i, _ in enumerate(uuids))
     final_query = f"""
-        SELECT * FROM songs 
+        SELECT {', '.join(SEARCH_LIST_COLUMNS)} FROM songs 
         WHERE uuid IN ({placeholders})
         ORDER BY CASE {order_case} END
     """
     params = uuids + uuids  # 参数数量需与 CASE 子句匹配
     with db_connection() as conn:
         cursor = conn.execute(final_query, params)
-        return [dict(row) for row in cursor.fetchall()]
-    
+        results = [dict(row) for row in cursor.fetchall()]
+    for song in results:
+        song['lyric_snippet'] = _lyric_match_snippet(query_lower, lyrics_by_uuid[song['uuid']])
+    return results
+
+# ========================
+# 搜索结果缓存 (JSON 搜索接口)
+# ========================
+# search_songs 对每个查询计算一次完整的排序结果（主搜索 + 歌词相似度结果去重后附加），
+# 按 (规范化后的查询, 歌曲变更序号) 缓存在 LRU 中；分页只在缓存的列表上切片。
+# 变更序号来自数据库中由触发器维护的 song_changes 日志，后台等其他进程的写入同样生效：
+# 每次查询只读一次序号（主键上的 MAX），序号变了旧条目自然不再命中。
+# 写入期间开始的查询，结果存在旧序号下，不会被之后的查询取到。
+SEARCH_CACHE_SIZE = 256
+SEARCH_CACHE_TTL = 300.0     # 查询次数的变化不触发失效，由有效期控制排序的陈旧程度
+SEARCH_RESULT_LIMIT = 200    # 每个查询最多排序的主搜索结果数
+SEARCH_LYRIC_LIMIT = 20      # 每个查询最多附加的歌词相似度结果数
+SONG_CHANGES_KEEP = 10000    # song_changes 保留的最近变更数；落后更多的进程改为全量刷新
+
+search_cache = TTLCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
+_song_changes_ready = False
+
+
+def ensure_song_changes(conn: sqlite3.Connection) -> None:
+    """确保歌曲变更日志与触发器存在；query_count 的写回不算内容变更"""
+    global _song_changes_ready
+    if _song_changes_ready:
+        return
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS song_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            song_uuid TEXT NOT NULL
+        )
+    """)
+    watched = sorted((song_update_columns(conn) | {'uuid'}) - {'query_count'})
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS song_changes_ai AFTER INSERT ON songs BEGIN
+            INSERT INTO song_changes (song_uuid) VALUES (new.uuid);
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS song_changes_au AFTER UPDATE OF {', '.join(watched)} ON songs BEGIN
+            INSERT INTO song_changes (song_uuid) VALUES (old.uuid);
+            INSERT INTO song_changes (song_uuid) SELECT new.uuid WHERE new.uuid != old.uuid;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS song_changes_ad AFTER DELETE ON songs BEGIN
+            INSERT INTO song_changes (song_uuid) VALUES (old.uuid);
+        END
+    """)
+    conn.commit()
+    _song_changes_ready = True
+
+
+def song_change_seq() -> int:
+    """目前的歌曲变更序号（任何进程写入歌曲内容后都会增加）"""
+    with db_connection() as conn:
+        ensure_song_changes(conn)
+        return conn.execute("SELECT IFNULL(MAX(seq), 0) FROM song_changes").fetchone()[0]
+
+
+def song_changes_since(seq: int) -> Optional[tuple]:
+    """返回 (最新序号, seq 之后变更过的 uuid 列表)；日志已剪掉 seq 之后的部分时 uuid 列表为 None"""
+    with db_connection() as conn:
+        ensure_song_changes(conn)
+        oldest, latest = conn.execute(
+            "SELECT IFNULL(MIN(seq), 0), IFNULL(MAX(seq), 0) FROM song_changes"
+        ).fetchone()
+        if latest <= seq:
+            return latest, []
+        if oldest > seq + 1:
+            return latest, None
+        rows = conn.execute(
+            "SELECT DISTINCT song_uuid FROM song_changes WHERE seq > ? AND seq <= ?", (seq, latest)
+        ).fetchall()
+    return latest, [row[0] for row in rows]
+
+
+def prune_song_changes(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        "DELETE FROM song_changes WHERE seq <= (SELECT MAX(seq) FROM song_changes) - ?",
+        (SONG_CHANGES_KEEP,)
+    )
+
+
+def songs_changed(song_uuids: List[str]) -> None:
+    """
+    本进程写入歌曲后调用：剪短变更日志，并让本进程的自动补全索引立即追上（耗时留在写入端）。
+    搜索缓存与其他进程的索引依变更序号自行失效，不依赖此调用。
+    """
+    if not song_uuids:
+        return
+    with db_connection() as conn:
+        ensure_song_changes(conn)
+        prune_song_changes(conn)
+    from app import autocomplete  # 延迟导入：autocomplete 依赖本模块
+    autocomplete.index.refresh()
+
+
+def search_key(
+    search_term: Optional[str] = None,
+    min_tempo: Optional[int] = None,
+    max_tempo: Optional[int] = None,
+    category: Optional[str] = None,
+    author: Optional[str] = None,
+    music_key: Optional[str] = None,
+    lyrics: Optional[str] = None
+) -> tuple:
+    """规范化的查询键：去除首尾空白、合并连续空白；检索词与歌词不区分大小写，其余字段为精确匹配"""
+    def text(value: Optional[str], fold: bool = False) -> Optional[str]:
+        value = ' '.join(value.split()) if value else ''
+        return (value.lower() if fold else value) or None
+    return (
+        text(search_term, fold=True), min_tempo, max_tempo,
+        text(category), text(author), text(music_key), text(lyrics, fold=True)
+    )
+
+
+def search_songs(
+    search_term: Optional[str] = None,
+    min_tempo: Optional[int] = None,
+    max_tempo: Optional[int] = None,
+    category: Optional[str] = None,
+    author: Optional[str] = None,
+    music_key: Optional[str] = None,
+    lyrics: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    完整的排序搜索结果（带缓存，调用方不可修改返回的列表与行）。
+    只给出 lyrics 时只做歌词相似度搜索；行的格式与 get_songs 的搜索结果相同。
+    """
+    key = search_key(search_term, min_tempo, max_tempo, category, author, music_key, lyrics)
+    cache_key = key + (song_change_seq(),)
+    results = search_cache.get(cache_key)
+    if results is not None:
+        return results
+
+    search_term, min_tempo, max_tempo, category, author, music_key, lyrics = key
+    results = []
+    if not lyrics or any(value is not None for value in key[:-1]):
+        with db_connection() as conn:
+            results = _search_rows(
+                conn, search_term, min_tempo, max_tempo, category, author, music_key, SEARCH_RESULT_LIMIT
+            )
+    if lyrics:
+        seen_uuids = {song['uuid'] for song in results}
+        results.extend(
+            song for song in similarity_search(lyrics, limit=SEARCH_LYRIC_LIMIT)
+            if song['uuid'] not in seen_uuids
+        )
+    search_cache.set(cache_key, results)
+    return results
+
 # ========================
 # 歌单管理系统
 # ========================
@@ -434,29 +1915,64 @@ def create_playlist(user_id: int, name: str) -> Dict[str, Any]:
     with db_connection() as conn:
         try:
             with conn:
-                # 使用事务保证原子性
+                # 使用事务保证原子性（连接来自连接池，total_changes 为累计值，需取差值）
+                changes_before = conn.total_changes
                 conn.execute("""
                     INSERT INTO playlists (user_id, name)
                     SELECT ?, ?
                     WHERE (SELECT COUNT(*) FROM playlists WHERE user_id = ?) < 50
                 """, (user_id, name, user_id))
                 
-                if conn.total_changes == 0:
+                if conn.total_changes == changes_before:
                     return {"status": "error", "message": "歌单数量已达上限（50个）"}
                 
                 playlist_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
-                return {"status": "success", "playlist_id": playlist_id}
+            user_playlists_cache.invalidate(user_id)
+            return {"status": "success", "playlist_id": playlist_id}
         except sqlite3.IntegrityError:
             return {"status": "error", "message": "歌单名称已存在"}
 
+def rename_playlist(user_id: int, playlist_id: int, name: str) -> Dict[str, Any]:
+    """重命名歌单（仅限歌单所有者）"""
+    with db_connection() as conn:
+        try:
+            cursor = conn.execute(
+                "UPDATE playlists SET name = ? WHERE playlist_id = ? AND user_id = ?",
+                (name, playlist_id, user_id)
+            )
+        except sqlite3.IntegrityError:
+            return {"status": "error", "message": "歌单名称已存在"}
+    if cursor.rowcount == 0:
+        return {"status": "error", "message": "歌单不存在"}
+    user_playlists_cache.invalidate(user_id)
+    return {"status": "success"}
+
+def delete_playlist(user_id: int, playlist_id: int) -> Dict[str, Any]:
+    """删除歌单（仅限歌单所有者，歌单歌曲随外键级联删除）"""
+    with db_connection() as conn:
+        cursor = conn.execute(
+            "DELETE FROM playlists WHERE playlist_id = ? AND user_id = ?",
+            (playlist_id, user_id)
+        )
+    if cursor.rowcount == 0:
+        return {"status": "error", "message": "歌单不存在"}
+    user_playlists_cache.invalidate(user_id)
+    export.invalidate_playlist_exports(playlist_id)
+    return {"status": "success"}
+
 def manage_playlist_songs(playlist_id: int, song_uuids: List[str], action: str = 'add') -> Dict[str, Any]:
     """批量管理歌单歌曲（添加/删除）"""
     if action not in ('add', 'remove'):
         return {"status": "error", "message": "无效操作类型"}
 
+    global _cooccurrence_writes
     with db_connection() as conn:
+        ensure_cooccurrence(conn)  # 共现计数由 playlist_songs 触发器维护
         try:
             with conn:
+                songs_before = conn.execute(
+                    "SELECT COUNT(*) FROM playlist_songs WHERE playlist_id = ?", (playlist_id,)
+                ).fetchone()[0]
                 if action == 'add':
                     # 使用 INSERT OR IGNORE 避免重复添加
                     conn.executemany(
@@ -468,9 +1984,135 @@ def manage_playlist_songs(playlist_id: int, song_uuids: List[str], action: str =
                         "DELETE FROM playlist_songs WHERE playlist_id = ? AND song_uuid = ?",
                         [(playlist_id, uid) for uid in song_uuids]
                     )
-                return {"status": "success", "affected_rows": conn.total_changes}
+                # total_changes 会把共现触发器的写入也算进去，这里改为比较歌单歌曲数
+                songs_after = conn.execute(
+                    "SELECT COUNT(*) FROM playlist_songs WHERE playlist_id = ?", (playlist_id,)
+                ).fetchone()[0]
+                affected_rows = abs(songs_after - songs_before)
         except sqlite3.Error as e:
             return {"status": "error", "message": f"数据库错误: {str(e)}"}
+        _cooccurrence_writes += 1
+        if _cooccurrence_writes % COOCCURRENCE_PRUNE_EVERY == 0:
+            prune_cooccurrence(conn)
+    if affected_rows:
+        export.invalidate_playlist_exports(playlist_id)  # 歌单内容已变，旧的导出缓存作废
+    return {"status": "success", "affected_rows": affected_rows}
+
+def invalidate_song_exports(song_uuids: List[str]) -> None:
+    """歌曲被编辑后，清除包含这些歌曲的歌单导出缓存"""
+    if not song_uuids:
+        return
+    with db_connection() as conn:
+        rows = conn.execute("""
+            SELECT DISTINCT playlist_id FROM playlist_songs
+            WHERE song_uuid IN (SELECT value FROM json_each(?))
+        """, (json.dumps(song_uuids),)).fetchall()
+    for row in rows:
+        export.invalidate_playlist_exports(row['playlist_id'])
+
+# ========================
+# 歌单共现推荐 ("接着听")
+# ========================
+# song_cooccurrence 记录两首歌同时出现在多少个歌单中（双向各存一行，按 song_a 前缀查询）。
+# playlist_songs 上的触发器在加入 / 移除歌曲时增减计数，因此模型随歌单变动增量更新。
+# 行数超过 COOCCURRENCE_MAX_PAIRS 时从低计数开始剪枝，控制存储与查询成本。
+COOCCURRENCE_MAX_PAIRS = 500000
+COOCCURRENCE_PRUNE_EVERY = 100  # 每隔多少次歌单写入检查一次是否需要剪枝
+
+_cooccurrence_ready = False
+_cooccurrence_writes = 0
+
+
+def ensure_cooccurrence(conn: sqlite3.Connection) -> None:
+    """确保共现表与触发器存在；首次创建时从现有歌单全量统计"""
+    global _cooccurrence_ready
+    if _cooccurrence_ready:
+        return
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'song_cooccurrence'"
+    ).fetchone()
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS song_cooccurrence (
+            song_a TEXT NOT NULL,
+            song_b TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (song_a, song_b)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS song_cooccurrence_ai AFTER INSERT ON playlist_songs BEGIN
+            INSERT INTO song_cooccurrence (song_a, song_b, count)
+            SELECT new.song_uuid, song_uuid, 1 FROM playlist_songs
+            WHERE playlist_id = new.playlist_id AND song_uuid != new.song_uuid
+            ON CONFLICT (song_a, song_b) DO UPDATE SET count = count + 1;
+            INSERT INTO song_cooccurrence (song_a, song_b, count)
+            SELECT song_uuid, new.song_uuid, 1 FROM playlist_songs
+            WHERE playlist_id = new.playlist_id AND song_uuid != new.song_uuid
+            ON CONFLICT (song_a, song_b) DO UPDATE SET count = count + 1;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS song_cooccurrence_ad AFTER DELETE ON playlist_songs BEGIN
+            UPDATE song_cooccurrence SET count = count - 1
+            WHERE (song_a = old.song_uuid AND song_b IN (
+                      SELECT song_uuid FROM playlist_songs WHERE playlist_id = old.playlist_id))
+               OR (song_b = old.song_uuid AND song_a IN (
+                      SELECT song_uuid FROM playlist_songs WHERE playlist_id = old.playlist_id));
+            DELETE FROM song_cooccurrence
+            WHERE (song_a = old.song_uuid OR song_b = old.song_uuid) AND count <= 0;
+        END
+    """)
+    if not exists:
+        conn.execute("""
+            INSERT INTO song_cooccurrence (song_a, song_b, count)
+            SELECT a.song_uuid, b.song_uuid, COUNT(*)
+            FROM playlist_songs a
+            JOIN playlist_songs b
+              ON a.playlist_id = b.playlist_id AND a.song_uuid != b.song_uuid
+            GROUP BY a.song_uuid, b.song_uuid
+        """)
+    conn.commit()
+    _cooccurrence_ready = True
+
+
+def prune_cooccurrence(conn: sqlite3.Connection, max_pairs: Optional[int] = None) -> int:
+    """行数超过上限时，逐步提高门槛删除低计数的歌曲对，返回删除的行数"""
+    if max_pairs is None:
+        max_pairs = COOCCURRENCE_MAX_PAIRS
+    total = conn.execute("SELECT COUNT(*) FROM song_cooccurrence").fetchone()[0]
+    removed = 0
+    threshold = 1
+    while total - removed > max_pairs:
+        cursor = conn.execute("DELETE FROM song_cooccurrence WHERE count <= ?", (threshold,))
+        removed += cursor.rowcount
+        threshold += 1
+    return removed
+
+
+def get_playlist_continuations(playlist_id: int, limit: int = 5) -> List[Dict[str, Any]]:
+    """
+    "接着听"推荐：与歌单内歌曲共现次数最多、且尚未在歌单中的歌曲。
+    co_count 是与歌单内每首歌的共现次数之和（关联度），不是出现过的歌单数。
+    """
+    with db_connection() as conn:
+        ensure_cooccurrence(conn)
+        cursor = conn.execute("""
+            SELECT s.*, c.co_count
+            FROM (
+                SELECT co.song_b, SUM(co.count) AS co_count
+                FROM playlist_songs ps
+                JOIN song_cooccurrence co ON co.song_a = ps.song_uuid
+                WHERE ps.playlist_id = ?
+                  AND co.song_b NOT IN (
+                      SELECT song_uuid FROM playlist_songs WHERE playlist_id = ?)
+                GROUP BY co.song_b
+                ORDER BY co_count DESC
+                LIMIT ?
+            ) c
+            JOIN songs s ON s.uuid = c.song_b
+            ORDER BY c.co_count DESC, s.query_count DESC
+        """, (playlist_id, playlist_id, limit))
+        return [dict(row) for row in cursor.fetchall()]
 
 # ========================
 # 测试与示例
@@ -502,7 +2144,7 @@ if __name__ == '__main__':
         'tempo_start': 72,
         'tempo_end': 84
     }])
-    print("Batch update count:", batch_result)
+    print("Batch update result:", batch_result)
     
     # 测试基于歌词的相似搜索
     sim_results = similarity_search("you can dance")
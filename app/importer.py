@@ -0,0 +1,210 @@
+import io
+import os
+import csv
+import sys
+import json
+import time
+import uuid
+import sqlite3
+import argparse
+from typing import Any, Dict, IO, Iterator, List, Optional, Tuple
+
+from app import found
+from app import repository
+
+# ========================
+# 歌曲批量导入 (CSV / JSONL)
+# ========================
+# 逐行读取文件，按块校验后以 executemany 写入，每块一个事务；uuid 已存在时更新给出的列（upsert）。
+# 大批量导入（超过一块）期间暂停 songs_fts 的同步触发器（found.suspend_search_sync），结束后一次性重建全文索引，
+# 避免每插入一行就写一次 FTS；songs 的二级索引保持不变，导入期间其他连接的查询照常走索引。
+# 暂停时会在数据库中留下标记，进程中途退出时下次启动由 found.ensure_search_index 恢复。
+# 不足一块的小文件直接走触发器，免去整表重建。歌词索引、推荐向量仍由各自的队列触发器记录。
+IMPORT_CHUNK_SIZE = 10000          # 每个事务写入的行数
+IMPORT_MAX_REJECTS_REPORTED = 1000 # 报告中最多列出的被拒行数
+IMPORT_COLUMNS = ('uuid',) + repository.SONG_WRITABLE_COLUMNS
+REQUIRED_COLUMNS = ('song_title', 'path')
+INTEGER_COLUMNS = ('tempo_start', 'tempo_end')
+
+
+class ImportStats:
+    """单次导入的统计：读取 / 写入 / 拒绝行数与耗时"""
+
+    def __init__(self):
+        self.rows_read = 0
+        self.rows_imported = 0
+        self.rows_rejected = 0
+        self.rejected: List[Dict[str, Any]] = []
+        self.started_at = time.perf_counter()
+        self.total_time = 0.0
+
+    def reject(self, line: int, reason: str) -> None:
+        self.rows_rejected += 1
+        if len(self.rejected) < IMPORT_MAX_REJECTS_REPORTED:
+            self.rejected.append({"line": line, "reason": reason})
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "rows_read": self.rows_read,
+            "rows_imported": self.rows_imported,
+            "rows_rejected": self.rows_rejected,
+            "rejected": self.rejected,
+            "total_time": round(self.total_time, 4),
+            "rows_per_second": round(self.rows_imported / self.total_time) if self.total_time else 0,
+        }
+
+
+def iter_records(stream: IO[str], fmt: str) -> Iterator[Tuple[int, Any]]:
+    """逐行产出 (行号, 记录)；JSONL 中无法解析的行产出 (行号, None)"""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == 'jsonl':
+        for line_no, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                yield line_no, json.loads(line)
+            except ValueError:
+                yield line_no, None
+    else:
+        raise ValueError(f"不支持的导入格式: {fmt}")
+
+
+def detect_format(filename: str) -> str:
+    extension = os.path.splitext(filename)[1].lower()
+    return {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}.get(extension, '')
+
+
+def validate_record(record: Any) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """校验并规整一行，返回 (行, None) 或 (None, 拒绝原因)"""
+    if not isinstance(record, dict):
+        return None, "无法解析的行"
+    unknown = [key for key in record if key not in IMPORT_COLUMNS]
+    if unknown:
+        return None, f"未知的列: {', '.join(map(str, unknown))}"
+
+    row = {}
+    for key, value in record.items():
+        if isinstance(value, str):
+            value = value.strip()
+        row[key] = None if value == '' else value
+    for key in REQUIRED_COLUMNS:
+        if not row.get(key):
+            return None, f"缺少必需字段: {key}"
+    for key in INTEGER_COLUMNS:
+        if row.get(key) is not None:
+            try:
+                row[key] = int(row[key])
+            except (TypeError, ValueError):
+                return None, f"{key} 不是整数"
+    if row.get('tempo_start') is not None and row.get('tempo_end') is not None \
+            and row['tempo_start'] > row['tempo_end']:
+        return None, "tempo_start 大于 tempo_end"
+    if not row.get('uuid'):
+        row['uuid'] = str(uuid.uuid4())
+    return row, None
+
+
+def _upsert_sql(columns: Tuple[str, ...]) -> str:
+    updates = ', '.join(f"{name} = excluded.{name}" for name in columns if name != 'uuid')
+    return f"""
+        INSERT INTO songs ({', '.join(columns)})
+        VALUES ({', '.join('?' for _ in columns)})
+        ON CONFLICT(uuid) DO UPDATE SET {updates}
+    """
+
+
+def _write_chunk(conn: sqlite3.Connection, chunk: List[Tuple[int, Dict[str, Any]]], stats: ImportStats) -> List[str]:
+    """按列集合分组 executemany 写入一块；某组失败时逐行重试以找出出错的行"""
+    groups: Dict[Tuple[str, ...], List[Tuple[int, Dict[str, Any]]]] = {}
+    for line, row in chunk:
+        groups.setdefault(tuple(sorted(row, key=IMPORT_COLUMNS.index)), []).append((line, row))
+
+    imported = []
+    for columns, rows in groups.items():
+        sql = _upsert_sql(columns)
+        try:
+            conn.execute("SAVEPOINT import_group")
+            conn.executemany(sql, [[row[name] for name in columns] for _, row in rows])
+            conn.execute("RELEASE import_group")
+            imported.extend(row['uuid'] for _, row in rows)
+        except sqlite3.Error:
+            conn.execute("ROLLBACK TO import_group")
+            conn.execute("RELEASE import_group")
+            for line, row in rows:
+                try:
+                    conn.execute(sql, [row[name] for name in columns])
+                    imported.append(row['uuid'])
+                except sqlite3.Error as e:
+                    stats.reject(line, str(e))
+    conn.commit()
+    stats.rows_imported += len(imported)
+    return imported
+
+
+def import_songs(stream: IO[str], fmt: str, chunk_size: int = IMPORT_CHUNK_SIZE,
+                 defer_indexes: Optional[bool] = None) -> ImportStats:
+    """从文本流导入歌曲，返回统计；defer_indexes 为 None 时仅在数据超过一块时推迟索引维护"""
+    stats = ImportStats()
+    imported: List[str] = []
+    with found.db_connection() as conn:
+        found.ensure_search_index(conn)
+        deferred = found.suspend_search_sync(conn) if defer_indexes else False
+        try:
+            chunk = []
+            for line, record in iter_records(stream, fmt):
+                stats.rows_read += 1
+                row, error = validate_record(record)
+                if error:
+                    stats.reject(line, error)
+                    continue
+                chunk.append((line, row))
+                if len(chunk) >= chunk_size:
+                    if defer_indexes is None and not imported and not deferred:
+                        deferred = found.suspend_search_sync(conn)
+                    imported.extend(_write_chunk(conn, chunk, stats))
+                    chunk = []
+            if chunk:
+                imported.extend(_write_chunk(conn, chunk, stats))
+        finally:
+            conn.rollback()
+            if deferred:
+                found.resume_search_sync(conn)
+        found.sync_lyric_index(conn)  # 在导入端建好歌词索引，不留给第一个搜索请求
+
+    found.invalidate_song_exports(imported)
+    found.songs_changed(imported)
+    found.trending.invalidate()
+    stats.total_time = time.perf_counter() - stats.started_at
+    return stats
+
+
+def import_file(path: str, fmt: Optional[str] = None, **options) -> ImportStats:
+    fmt = fmt or detect_format(path)
+    with open(path, encoding='utf-8-sig', newline='') as stream:
+        return import_songs(stream, fmt, **options)
+
+
+def import_upload(file_storage, fmt: Optional[str] = None, **options) -> ImportStats:
+    """导入 Flask 上传的文件（werkzeug FileStorage），边读边写，不整份读入内存"""
+    fmt = fmt or detect_format(file_storage.filename or '')
+    stream = io.TextIOWrapper(file_storage.stream, encoding='utf-8-sig', newline='')
+    return import_songs(stream, fmt, **options)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="批量导入歌曲 (CSV / JSONL)")
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=['csv', 'jsonl'])
+    parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE)
+    parser.add_argument('--keep-indexes', action='store_true', help="导入期间不暂停全文索引同步")
+    args = parser.parse_args()
+
+    result = import_file(
+        args.path, args.format, chunk_size=args.chunk_size,
+        defer_indexes=False if args.keep_indexes else None
+    )
+    json.dump(result.as_dict(), sys.stdout, ensure_ascii=False, indent=2)
+    print()
@@ -0,0 +1,209 @@
+import os
+import sys
+import json
+import time
+import uuid
+import hashlib
+import argparse
+import sqlite3
+from typing import Any, BinaryIO, Dict, List, Optional
+
+from werkzeug.utils import secure_filename
+
+from app import found
+
+# ========================
+# 内容寻址的媒体存储
+# ========================
+# 上传的文件按 SHA-256 存放在 <上传目录>/objects/ab/cd/<sha256><扩展名>，内容相同的文件只存一份；
+# 歌曲的 path / img_url / mp3_url 直接指向对象文件。hash 在写入临时文件的同时计算，不需再读一遍。
+# 引用计数以 songs 的三个路径列为准，gc() 删除超过宽限期仍无人引用的对象。
+MEDIA_OBJECTS_DIR = 'objects'
+MEDIA_TMP_DIR = '.tmp'
+MEDIA_BUFFER_SIZE = 64 * 1024
+MEDIA_GC_GRACE = 3600  # 新对象的宽限期（秒）：刚上传、尚未保存到歌曲的文件不会被回收
+
+_tables_ready = False
+
+
+def ensure_media_table(conn: sqlite3.Connection) -> None:
+    global _tables_ready
+    if _tables_ready:
+        return
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS media_objects (
+            sha256 TEXT NOT NULL,
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_media_objects_sha256 ON media_objects(sha256)")
+    conn.commit()
+    _tables_ready = True
+
+
+def object_path(root: str, digest: str, filename: str) -> str:
+    """对象文件的路径：以 hash 前两级分目录，保留原扩展名以便按类型提供"""
+    extension = os.path.splitext(secure_filename(filename or ''))[1].lower()
+    return os.path.join(root, MEDIA_OBJECTS_DIR, digest[:2], digest[2:4], digest + extension)
+
+
+def object_digest(path: str) -> Optional[str]:
+    """path 为存储中的对象时返回其 sha256（由文件名与分片目录判断），否则 None"""
+    name = os.path.basename(path or '')
+    digest = os.path.splitext(name)[0]
+    if len(digest) != 64 or any(c not in '0123456789abcdef' for c in digest):
+        return None
+    shard = os.path.dirname(path)
+    if os.path.basename(shard) != digest[2:4] or os.path.basename(os.path.dirname(shard)) != digest[:2]:
+        return None
+    return digest
+
+
+def _register(path: str, digest: str, size: int) -> None:
+    with found.db_connection() as conn:
+        ensure_media_table(conn)
+        conn.execute("""
+            INSERT INTO media_objects (sha256, path, size, created_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(path) DO UPDATE SET created_at = excluded.created_at
+        """, (digest, path, size, time.time()))
+
+
+def _existing_object(digest: str) -> Optional[str]:
+    """已存储的同内容对象（扩展名可能不同）"""
+    with found.db_connection() as conn:
+        ensure_media_table(conn)
+        rows = conn.execute("SELECT path FROM media_objects WHERE sha256 = ?", (digest,)).fetchall()
+    return next((row['path'] for row in rows if os.path.exists(row['path'])), None)
+
+
+def adopt_file(root: str, source: str, digest: str, filename: str) -> str:
+    """把已算好 hash 的文件移入存储；已有相同内容时删除 source，返回对象路径"""
+    target = _existing_object(digest) or object_path(root, digest, filename)
+    if os.path.exists(target):
+        os.remove(source)
+    else:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(source, target)
+    _register(target, digest, os.path.getsize(target))
+    return target
+
+
+def store_stream(root: str, stream: BinaryIO, filename: str) -> str:
+    """边写临时文件边计算 hash，再交给 adopt_file 去重，返回对象路径"""
+    tmp_dir = os.path.join(root, MEDIA_TMP_DIR)
+    os.makedirs(tmp_dir, exist_ok=True)
+    tmp_path = os.path.join(tmp_dir, uuid.uuid4().hex)
+    hasher = hashlib.sha256()
+    try:
+        with open(tmp_path, 'wb') as f:
+            for block in iter(lambda: stream.read(MEDIA_BUFFER_SIZE), b''):
+                hasher.update(block)
+                f.write(block)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return adopt_file(root, tmp_path, hasher.hexdigest(), filename)
+
+
+def reference_counts(conn: sqlite3.Connection) -> Dict[str, int]:
+    """各对象被 songs.path / img_url / mp3_url 引用的次数"""
+    ensure_media_table(conn)
+    rows = conn.execute("""
+        SELECT o.path, COUNT(r.ref) AS refcount
+        FROM media_objects o
+        LEFT JOIN (
+            SELECT path AS ref FROM songs
+            UNION ALL SELECT img_url FROM songs
+            UNION ALL SELECT mp3_url FROM songs
+        ) r ON r.ref = o.path
+        GROUP BY o.path
+    """).fetchall()
+    return {row['path']: row['refcount'] for row in rows}
+
+
+def gc(root: str, grace: float = MEDIA_GC_GRACE, dry_run: bool = False) -> Dict[str, Any]:
+    """回收无人引用且超过宽限期的对象，以及残留的临时文件"""
+    deadline = time.time() - grace
+    removed, freed = [], 0
+    with found.db_connection() as conn:
+        counts = reference_counts(conn)
+        candidates = conn.execute(
+            "SELECT path, size FROM media_objects WHERE created_at < ?", (deadline,)
+        ).fetchall()
+        for row in candidates:
+            if counts.get(row['path']):
+                continue
+            removed.append(row['path'])
+            freed += row['size']
+            if dry_run:
+                continue
+            try:
+                os.remove(row['path'])
+            except FileNotFoundError:
+                pass
+            conn.execute("DELETE FROM media_objects WHERE path = ?", (row['path'],))
+
+    tmp_dir = os.path.join(root, MEDIA_TMP_DIR)
+    if not dry_run and os.path.isdir(tmp_dir):
+        for entry in os.scandir(tmp_dir):
+            if entry.stat().st_mtime < deadline:
+                os.remove(entry.path)
+    return {"removed": len(removed), "bytes_freed": freed, "paths": removed}
+
+
+def dedupe_existing(root: str) -> Dict[str, Any]:
+    """把上传目录中歌曲仍引用的旧式文件（<uuid>_<文件名>）移入存储并改写引用，重复的内容只保留一份"""
+    root_prefix = os.path.join(os.path.abspath(root), '')
+    objects_root = os.path.join(root_prefix, MEDIA_OBJECTS_DIR, '')
+    with found.db_connection() as conn:
+        paths = [row[0] for row in conn.execute("""
+            SELECT path FROM songs
+            UNION SELECT img_url FROM songs
+            UNION SELECT mp3_url FROM songs
+        """) if row[0]]
+
+    moved, bytes_saved = 0, 0
+    changed: List[str] = []
+    for old_path in paths:
+        absolute = os.path.abspath(old_path)
+        if not absolute.startswith(root_prefix) or absolute.startswith(objects_root) \
+                or not os.path.isfile(old_path):
+            continue
+        hasher = hashlib.sha256()
+        with open(old_path, 'rb') as f:
+            for block in iter(lambda: f.read(MEDIA_BUFFER_SIZE), b''):
+                hasher.update(block)
+        if _existing_object(hasher.hexdigest()):
+            bytes_saved += os.path.getsize(old_path)
+        target = adopt_file(root, old_path, hasher.hexdigest(), old_path)
+        with found.db_connection() as conn:
+            changed.extend(row[0] for row in conn.execute(
+                "SELECT uuid FROM songs WHERE path = ? OR img_url = ? OR mp3_url = ?",
+                (old_path, old_path, old_path)
+            ))
+            for column in ('path', 'img_url', 'mp3_url'):
+                conn.execute(f"UPDATE songs SET {column} = ? WHERE {column} = ?", (target, old_path))
+        moved += 1
+
+    # 路径已改写：清除仍指向旧路径的歌单导出缓存，并通知其他派生缓存
+    changed = list(dict.fromkeys(changed))
+    found.invalidate_song_exports(changed)
+    found.songs_changed(changed)
+    return {"files_moved": moved, "bytes_saved": bytes_saved}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="媒体存储维护")
+    parser.add_argument('command', choices=['gc', 'dedupe'])
+    parser.add_argument('root', help="上传目录")
+    parser.add_argument('--dry-run', action='store_true', help="gc 时只列出将删除的对象")
+    args = parser.parse_args()
+
+    if args.command == 'gc':
+        result = gc(args.root, dry_run=args.dry_run)
+    else:
+        result = dedupe_existing(args.root)
+    json.dump(result, sys.stdout, ensure_ascii=False, indent=2)
+    print()
@@ -2,10 +2,14 @@ from app import db
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 
+# 以下模型與 found.initialize_database 建立的實際資料表一一對應，僅作為結構描述；
+# 路由的讀寫一律經由 app/repository.py（共用 found 的連線池），不再透過 SQLAlchemy 查詢。
+
 # 多對多關聯表（playlist 和 song）
-playlist_song = db.Table('playlist_song',
-    db.Column('playlist_id', db.Integer, db.ForeignKey('playlists.id'), primary_key=True),
-    db.Column('song_id', db.Integer, db.ForeignKey('songs.id'), primary_key=True)  # 這裡不再用 `music.songs`
+playlist_song = db.Table('playlist_songs',
+    db.Column('playlist_id', db.Integer, db.ForeignKey('playlists.playlist_id', ondelete='CASCADE'), primary_key=True),
+    db.Column('song_uuid', db.Text, db.ForeignKey('songs.uuid', ondelete='CASCADE'), primary_key=True),
+    db.Column('added_at', db.DateTime, server_default=db.func.current_timestamp())
 )
 
 class User(UserMixin, db.Model):
@@ -13,6 +17,7 @@ class User(UserMixin, db.Model):
     user_id = db.Column(db.Integer, primary_key=True)  # 這裡是 user_id，不是 id
     username = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(128), nullable=False)
+    created_at = db.Column(db.DateTime, server_default=db.func.current_timestamp())
 
     playlists = db.relationship('Playlist', backref='creator', lazy='dynamic')
 
@@ -28,27 +33,29 @@ class User(UserMixin, db.Model):
 
 class Playlist(db.Model):
     __tablename__ = 'playlists'
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'), nullable=False)  # 修正這裡！
-    name = db.Column(db.String(255), nullable=False)
-    
+    __table_args__ = (db.UniqueConstraint('user_id', 'name'),)
+    playlist_id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.user_id', ondelete='CASCADE'), nullable=False)  # 修正這裡！
+    name = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, server_default=db.func.current_timestamp())
+
+    songs = db.relationship('Song', secondary=playlist_song, lazy='dynamic')
 
 
 class Song(db.Model):
     __tablename__ = 'songs'
-    id = db.Column(db.Integer, primary_key=True)
-    title = db.Column(db.String(256), nullable=False)
-    artist = db.Column(db.String(128))
-    category = db.Column(db.String(64))
-    tempo = db.Column(db.Integer)
+    uuid = db.Column(db.Text, primary_key=True)
+    song_title = db.Column(db.Text, nullable=False)
+    tags = db.Column(db.Text)  # 讓它支持標籤
+    music_key = db.Column(db.Text)
+    author = db.Column(db.Text)
     lyrics = db.Column(db.Text)
-    popularity = db.Column(db.Integer, default=0)  # 用於熱門歌曲排序
-    path = db.Column(db.String(512), nullable=False)  # 加上歌曲文件路徑
-    tags = db.Column(db.String(256))  # 讓它支持標籤
-
-from app import db
-from app.models import Song
-
-def get_trending_songs(limit=10):
-    return Song.query.order_by(Song.popularity.desc()).limit(limit).all()
-    
\ No newline at end of file
+    category = db.Column(db.Text)
+    tempo_start = db.Column(db.Integer)
+    tempo_end = db.Column(db.Integer)
+    source = db.Column(db.Text)
+    path = db.Column(db.Text, nullable=False)  # 加上歌曲文件路徑
+    query_count = db.Column(db.Integer, default=0)  # 用於熱門歌曲排序
+    img_url = db.Column(db.Text)
+    mp3_url = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, server_default=db.func.current_timestamp())
@@ -0,0 +1,388 @@
+import os
+import json
+import math
+import zlib
+import logging
+import threading
+import sqlite3
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # 未安装 NumPy 时 found.get_recommendations 退回 SQL 推荐
+    np = None
+
+from app import found
+
+logger = logging.getLogger(__name__)
+
+# ========================
+# 特征向量推荐引擎
+# ========================
+# 每首歌编码为一个 L2 归一化的 float32 向量，余弦相似度即为点积：
+#   调性 one-hot | 类别（哈希 one-hot）| 节奏范围（RBF 分箱）| 标签（哈希词袋）| 歌词（可选，哈希双字组对数 TF）
+# 向量存放在内存映射矩阵文件中（多个进程共用同一文件），uuid 与行号的对应关系存于 song_vectors 表，
+# 矩阵维度、容量与版本号存于 song_vector_meta。songs 写入时触发器把 uuid 放入 song_vector_queue，
+# 查询前在 BEGIN IMMEDIATE 写事务中增量更新对应行：同一时刻只有一个进程分配行号与扩容，
+# 每次提交递增版本号，其他进程发现版本变化后重新载入行号映射，容量变大时重新映射文件。
+# 相似度越大越相似；余弦为 0（没有任何共同特征）的歌曲不作为推荐。
+RECOMMEND_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance', 'recommend'
+)
+MUSIC_KEYS = [
+    'C', 'C#', 'Cm', 'D', 'D#', 'Dm', 'E', 'E#', 'Em', 'F', 'F#', 'Fm',
+    'G', 'G#', 'Gm', 'A', 'A#', 'Am', 'B', 'B#', 'Bm',
+]
+CATEGORY_DIMS = 16
+TAG_DIMS = 32
+LYRIC_DIMS = 64
+TEMPO_CENTERS = list(range(40, 241, 20))  # BPM 分箱中心
+TEMPO_SIGMA = 20.0
+RECOMMEND_USE_LYRICS = False
+FEATURE_WEIGHTS = {'key': 1.0, 'category': 1.0, 'tempo': 1.0, 'tags': 0.5, 'lyric_tf': 0.5}
+INITIAL_CAPACITY = 1024
+
+
+def feature_dim() -> int:
+    dim = len(MUSIC_KEYS) + 1 + CATEGORY_DIMS + len(TEMPO_CENTERS) + TAG_DIMS
+    if RECOMMEND_USE_LYRICS:
+        dim += LYRIC_DIMS
+    return dim
+
+
+def _bucket(text: str, dims: int) -> int:
+    """稳定哈希（内建 hash 每次启动会加盐，不能用于持久化的特征）"""
+    return zlib.crc32(text.encode('utf-8')) % dims
+
+
+def _parse_tempo(value: Any) -> Optional[float]:
+    """节奏值转为数字；后台表单会存入空字符串，空值或非数字视为未填写"""
+    if value is None:
+        return None
+    try:
+        tempo = float(value)
+    except (TypeError, ValueError):
+        return None
+    return tempo if math.isfinite(tempo) else None
+
+
+def encode_song(song: Dict[str, Any]) -> "np.ndarray":
+    """把一首歌编码为归一化特征向量"""
+    parts = []
+
+    key = np.zeros(len(MUSIC_KEYS) + 1, dtype=np.float32)
+    music_key = (song.get('music_key') or '').strip()
+    if music_key:
+        key[MUSIC_KEYS.index(music_key) if music_key in MUSIC_KEYS else len(MUSIC_KEYS)] = 1.0
+    parts.append(key * FEATURE_WEIGHTS['key'])
+
+    category = np.zeros(CATEGORY_DIMS, dtype=np.float32)
+    if song.get('category'):
+        category[_bucket(song['category'].strip().lower(), CATEGORY_DIMS)] = 1.0
+    parts.append(category * FEATURE_WEIGHTS['category'])
+
+    # 节奏范围：范围内的分箱为 1，范围外按距离高斯衰减，并归一化为单位向量
+    tempo = np.zeros(len(TEMPO_CENTERS), dtype=np.float32)
+    start, end = _parse_tempo(song.get('tempo_start')), _parse_tempo(song.get('tempo_end'))
+    if start is not None or end is not None:
+        start = start if start is not None else end
+        end = end if end is not None else start
+        for i, center in enumerate(TEMPO_CENTERS):
+            distance = max(start - center, center - end, 0.0)
+            tempo[i] = math.exp(-0.5 * (distance / TEMPO_SIGMA) ** 2)
+        tempo /= np.linalg.norm(tempo) or 1.0
+    parts.append(tempo * FEATURE_WEIGHTS['tempo'])
+
+    tags = np.zeros(TAG_DIMS, dtype=np.float32)
+    for tag in (song.get('tags') or '').split(','):
+        tag = tag.strip().lower()
+        if tag:
+            tags[_bucket(tag, TAG_DIMS)] += 1.0
+    tags /= np.linalg.norm(tags) or 1.0
+    parts.append(tags * FEATURE_WEIGHTS['tags'])
+
+    # 歌词只用词频不加 IDF：双字组哈希到 LYRIC_DIMS 个桶后，几乎每个桶都出现在每首歌中，IDF 趋近于零、没有区分度
+    if RECOMMEND_USE_LYRICS:
+        lyrics = np.zeros(LYRIC_DIMS, dtype=np.float32)
+        text = (song.get('lyrics') or '').lower()
+        for i in range(len(text) - 1):
+            gram = text[i:i + 2]
+            if not gram.isspace():
+                lyrics[_bucket(gram, LYRIC_DIMS)] += 1.0
+        lyrics = np.log1p(lyrics)  # 次线性词频，避免副歌重复主导
+        lyrics /= np.linalg.norm(lyrics) or 1.0
+        parts.append(lyrics * FEATURE_WEIGHTS['lyric_tf'])
+
+    vector = np.concatenate(parts)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class RecommendEngine:
+    """内存映射特征矩阵 + 批量余弦 top-k"""
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or RECOMMEND_DIR
+        self._lock = threading.RLock()
+        self._matrix = None
+        self._rows: Dict[str, int] = {}     # uuid -> 行号
+        self._uuids: List[Optional[str]] = []  # 行号 -> uuid（空行为 None）
+        self._free: List[int] = []
+        self._version: Optional[int] = None  # 已载入的 song_vector_meta.version
+        self._schema_ready = False
+
+    @property
+    def _matrix_path(self) -> str:
+        return os.path.join(self.directory, 'vectors.f32')
+
+    def _map(self, capacity: int) -> None:
+        self._matrix = np.memmap(
+            self._matrix_path, dtype=np.float32, mode='r+', shape=(capacity, feature_dim())
+        )
+
+    def _unmap(self) -> None:
+        if self._matrix is not None:
+            self._matrix.flush()
+            self._matrix = None
+
+    def _grow(self, conn: sqlite3.Connection, needed: int) -> None:
+        """扩容矩阵文件（调用方持有写事务）"""
+        capacity = self._matrix.shape[0]
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        # 先释放映射再扩展文件（Windows 不允许截断已映射的文件），新增部分由系统填零
+        self._unmap()
+        with open(self._matrix_path, 'r+b') as f:
+            f.truncate(capacity * feature_dim() * 4)
+        self._map(capacity)
+        conn.execute("UPDATE song_vector_meta SET capacity = ? WHERE id = 1", (capacity,))
+
+    def _ensure_schema(self, conn: sqlite3.Connection) -> None:
+        if self._schema_ready:
+            return
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS song_vectors (
+                song_uuid TEXT PRIMARY KEY,
+                row_idx INTEGER NOT NULL UNIQUE
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS song_vector_meta (
+                id INTEGER PRIMARY KEY CHECK(id = 1),
+                dim INTEGER NOT NULL,
+                capacity INTEGER NOT NULL,
+                version INTEGER NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS song_vector_queue (
+                song_uuid TEXT PRIMARY KEY
+            )
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS song_vectors_ai AFTER INSERT ON songs BEGIN
+                INSERT OR IGNORE INTO song_vector_queue (song_uuid) VALUES (new.uuid);
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS song_vectors_au
+            AFTER UPDATE OF uuid, category, music_key, tempo_start, tempo_end, tags, lyrics ON songs BEGIN
+                INSERT OR IGNORE INTO song_vector_queue (song_uuid) VALUES (old.uuid);
+                INSERT OR IGNORE INTO song_vector_queue (song_uuid) VALUES (new.uuid);
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS song_vectors_ad AFTER DELETE ON songs BEGIN
+                INSERT OR IGNORE INTO song_vector_queue (song_uuid) VALUES (old.uuid);
+            END
+        """)
+        conn.commit()
+        self._schema_ready = True
+
+    def _matrix_valid(self, meta: Optional[sqlite3.Row]) -> bool:
+        if meta is None or meta['dim'] != feature_dim():
+            return False
+        try:
+            return os.path.getsize(self._matrix_path) >= meta['capacity'] * feature_dim() * 4
+        except OSError:
+            return False
+
+    def _open(self, conn: sqlite3.Connection) -> None:
+        """建立表与触发器；矩阵文件不存在或特征维度变化时（在写事务中）清空矩阵并全部重新入队"""
+        self._ensure_schema(conn)
+        if self._version is not None:
+            return
+        meta = conn.execute("SELECT dim, capacity, version FROM song_vector_meta WHERE id = 1").fetchone()
+        if self._matrix_valid(meta):
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            meta = conn.execute("SELECT dim, capacity, version FROM song_vector_meta WHERE id = 1").fetchone()
+            if not self._matrix_valid(meta):  # 其他进程可能刚完成初始化
+                self._unmap()
+                with open(self._matrix_path, 'wb') as f:
+                    f.truncate(INITIAL_CAPACITY * feature_dim() * 4)
+                conn.execute("DELETE FROM song_vectors")
+                conn.execute("INSERT OR IGNORE INTO song_vector_queue (song_uuid) SELECT uuid FROM songs")
+                conn.execute("""
+                    INSERT OR REPLACE INTO song_vector_meta (id, dim, capacity, version)
+                    VALUES (1, ?, ?, ?)
+                """, (feature_dim(), INITIAL_CAPACITY, (meta['version'] + 1) if meta else 1))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def _refresh(self, conn: sqlite3.Connection) -> None:
+        """版本号变化（其他进程写入了向量）时重新载入行号映射，容量变化时重新映射矩阵文件"""
+        meta = conn.execute("SELECT capacity, version FROM song_vector_meta WHERE id = 1").fetchone()
+        if meta['version'] == self._version:
+            return
+        if self._matrix is None or self._matrix.shape[0] != meta['capacity']:
+            self._unmap()
+            self._map(meta['capacity'])
+        self._rows = {row['song_uuid']: row['row_idx'] for row in conn.execute(
+            "SELECT song_uuid, row_idx FROM song_vectors"
+        ).fetchall()}
+        used = max(self._rows.values(), default=-1) + 1
+        self._uuids = [None] * used
+        for song_uuid, idx in self._rows.items():
+            self._uuids[idx] = song_uuid
+        self._free = [i for i, song_uuid in enumerate(self._uuids) if song_uuid is None]
+        self._version = meta['version']
+
+    def _sync_batch(self, conn: sqlite3.Connection, batch_size: int) -> int:
+        """在写事务中处理一批队列；行号分配、扩容与出队随事务一起提交，返回处理的歌曲数"""
+        conn.execute("BEGIN IMMEDIATE")  # 与其他进程串行，之后载入的行号映射在提交前不会被改动
+        self._refresh(conn)
+        pending = [row[0] for row in conn.execute(
+            "SELECT song_uuid FROM song_vector_queue LIMIT ?", (batch_size,)
+        ).fetchall()]
+        if not pending:
+            conn.commit()
+            return 0
+        songs = {row['uuid']: dict(row) for row in conn.execute("""
+            SELECT uuid, category, music_key, tempo_start, tempo_end, tags, lyrics
+            FROM songs WHERE uuid IN (SELECT value FROM json_each(?))
+        """, (json.dumps(pending),)).fetchall()}
+        for song_uuid in pending:
+            song = songs.get(song_uuid)
+            idx = self._rows.get(song_uuid)
+            if song is None:
+                if idx is not None:
+                    # 歌曲已删除：清空该行并回收
+                    self._matrix[idx] = 0.0
+                    self._uuids[idx] = None
+                    self._free.append(idx)
+                    del self._rows[song_uuid]
+                    conn.execute("DELETE FROM song_vectors WHERE song_uuid = ?", (song_uuid,))
+                continue
+            try:
+                vector = encode_song(song)
+            except Exception:
+                # 单行数据异常不能卡住整个队列：记录后照常出队，该歌曲下次修改时重新入队
+                logger.exception("无法编码歌曲 %s 的特征向量", song_uuid)
+                continue
+            if idx is None:
+                if self._free:
+                    idx = self._free.pop()
+                else:
+                    idx = len(self._uuids)  # 即 MAX(row_idx) + 1
+                    self._uuids.append(None)
+                    self._grow(conn, idx + 1)
+                self._rows[song_uuid] = idx
+                self._uuids[idx] = song_uuid
+                conn.execute(
+                    "INSERT INTO song_vectors (song_uuid, row_idx) VALUES (?, ?)",
+                    (song_uuid, idx)
+                )
+            self._matrix[idx] = vector
+        self._matrix.flush()  # 先落盘再提交，其他进程看到新版本时向量已可读
+        conn.executemany(
+            "DELETE FROM song_vector_queue WHERE song_uuid = ?",
+            [(uid,) for uid in pending]
+        )
+        conn.execute("UPDATE song_vector_meta SET version = version + 1 WHERE id = 1")
+        conn.commit()
+        self._version += 1
+        return len(pending)
+
+    def sync(self, conn: sqlite3.Connection, batch_size: int = 1000) -> int:
+        """处理待更新队列并追上其他进程的写入，返回本次处理的歌曲数"""
+        with self._lock:
+            self._open(conn)
+            processed = 0
+            while conn.execute("SELECT 1 FROM song_vector_queue LIMIT 1").fetchone():
+                conn.commit()  # 结束隐式读事务，才能开始 BEGIN IMMEDIATE
+                try:
+                    count = self._sync_batch(conn, batch_size)
+                except BaseException:
+                    conn.rollback()
+                    self._version = None  # 内存中的映射可能已与数据库不一致，下次重新载入
+                    raise
+                if not count:
+                    break
+                processed += count
+            self._refresh(conn)
+            return processed
+
+    def top_k(self, song_uuids: List[str], limit: int) -> Dict[str, List[Tuple[str, float]]]:
+        """批量推荐：一次矩阵乘法算出所有种子歌曲与全曲库的余弦相似度，再各取前 limit 首（不含相似度为 0 的）"""
+        with self._lock:
+            seeds = [uid for uid in song_uuids if uid in self._rows]
+            results: Dict[str, List[Tuple[str, float]]] = {uid: [] for uid in song_uuids}
+            used = len(self._uuids)
+            if not seeds or used == 0 or limit <= 0:
+                return results
+            vectors = self._matrix[:used]
+            seed_rows = np.array([self._rows[uid] for uid in seeds])
+            scores = np.asarray(vectors[seed_rows] @ vectors.T)  # (种子数, 曲库大小)
+            empty = np.array([uid is None for uid in self._uuids])
+            scores[:, empty] = -np.inf
+            scores[np.arange(len(seeds)), seed_rows] = -np.inf  # 排除种子本身
+            k = min(limit, used)
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            for i, song_uuid in enumerate(seeds):
+                row_scores = scores[i, top[i]]
+                order = np.argsort(-row_scores)
+                # 特征均非负，余弦为 0 表示没有任何共同特征，不算相似
+                results[song_uuid] = [
+                    (self._uuids[top[i][j]], float(row_scores[j]))
+                    for j in order if np.isfinite(row_scores[j]) and row_scores[j] > 0
+                ]
+            return results
+
+
+engine = RecommendEngine()
+
+
+def available() -> bool:
+    return np is not None
+
+
+def recommend_batch(song_uuids: List[str], limit: int = 5) -> Dict[str, List[Dict[str, Any]]]:
+    """为多首种子歌曲同时推荐，返回 {种子 uuid: [歌曲信息（含 score）]}"""
+    with found.db_connection() as conn:
+        engine.sync(conn)
+        ranked = engine.top_k(song_uuids, limit)
+        wanted = {uid for pairs in ranked.values() for uid, _ in pairs}
+        songs = {row['uuid']: dict(row) for row in conn.execute(
+            "SELECT * FROM songs WHERE uuid IN (SELECT value FROM json_each(?))",
+            (json.dumps(sorted(wanted)),)
+        ).fetchall()}
+    results = {}
+    for seed, pairs in ranked.items():
+        results[seed] = []
+        for song_uuid, score in pairs:
+            if song_uuid in songs:
+                song = dict(songs[song_uuid])
+                song['score'] = score
+                results[seed].append(song)
+    return results
+
+
+def recommend(song_uuid: str, limit: int = 5) -> List[Dict[str, Any]]:
+    return recommend_batch([song_uuid], limit)[song_uuid]
@@ -0,0 +1,369 @@
+import json
+import base64
+import sqlite3
+from dataclasses import dataclass, fields
+from typing import Any, Dict, List, Optional, Tuple
+
+from app import found
+from app import media_store
+
+# ========================
+# 数据访问层
+# ========================
+# 路由与后台统一经此读写：连接只来自 found.db_connection()（同一个连接池），
+# SQL 全部是下面的模块常量 —— sqlite3 按语句文本缓存预编译语句（容量见 found.SQLITE_STATEMENT_CACHE），
+# 文本固定即可在每条连接上只编译一次。查询结果映射为带 __slots__ 的行对象，不再逐行复制成 dict。
+
+
+def _slotted(cls):
+    """
+    以字段名作为 __slots__ 重建 dataclass（等同 Python 3.10 的 dataclass(slots=True)，numpy 1.26 仍支持 3.9）。
+    默认值已写入生成的 __init__，去掉同名类属性后才能声明为 slot。
+    """
+    names = tuple(f.name for f in fields(cls))
+    namespace = {key: value for key, value in cls.__dict__.items()
+                 if key not in names and key not in ('__dict__', '__weakref__')}
+    namespace['__slots__'] = names
+    return type(cls)(cls.__name__, cls.__bases__, namespace)
+
+
+class _Row:
+    __slots__ = ()
+
+    @classmethod
+    def columns(cls) -> List[str]:
+        return [f.name for f in fields(cls)]
+
+    def as_dict(self) -> Dict[str, Any]:
+        """转成 dict（jsonify 用）"""
+        return {name: getattr(self, name) for name in self.columns()}
+
+
+@_slotted
+@dataclass(eq=False)
+class UserRow:
+    """
+    Flask-Login 的用户对象；不继承 UserMixin（它没有 __slots__，子类会带上 __dict__），直接实现所需接口。
+    不携带 password_hash：对象会进入用户缓存与会话，密码校验只在 found.login_user 中进行。
+    """
+    user_id: int
+    username: str
+
+    @property
+    def is_authenticated(self) -> bool:
+        return True
+
+    @property
+    def is_active(self) -> bool:
+        return True
+
+    @property
+    def is_anonymous(self) -> bool:
+        return False
+
+    def get_id(self):
+        return str(self.user_id)  # Flask-Login 要求字符串
+
+
+@_slotted
+@dataclass
+class SongRow(_Row):
+    uuid: str
+    song_title: str
+    tags: Optional[str]
+    music_key: Optional[str]
+    author: Optional[str]
+    lyrics: Optional[str]
+    category: Optional[str]
+    tempo_start: Optional[int]
+    tempo_end: Optional[int]
+    tempo_range: Optional[str]
+    source: Optional[str]
+    path: str
+    query_count: int
+    img_url: Optional[str]
+    mp3_url: Optional[str]
+    created_at: Optional[str]
+    added_at: Optional[str] = None  # 仅歌单歌曲查询时有值
+
+
+@_slotted
+@dataclass
+class PlaylistRow(_Row):
+    playlist_id: int
+    name: str
+    user_id: Optional[int] = None
+    created_at: Optional[str] = None
+    song_count: Optional[int] = None
+
+
+@_slotted
+@dataclass
+class SongListRow(_Row):
+    """后台列表只需要的列（不含歌词等大字段）"""
+    uuid: str
+    song_title: str
+    author: Optional[str]
+    category: Optional[str]
+    music_key: Optional[str]
+    query_count: int
+    created_at: Optional[str]
+
+
+# 可由表单 / 接口写入的歌曲列（uuid、生成列与统计列除外）
+SONG_WRITABLE_COLUMNS = (
+    'song_title', 'tags', 'music_key', 'author', 'lyrics', 'category',
+    'tempo_start', 'tempo_end', 'source', 'path', 'img_url', 'mp3_url'
+)
+
+_SONG_SELECT = ', '.join(f"s.{name}" for name in SongRow.columns() if name != 'added_at')
+
+SQL_USER_BY_USERNAME = "SELECT user_id, username FROM users WHERE username = ?"
+SQL_SONG_BY_UUID = f"SELECT {_SONG_SELECT}, NULL FROM songs s WHERE s.uuid = ?"
+SQL_PLAYLIST_SONGS = f"""
+    SELECT {_SONG_SELECT}, ps.added_at
+    FROM playlist_songs ps
+    JOIN songs s ON s.uuid = ps.song_uuid
+    WHERE ps.playlist_id = ?
+    ORDER BY ps.added_at
+"""
+SQL_USER_PLAYLISTS = """
+    SELECT p.playlist_id, p.name, p.user_id, p.created_at,
+           COUNT(ps.song_uuid) AS song_count
+    FROM playlists p
+    LEFT JOIN playlist_songs ps ON p.playlist_id = ps.playlist_id
+    WHERE p.user_id = ?
+    GROUP BY p.playlist_id
+    ORDER BY p.created_at DESC
+"""
+SQL_PLAYLIST = """
+    SELECT p.playlist_id, p.name, p.user_id, p.created_at,
+           COUNT(ps.song_uuid) AS song_count
+    FROM playlists p
+    LEFT JOIN playlist_songs ps ON p.playlist_id = ps.playlist_id
+    WHERE p.playlist_id = ? AND p.user_id = ?
+    GROUP BY p.playlist_id
+"""
+# 同一内容可能以不同扩展名登记多次：优先与网址文件名一致的对象，其次最早登记的，结果固定
+SQL_MEDIA_OBJECT = """
+    SELECT path FROM media_objects
+    WHERE sha256 = ?
+    ORDER BY path LIKE '%' || ? DESC, created_at, path
+    LIMIT 1
+"""
+SQL_UPDATE_SONG = f"""
+    UPDATE songs
+    SET {', '.join(f'{name} = ?' for name in SONG_WRITABLE_COLUMNS)}
+    WHERE uuid = ?
+"""
+
+
+# ========================
+# 用户
+# ========================
+def get_user(user_id: int) -> Optional[UserRow]:
+    """按 user_id 取用户（经 found 的用户缓存）"""
+    row = found.get_user(user_id)
+    return UserRow(**row) if row else None
+
+
+def get_user_by_username(username: str) -> Optional[UserRow]:
+    with found.db_connection() as conn:
+        row = conn.execute(SQL_USER_BY_USERNAME, (username,)).fetchone()
+    return UserRow(*row) if row else None
+
+
+# ========================
+# 歌单
+# ========================
+def get_user_playlists(user_id: int) -> List[PlaylistRow]:
+    """用户歌单的 id 与名称（经 found 的歌单缓存，供搜索页下拉框使用）"""
+    return [PlaylistRow(**playlist) for playlist in found.get_user_playlists(user_id)]
+
+
+def list_playlists(user_id: int) -> List[PlaylistRow]:
+    """用户歌单及歌曲数，新建的在前"""
+    with found.db_connection() as conn:
+        return [PlaylistRow(*row) for row in conn.execute(SQL_USER_PLAYLISTS, (user_id,))]
+
+
+def get_playlist(playlist_id: int, user_id: int) -> Optional[PlaylistRow]:
+    """取属于该用户的歌单；不存在或无权访问时返回 None"""
+    with found.db_connection() as conn:
+        row = conn.execute(SQL_PLAYLIST, (playlist_id, user_id)).fetchone()
+    return PlaylistRow(*row) if row else None
+
+
+def get_playlist_songs(playlist_id: int) -> List[SongRow]:
+    with found.db_connection() as conn:
+        return [SongRow(*row) for row in conn.execute(SQL_PLAYLIST_SONGS, (playlist_id,))]
+
+
+# ========================
+# 媒体对象
+# ========================
+def get_media_object_path(digest: str, name: str) -> Optional[str]:
+    """内容 hash 对应的存储路径；name 为网址中的文件名（hash + 扩展名）"""
+    with found.db_connection() as conn:
+        media_store.ensure_media_table(conn)
+        row = conn.execute(SQL_MEDIA_OBJECT, (digest, name)).fetchone()
+    return row['path'] if row else None
+
+
+# ========================
+# 歌曲
+# ========================
+def get_song(song_uuid: str) -> Optional[SongRow]:
+    with found.db_connection() as conn:
+        row = conn.execute(SQL_SONG_BY_UUID, (song_uuid,)).fetchone()
+    return SongRow(*row) if row else None
+
+
+def create_song(values: Dict[str, Any]) -> str:
+    """新增歌曲，只接受 SONG_WRITABLE_COLUMNS 中的列，返回 uuid"""
+    return found.create_song(**{
+        name: values[name] for name in SONG_WRITABLE_COLUMNS if name in values
+    })
+
+
+def update_song(song_uuid: str, values: Dict[str, Any]) -> bool:
+    """整行更新歌曲的可写列，并清除相关歌单的导出缓存与搜索缓存"""
+    params = [values.get(name) for name in SONG_WRITABLE_COLUMNS] + [song_uuid]
+    with found.db_connection() as conn:
+        updated = conn.execute(SQL_UPDATE_SONG, params).rowcount > 0
+        if updated:
+            conn.commit()
+            found.sync_lyric_index(conn)  # 歌词变更在写入端补建索引
+    if updated:
+        found.invalidate_song_exports([song_uuid])
+        found.songs_changed([song_uuid])
+    return updated
+
+
+# ========================
+# 后台歌曲列表（键集分页）
+# ========================
+# 以 (排序列, uuid) 作为游标，下一页从上一页最后一行之后继续，
+# 不用 OFFSET，翻到多深都只读取一页的行；每种排序都有对应的复合索引。
+SONG_LIST_PAGE_SIZE = 50
+SONG_LIST_MAX_PAGE_SIZE = 200
+SONG_LIST_SORTS = {
+    'newest': ('created_at', 'DESC'),
+    'oldest': ('created_at', 'ASC'),
+    'title': ('song_title', 'ASC'),
+    'popular': ('query_count', 'DESC'),
+}
+
+_song_list_indexes_ready = False
+
+
+def _ensure_song_list_indexes(conn: sqlite3.Connection) -> None:
+    global _song_list_indexes_ready
+    if _song_list_indexes_ready:
+        return
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_songs_created_uuid ON songs(created_at, uuid)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_songs_title_uuid ON songs(song_title, uuid)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_songs_query_count_uuid ON songs(query_count, uuid)")
+    conn.commit()
+    _song_list_indexes_ready = True
+
+
+def encode_cursor(value: Any, song_uuid: str) -> str:
+    raw = json.dumps([value, song_uuid], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Optional[Tuple[Any, str]]:
+    """解析游标；格式不正确时返回 None（当作第一页）"""
+    try:
+        value, song_uuid = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return value, str(song_uuid)
+    except (ValueError, TypeError):
+        return None
+
+
+def list_songs_page(
+    cursor: Optional[str] = None,
+    limit: int = SONG_LIST_PAGE_SIZE,
+    sort: str = 'newest',
+    search: Optional[str] = None,
+    category: Optional[str] = None
+) -> Tuple[List[SongListRow], Optional[str]]:
+    """取一页后台歌曲列表，返回 (行, 下一页游标)；没有下一页时游标为 None"""
+    column, direction = SONG_LIST_SORTS.get(sort, SONG_LIST_SORTS['newest'])
+    limit = max(1, min(int(limit), SONG_LIST_MAX_PAGE_SIZE))
+
+    conditions, params = [], []
+    if search:
+        conditions.append("(song_title LIKE ? OR author LIKE ?)")
+        params.extend([f"%{search}%"] * 2)
+    if category:
+        conditions.append("category = ?")
+        params.append(category)
+    position = decode_cursor(cursor) if cursor else None
+    if position is not None:
+        conditions.append(f"({column}, uuid) {'<' if direction == 'DESC' else '>'} (?, ?)")
+        params.extend(position)
+
+    query = f"""
+        SELECT {', '.join(SongListRow.columns())}
+        FROM songs
+        {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+        ORDER BY {column} {direction}, uuid {direction}
+        LIMIT ?
+    """
+    with found.db_connection() as conn:
+        _ensure_song_list_indexes(conn)
+        rows = [SongListRow(*row) for row in conn.execute(query, params + [limit + 1])]
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, column), last.uuid)
+    return rows, next_cursor
+
+
+def list_song_categories() -> List[str]:
+    """后台筛选下拉框使用的类别列表"""
+    with found.db_connection() as conn:
+        return [row[0] for row in conn.execute(
+            "SELECT DISTINCT category FROM songs WHERE category IS NOT NULL AND category != '' ORDER BY category"
+        )]
+
+
+# ========================
+# 搜索（JSON 接口的游标分页）
+# ========================
+# 排序结果由 found.search_songs 计算并缓存，这里只在其上切片。游标为 (已返回的行数, 最后一行的 uuid)：
+# 缓存失效后结果若有变动，从最后一行的新位置继续，找不到时才退回按行数继续。
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+
+
+def search_songs_page(
+    params: Dict[str, Any],
+    cursor: Optional[str] = None,
+    limit: int = SEARCH_PAGE_SIZE
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """取一页搜索结果，params 为 found.search_songs 的参数；返回 (行, 下一页游标)"""
+    limit = max(1, min(int(limit), SEARCH_MAX_PAGE_SIZE))
+    results = found.search_songs(**params)
+
+    start = 0
+    position = decode_cursor(cursor) if cursor else None
+    if position is not None:
+        offset, last_uuid = position
+        start = offset if isinstance(offset, int) and offset >= 0 else 0
+        if not (0 < start <= len(results) and results[start - 1]['uuid'] == last_uuid):
+            start = next(
+                (i + 1 for i, song in enumerate(results) if song['uuid'] == last_uuid), start
+            )
+
+    rows = results[start:start + limit]
+    # 查询次数交给写回缓冲，与 get_songs 一样按实际返回的行计数
+    found.query_counter.record([song['uuid'] for song in rows])
+    next_cursor = None
+    if start + limit < len(results):
+        next_cursor = encode_cursor(start + limit, rows[-1]['uuid'])
+    return rows, next_cursor
@@ -1,23 +1,19 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_user, logout_user, login_required, current_user
-from app import db, login_manager
-from app.models import User  # 請確保 User 模型正確定義
+from app import login_manager, repository, autocomplete
 # 將 found.py 的方法直接引入，確保 found.py 已包含這些方法的實作
 from app.found import (
     register_user,
     login_user as found_login_user,
-    get_trending_songs,
-    get_songs,
-    similarity_search
+    get_trending_songs
 )
-from sqlalchemy import text
 
 bp = Blueprint('auth', __name__, url_prefix='/auth')
 
 @login_manager.user_loader
 def load_user(user_id):
-    # 根據使用者主鍵（user_id）取得用戶資料
-    return User.query.get(int(user_id))
+    # 根據使用者主鍵（user_id）取得用戶資料；走 found 的快取，命中時不查資料庫
+    return repository.get_user(int(user_id))
 
 
 @bp.route('/login', methods=['GET', 'POST'])
@@ -27,9 +23,9 @@ def login():
         password = request.form.get('password')
 
         # 使用 found.py 的登入驗證邏輯
-        result = found_login_user(username, password)
+        result = found_login_user(username, password, ip=request.remote_addr)
         if result['status'] == 'success':
-            user = User.query.filter_by(username=username).first()
+            user = repository.get_user_by_username(username)
             if user:
                 login_user(user)
                 flash('登入成功', 'success')
@@ -57,7 +53,7 @@ def register():
         password = request.form.get('password')
 
         # 採用 found.py 中的註冊方法
-        result = register_user(username, password)
+        result = register_user(username, password, ip=request.remote_addr)
         if result['status'] == 'success':
             flash('註冊成功！請登入。', 'success')
             return redirect(url_for('auth.login'))
@@ -71,15 +67,13 @@ def register():
 @login_required
 def found():
     results = []
+    search_params = None
+    next_cursor = None
     top_songs = get_trending_songs(limit=10)
 
-    # 获取用户歌单
-    with db.engine.connect() as conn:
-        result = conn.execute(
-            text("SELECT playlist_id, name FROM playlists WHERE user_id = :user_id"),
-            {"user_id": current_user.user_id}
-        )
-        playlists = [dict(row._mapping) for row in result]
+    # 获取用户歌单（带缓存）
+    playlists = repository.get_user_playlists(current_user.user_id)
+    autocomplete.index.warm()  # 预先建立歌名栏的输入即搜索引
 
     if request.method == 'POST':
         # 获取所有表单参数
@@ -98,29 +92,22 @@ def found():
         except ValueError:
             tempo_start = tempo_end = None
 
-        # 执行主搜索
-        results = get_songs(
-            search_term=song_title,
-            author=author,
-            category=category,
-            music_key=music_key,
-            min_tempo=tempo_start,
-            max_tempo=tempo_end,
-            limit=20
-        )
-
-        # 附加歌词相似度搜索
-        if lyrics:
-            lyrics_results = similarity_search(lyrics, limit=5)
-            # 合并结果并去重
-            seen_uuids = {s['uuid'] for s in results}
-            for song in lyrics_results:
-                if song['uuid'] not in seen_uuids:
-                    results.append(song)
-                    seen_uuids.add(song['uuid'])
+        # 主搜索与歌词相似度搜索合并排序（带缓存），先取第一页，其余由页面经 /songs/search 续载
+        search_params = {
+            'search_term': song_title,
+            'author': author,
+            'category': category,
+            'music_key': music_key,
+            'min_tempo': tempo_start,
+            'max_tempo': tempo_end,
+            'lyrics': lyrics
+        }
+        results, next_cursor = repository.search_songs_page(search_params)
 
     return render_template('found.html', 
                          results=results, 
+                         search_params=search_params,
+                         next_cursor=next_cursor,
                          top_songs=top_songs, 
                          playlists=playlists)
     # 將搜尋結果、熱門歌曲及歌單傳遞給模板
\ No newline at end of file
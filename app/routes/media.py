@@ -0,0 +1,105 @@
+import os
+import re
+from flask import Blueprint, abort, send_file, url_for, redirect, request
+from flask_login import login_required
+from app import media_store
+from app import repository
+from app import thumbnails
+
+bp = Blueprint('media', __name__, url_prefix='/media')
+
+# 內容定址的對象（見 media_store）：檔名即內容 hash，網址不變內容就不變，可永久快取
+OBJECT_NAME = re.compile(r'^([0-9a-f]{64})(\.[a-z0-9]+)?$')
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+MEDIA_COLUMNS = {'audio': 'mp3_url', 'image': 'img_url', 'file': 'path'}
+
+
+def _song_value(song, column):
+    return song[column] if isinstance(song, dict) else getattr(song, column)
+
+
+@bp.app_template_global()
+def media_url(song, kind):
+    """模板用：取得歌曲媒體的網址；外部網址原樣回傳，存儲對象走可永久快取的網址"""
+    value = _song_value(song, MEDIA_COLUMNS[kind])
+    if not value:
+        return ''
+    if value.startswith(('http://', 'https://', '/media/')):
+        return value
+    if media_store.object_digest(value):
+        return url_for('media.serve_object', name=os.path.basename(value))
+    return url_for('media.serve_song_media', song_uuid=_song_value(song, 'uuid'), kind=kind)
+
+
+@bp.app_template_global()
+def thumbnail_srcset(song, fmt):
+    """模板用：封面各寬度縮圖的 srcset；無法產生縮圖（外部網址、未安裝 Pillow）時回傳空字串"""
+    source = _song_value(song, 'img_url')
+    if not source or source.startswith(('http://', 'https://', '/media/')) or not thumbnails.available():
+        return ''
+    key = thumbnails.source_key(source)
+    if not key:
+        return ''
+    song_uuid = _song_value(song, 'uuid')
+    return ', '.join(
+        f"{url_for('media.serve_thumbnail', song_uuid=song_uuid, width=width, fmt=fmt, v=key)} {width}w"
+        for width in thumbnails.THUMBNAIL_WIDTHS
+    )
+
+
+def _send(path, etag=True, max_age=None, immutable=False):
+    # conditional=True：send_file 處理 If-None-Match / If-Modified-Since（304）與 Range（206，供音訊拖動）；
+    # 整檔回應時交給 WSGI 伺服器的 file_wrapper（如 gunicorn 以 sendfile 零拷貝傳送），
+    # 設定 USE_X_SENDFILE 時則由前端代理伺服器直接讀檔
+    if not os.path.isfile(path):
+        abort(404)
+    response = send_file(path, conditional=True, etag=etag, max_age=max_age)
+    if immutable:
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True  # 路徑可能被編輯覆寫，每次以 ETag 重新驗證
+    return response
+
+
+@bp.route('/o/<name>')
+@login_required
+def serve_object(name):
+    """以內容 hash 提供存儲對象：強 ETag 即 hash，Cache-Control 為 immutable"""
+    match = OBJECT_NAME.match(name)
+    if not match:
+        abort(404)
+    path = repository.get_media_object_path(match.group(1), name)
+    if not path:
+        abort(404)
+    return _send(path, etag=match.group(1), max_age=IMMUTABLE_MAX_AGE, immutable=True)
+
+
+@bp.route('/song/<song_uuid>/<kind>')
+@login_required
+def serve_song_media(song_uuid, kind):
+    """提供舊式路徑（非內容定址）的歌曲媒體，ETag 依修改時間與大小產生"""
+    if kind not in MEDIA_COLUMNS:
+        abort(404)
+    song = repository.get_song(song_uuid)
+    path = getattr(song, MEDIA_COLUMNS[kind]) if song else None
+    if not path:
+        abort(404)
+    return _send(path)
+
+
+@bp.route('/thumb/<song_uuid>/<int:width>.<fmt>')
+@login_required
+def serve_thumbnail(song_uuid, width, fmt):
+    """封面縮圖：網址帶來源鍵 v，與目前來源一致時可永久快取；尚未產生完成時先導向原圖"""
+    if width not in thumbnails.THUMBNAIL_WIDTHS or fmt not in thumbnails.THUMBNAIL_FORMATS:
+        abort(404)
+    song = repository.get_song(song_uuid)
+    if not song or not song.img_url:
+        abort(404)
+    path, key = thumbnails.get_thumbnail(song.img_url, width, fmt)
+    if not path:
+        return redirect(media_url(song, 'image'))
+    if request.args.get('v') == key:
+        return _send(path, etag=f"{key}-{width}-{fmt}", max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    return _send(path, etag=f"{key}-{width}-{fmt}")
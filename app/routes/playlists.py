@@ -1,9 +1,10 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, send_file
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, send_file, Response, stream_with_context, current_app
 from flask_login import login_required, current_user
-import os
-import zipfile
-import io
+from urllib.parse import quote
 from app import found  # 直接导入 found 模块
+from app import export
+from app import export_jobs
+from app import repository
 
 bp = Blueprint('playlist', __name__, url_prefix='/playlist')
 
@@ -11,18 +12,7 @@ bp = Blueprint('playlist', __name__, url_prefix='/playlist')
 @login_required
 def list_playlists():
     """显示用户的所有歌单"""
-    with found.db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT p.playlist_id, p.name, p.created_at,
-                   COUNT(ps.song_uuid) as song_count
-            FROM playlists p
-            LEFT JOIN playlist_songs ps ON p.playlist_id = ps.playlist_id
-            WHERE p.user_id = ?
-            GROUP BY p.playlist_id
-            ORDER BY p.created_at DESC
-        """, (current_user.user_id,))  # 使用 user_id 而非 id
-        playlists = [dict(row) for row in cursor.fetchall()]
+    playlists = repository.list_playlists(current_user.user_id)  # 使用 user_id 而非 id
     return render_template('list.html', playlists=playlists)
 
 @bp.route('/create', methods=['POST'])
@@ -41,16 +31,7 @@ def create_playlist():
 
     if result['status'] == 'success':
         # 获取完整歌单信息
-        with found.db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT p.playlist_id, p.name, p.created_at, 
-                       COUNT(ps.song_uuid) as song_count 
-                FROM playlists p
-                LEFT JOIN playlist_songs ps ON p.playlist_id = ps.playlist_id
-                WHERE p.playlist_id = ?
-            """, (result['playlist_id'],))
-            new_playlist = dict(cursor.fetchone())
+        new_playlist = repository.get_playlist(result['playlist_id'], current_user.user_id).as_dict()
         return jsonify({
             'success': True,
             'message': '歌单创建成功',
@@ -73,14 +54,8 @@ def add_song(playlist_id):
         return jsonify({'success': False, 'message': '未指定歌曲'}), 400
 
     # 权限验证：确保该歌单属于当前用户
-    with found.db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT playlist_id FROM playlists 
-            WHERE playlist_id = ? AND user_id = ? 
-        """, (playlist_id, current_user.user_id))
-        if not cursor.fetchone():
-            return jsonify({'success': False, 'message': '无权限操作'}), 403
+    if not repository.get_playlist(playlist_id, current_user.user_id):
+        return jsonify({'success': False, 'message': '无权限操作'}), 403
 
     # 调用 found.py 的歌曲管理函数
     result = found.manage_playlist_songs(
@@ -108,17 +83,21 @@ def add_song(playlist_id):
 def export_playlist(playlist_id):
     """導出歌單（保留原始資料夾結構）"""
     # 驗證歌單所有權
-    with found.db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT name FROM playlists 
-            WHERE playlist_id = ? AND user_id = ?
-        """, (playlist_id, current_user.user_id))
-        playlist = cursor.fetchone()
-        if not playlist:
-            flash('歌單不存在或無權訪問', 'danger')
-            return redirect(url_for('playlist.list_playlists'))
-    playlist_name = playlist['name']
+    playlist = repository.get_playlist(playlist_id, current_user.user_id)
+    if not playlist:
+        flash('歌單不存在或無權訪問', 'danger')
+        return redirect(url_for('playlist.list_playlists'))
+    playlist_name = playlist.name
+
+    # 非同步模式：交給後台任務產生壓縮包，立即回傳任務 id 供輪詢進度
+    if request.args.get('async') in ('1', 'true'):
+        job_id = export_jobs.enqueue_export(playlist_id, current_user.user_id)
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'progress_url': url_for('playlist.export_job_status', job_id=job_id),
+            'download_url': url_for('playlist.export_job_download', job_id=job_id)
+        }), 202
 
     # 獲取歌單歌曲
     songs = found.get_songs(playlist_id=playlist_id, limit=None)
@@ -126,21 +105,88 @@ def export_playlist(playlist_id):
         flash('歌單中沒有歌曲', 'warning')
         return redirect(url_for('playlist.view_playlist', playlist_id=playlist_id))
 
-    # 創建 ZIP 文件（在內存中生成）
-    memory_file = io.BytesIO()
-    with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
-        for song in songs:
-            file_path = song.get('path')
-            print(song.get('path'))
-            
-            if file_path and os.path.exists(file_path):
-                # 將文件放入以歌單名稱命名的資料夾中
-                file_name = os.path.basename(file_path)
-                arcname = os.path.join(playlist_name, file_name)
-                zf.write(file_path, arcname=arcname)
-                
-    memory_file.seek(0)
-    return send_file(memory_file, download_name=f"{playlist_name}.zip", as_attachment=True)
+    # 依內容計算快取鍵，同時作為 ETag；內容未變時客戶端可直接使用本地副本
+    zip_name = f"{playlist_name}.zip"
+    cache_key = export.export_cache_key(playlist_id, playlist_name, songs)
+    if cache_key in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(cache_key)
+        return response
+
+    # 命中快取：send_file 負責 If-None-Match 與 Range（斷點續傳）
+    cached_path = export.cached_export_path(playlist_id, cache_key)
+    if cached_path:
+        return send_file(
+            cached_path,
+            mimetype='application/zip',
+            as_attachment=True,
+            download_name=zip_name,
+            etag=cache_key,
+            conditional=True
+        )
+
+    # 未命中：以生成器逐塊輸出 ZIP，記憶體佔用固定，同時寫入快取
+    stats = export.ExportStats()
+    body = export.cache_stream(
+        playlist_id,
+        cache_key,
+        export.stream_zip(
+            export.playlist_members(playlist_name, songs),
+            stats=stats,
+            manifest_dir=playlist_name
+        )
+    )
+
+    def generate():
+        yield from body
+        current_app.logger.info("歌單 %s 匯出完成: %s", playlist_id, stats.as_dict())
+
+    response = Response(
+        stream_with_context(generate()),
+        mimetype='application/zip',
+        headers={
+            'Content-Disposition': f"attachment; filename*=UTF-8''{quote(zip_name)}"
+        }
+    )
+    response.set_etag(cache_key)
+    return response
+
+
+@bp.route('/export_jobs/<job_id>')
+@login_required
+def export_job_status(job_id):
+    """查詢非同步匯出任務的進度"""
+    job = export_jobs.get_job(job_id, current_user.user_id)
+    if not job:
+        return jsonify({'success': False, 'message': '任務不存在'}), 404
+    return jsonify({
+        'success': True,
+        'job_id': job['job_id'],
+        'playlist_id': job['playlist_id'],
+        'status': job['status'],
+        'files_total': job['files_total'],
+        'files_done': job['files_done'],
+        'bytes_written': job['bytes_written'],
+        'error': job['error']
+    })
+
+
+@bp.route('/export_jobs/<job_id>/download')
+@login_required
+def export_job_download(job_id):
+    """下載已完成的非同步匯出壓縮包"""
+    job = export_jobs.get_job(job_id, current_user.user_id)
+    if not job:
+        return jsonify({'success': False, 'message': '任務不存在'}), 404
+    if job['status'] != 'done':
+        return jsonify({'success': False, 'message': '任務尚未完成', 'status': job['status']}), 409
+    return send_file(
+        job['artifact_path'],
+        mimetype='application/zip',
+        as_attachment=True,
+        download_name=job['download_name'],
+        conditional=True
+    )
 
 
 @bp.route('/<int:playlist_id>/remove_song', methods=['POST'])
@@ -166,31 +212,15 @@ def remove_song(playlist_id):
 @login_required
 def view_playlist(playlist_id):
     """查看歌單詳細頁"""
-    with found.db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT p.playlist_id, p.name, p.created_at,
-                   COUNT(ps.song_uuid) as song_count
-            FROM playlists p
-            LEFT JOIN playlist_songs ps ON p.playlist_id = ps.playlist_id
-            WHERE p.playlist_id = ? AND p.user_id = ?
-            GROUP BY p.playlist_id
-        """, (playlist_id, current_user.user_id))
-        playlist = cursor.fetchone()
-
+    playlist = repository.get_playlist(playlist_id, current_user.user_id)
     if not playlist:
         flash('歌單不存在或無權訪問', 'danger')
         return redirect(url_for('playlist.list_playlists'))
 
-    # 查詢歌曲列表
-    with found.db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT s.*
-            FROM songs s
-            JOIN playlist_songs ps ON s.uuid = ps.song_uuid
-            WHERE ps.playlist_id = ?
-        """, (playlist_id,))
-        songs = cursor.fetchall()
-
-    return render_template('view.html', playlist=playlist, songs=songs)
+    # 查詢歌曲列表（含加入時間）
+    songs = repository.get_playlist_songs(playlist_id)
+
+    # 依歌單共現統計推薦「接著聽」的歌曲
+    continuations = found.get_playlist_continuations(playlist_id, limit=5)
+
+    return render_template('view.html', playlist=playlist, songs=songs, continuations=continuations)
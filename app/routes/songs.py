@@ -1 +1,71 @@
- 
+from flask import Blueprint, jsonify, abort, request
+from flask_login import login_required
+from app import repository
+from app import autocomplete
+from app.routes.media import media_url, thumbnail_srcset
+
+bp = Blueprint('song', __name__, url_prefix='/songs')
+
+# 詳情不含 query_count：查詢次數常變，放進來會讓 ETag 頻繁失效
+SONG_DETAIL_FIELDS = (
+    'uuid', 'song_title', 'author', 'tags', 'music_key', 'category',
+    'tempo_start', 'tempo_end', 'tempo_range', 'lyrics', 'created_at'
+)
+SONG_DETAIL_MAX_AGE = 60
+AUTOCOMPLETE_MAX_AGE = 30
+SEARCH_TEXT_PARAMS = ('search_term', 'category', 'author', 'music_key', 'lyrics')
+
+
+@bp.route('/<song_uuid>')
+@login_required
+def song_detail(song_uuid):
+    """單首歌曲的完整資訊（歌詞、媒體網址），供搜尋結果展開時載入；以 ETag 重新驗證"""
+    song = repository.get_song(song_uuid)
+    if song is None:
+        abort(404)
+    detail = {name: getattr(song, name) for name in SONG_DETAIL_FIELDS}
+    detail.update({
+        'audio_url': media_url(song, 'audio'),
+        'image_url': media_url(song, 'image'),
+        'image_srcset': {fmt: thumbnail_srcset(song, fmt) for fmt in ('webp', 'jpeg')},
+    })
+    response = jsonify(detail)
+    response.add_etag()
+    response.cache_control.private = True
+    response.cache_control.max_age = SONG_DETAIL_MAX_AGE
+    return response.make_conditional(request)
+
+
+@bp.route('/search')
+@login_required
+def search():
+    """JSON 搜尋：參數同 found.get_songs 另加 lyrics，以 cursor 取下一頁（next_cursor 為 null 表示沒有更多）"""
+    params = {name: request.args.get(name) for name in SEARCH_TEXT_PARAMS}
+    # 節奏範圍格式錯誤時與 /auth/found 相同，視為未指定
+    params['min_tempo'] = request.args.get('min_tempo', type=int)
+    params['max_tempo'] = request.args.get('max_tempo', type=int)
+    try:
+        limit = int(request.args.get('limit', repository.SEARCH_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'success': False, 'message': '參數格式錯誤'}), 400
+
+    rows, next_cursor = repository.search_songs_page(params, request.args.get('cursor'), limit)
+    return jsonify({'success': True, 'results': rows, 'next_cursor': next_cursor})
+
+
+@bp.route('/autocomplete')
+@login_required
+def autocomplete_songs():
+    """輸入即搜：依前綴回傳標題、作者、標籤建議（中文可用字、拼音或注音首字母）"""
+    try:
+        limit = int(request.args.get('limit', autocomplete.AUTOCOMPLETE_LIMIT))
+    except ValueError:
+        return jsonify({'success': False, 'message': '參數格式錯誤'}), 400
+
+    response = jsonify({
+        'success': True,
+        'suggestions': autocomplete.suggest(request.args.get('q', ''), limit)
+    })
+    response.cache_control.private = True
+    response.cache_control.max_age = AUTOCOMPLETE_MAX_AGE
+    return response
@@ -0,0 +1,148 @@
+import os
+import atexit
+import hashlib
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional, Tuple
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # 未安装 Pillow 时不产生缩图，模板直接使用原图
+    Image = None
+
+from app import media_store
+
+# ========================
+# 封面 / 乐谱预览缩图
+# ========================
+# 每张图片按 THUMBNAIL_WIDTHS 产生 WebP 与 JPEG 两种格式，存于 instance/thumbnails/ab/<来源键>_<宽度>.<格式>。
+# 来源键：媒体存储中的对象直接用其 sha256；旧式路径以 路径 + 修改时间 + 大小 的 hash 代替，文件变更即换键。
+# 生成在专用进程池中进行：后台上传时预先提交，页面请求时若尚未生成则提交并短暂等待。
+THUMBNAIL_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance', 'thumbnails'
+)
+THUMBNAIL_WIDTHS = (160, 320, 640)
+THUMBNAIL_FORMATS = ('webp', 'jpeg')
+THUMBNAIL_QUALITY = 80
+THUMBNAIL_WORKERS = 2
+THUMBNAIL_WAIT = 2.0  # 请求时等待生成的最长秒数，超时则先返回原图
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+_pending: Dict[str, Future] = {}  # 目标路径 -> 进行中的任务，同一缩图只生成一次
+_pending_lock = threading.Lock()
+
+
+def available() -> bool:
+    return Image is not None
+
+
+def source_key(source: str) -> Optional[str]:
+    """缩图缓存键；来源文件不存在时返回 None"""
+    digest = media_store.object_digest(source)
+    if digest:
+        return digest
+    try:
+        stat = os.stat(source)
+    except OSError:
+        return None
+    return hashlib.sha256(f"{source}:{stat.st_mtime_ns}:{stat.st_size}".encode('utf-8')).hexdigest()
+
+
+def thumbnail_path(key: str, width: int, fmt: str) -> str:
+    return os.path.join(THUMBNAIL_DIR, key[:2], f"{key}_{width}.{fmt}")
+
+
+def _render(source: str, target: str, width: int, fmt: str) -> str:
+    """在工作进程中执行：缩放到指定宽度（不放大）并写入 target"""
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.width > width:
+            image = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+        if fmt == 'jpeg':
+            image = image.convert('RGB')
+        elif image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp_path = f"{target}.{os.getpid()}.tmp"
+        image.save(tmp_path, format=fmt.upper(), quality=THUMBNAIL_QUALITY)
+    os.replace(tmp_path, target)
+    return target
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=THUMBNAIL_WORKERS)
+        return _executor
+
+
+def _discard_executor(executor: ProcessPoolExecutor) -> None:
+    """丢弃损坏的进程池（工作进程被杀等），下次使用时重建"""
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+@atexit.register
+def shutdown_executor() -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def _submit(source: str, target: str, width: int, fmt: str) -> Future:
+    with _pending_lock:
+        future = _pending.get(target)
+        if future is None:
+            executor = _get_executor()
+            try:
+                future = executor.submit(_render, source, target, width, fmt)
+            except (BrokenProcessPool, RuntimeError):
+                # BrokenProcessPool：工作进程被杀；RuntimeError：进程池已关闭。重建后重试一次
+                _discard_executor(executor)
+                future = _get_executor().submit(_render, source, target, width, fmt)
+            _pending[target] = future
+            future.add_done_callback(lambda _: _pending.pop(target, None))
+        return future
+
+
+def pregenerate(source: str) -> int:
+    """后台上传后预先提交所有尺寸 / 格式，不等待；返回提交的任务数"""
+    key = source_key(source) if available() else None
+    if not key:
+        return 0
+    submitted = 0
+    for width in THUMBNAIL_WIDTHS:
+        for fmt in THUMBNAIL_FORMATS:
+            target = thumbnail_path(key, width, fmt)
+            if not os.path.exists(target):
+                _submit(source, target, width, fmt)
+                submitted += 1
+    return submitted
+
+
+def get_thumbnail(source: str, width: int, fmt: str, wait: float = THUMBNAIL_WAIT) -> Tuple[Optional[str], Optional[str]]:
+    """取得缩图，返回 (缩图路径, 来源键)；未能在 wait 秒内生成或生成失败时路径为 None"""
+    key = source_key(source) if available() else None
+    if not key or width not in THUMBNAIL_WIDTHS or fmt not in THUMBNAIL_FORMATS:
+        return None, key
+    target = thumbnail_path(key, width, fmt)
+    if os.path.exists(target):
+        return target, key
+    executor = _get_executor()
+    try:
+        return _submit(source, target, width, fmt).result(timeout=wait), key
+    except FutureTimeout:
+        return None, key
+    except (BrokenProcessPool, RuntimeError):
+        _discard_executor(executor)  # 下次请求时以新的进程池重新生成
+        return None, key
+    except Exception:  # 无法识别的图片格式等
+        return None, key
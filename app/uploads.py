@@ -0,0 +1,207 @@
+import os
+import time
+import uuid
+import hashlib
+import threading
+import sqlite3
+from typing import Any, BinaryIO, Dict, Optional
+
+from werkzeug.utils import secure_filename
+
+from app import found
+from app import media_store
+
+# ========================
+# 分块、可续传的上传
+# ========================
+# 客户端先建立上传会话，再按顺序以原始请求体（非 multipart）送出各块，每块标明起始偏移；
+# 服务器直接把请求体以固定大小的缓冲写入 <上传目录>/.partial/<id>.part，内存占用与文件大小无关。
+# 连接中断后查询会话即可取得已写入的偏移，从该处继续。全部写完后校验大小与 SHA-256，
+# 再交给 media_store 按内容存放（相同内容只存一份）。会话状态存于 upload_sessions 表，进程重启后仍可续传。
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024          # 建议客户端使用的分块大小
+UPLOAD_MAX_CHUNK_SIZE = 16 * 1024 * 1024     # 单块上限
+UPLOAD_MAX_FILE_SIZE = 2 * 1024 * 1024 * 1024
+UPLOAD_BUFFER_SIZE = 64 * 1024               # 每次从请求体读取的字节数
+UPLOAD_SESSION_TTL = 24 * 3600               # 未完成会话的保留时间（秒）
+PARTIAL_DIR_NAME = '.partial'
+
+_tables_ready = False
+_session_locks: Dict[str, threading.Lock] = {}
+_session_locks_guard = threading.Lock()
+# 本进程内随写入同步累计的 SHA-256：(已计算到的偏移, hash 对象)；重启后在完成时从磁盘重算
+_hashers: Dict[str, tuple] = {}
+
+
+class UploadOffsetMismatch(ValueError):
+    """块的起始偏移与服务器已写入的偏移不一致，offset 为正确的续传位置"""
+
+    def __init__(self, offset: int):
+        super().__init__(f"偏移不一致，应从 {offset} 继续")
+        self.offset = offset
+
+
+def ensure_upload_table(conn: sqlite3.Connection) -> None:
+    global _tables_ready
+    if _tables_ready:
+        return
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS upload_sessions (
+            upload_id TEXT PRIMARY KEY,
+            filename TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            received INTEGER NOT NULL DEFAULT 0,
+            sha256 TEXT,
+            status TEXT NOT NULL DEFAULT 'uploading'
+                CHECK(status IN ('uploading', 'done')),
+            final_path TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    """)
+    conn.commit()
+    _tables_ready = True
+
+
+def _session_lock(upload_id: str) -> threading.Lock:
+    with _session_locks_guard:
+        return _session_locks.setdefault(upload_id, threading.Lock())
+
+
+def _partial_path(upload_folder: str, upload_id: str) -> str:
+    return os.path.join(upload_folder, PARTIAL_DIR_NAME, f"{upload_id}.part")
+
+
+def _purge_expired(conn: sqlite3.Connection, upload_folder: str) -> None:
+    rows = conn.execute(
+        "SELECT upload_id FROM upload_sessions WHERE status = 'uploading' AND updated_at < ?",
+        (time.time() - UPLOAD_SESSION_TTL,)
+    ).fetchall()
+    for row in rows:
+        try:
+            os.remove(_partial_path(upload_folder, row['upload_id']))
+        except OSError:
+            pass
+        _hashers.pop(row['upload_id'], None)
+    conn.execute(
+        "DELETE FROM upload_sessions WHERE updated_at < ?",
+        (time.time() - UPLOAD_SESSION_TTL,)
+    )
+
+
+def create_session(upload_folder: str, filename: str, size: int, sha256: Optional[str] = None) -> Dict[str, Any]:
+    """建立上传会话；sha256 可选，提供时在完成时校验"""
+    if not secure_filename(filename or ''):
+        raise ValueError("文件名無效")
+    if size < 0 or size > UPLOAD_MAX_FILE_SIZE:
+        raise ValueError("文件大小超出限制")
+    upload_id = uuid.uuid4().hex
+    os.makedirs(os.path.join(upload_folder, PARTIAL_DIR_NAME), exist_ok=True)
+    open(_partial_path(upload_folder, upload_id), 'wb').close()
+    _hashers[upload_id] = (0, hashlib.sha256())
+
+    now = time.time()
+    with found.db_connection() as conn:
+        ensure_upload_table(conn)
+        _purge_expired(conn, upload_folder)
+        conn.execute("""
+            INSERT INTO upload_sessions (upload_id, filename, size, sha256, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (upload_id, filename, size, sha256.lower() if sha256 else None, now, now))
+    return {"upload_id": upload_id, "offset": 0, "size": size, "chunk_size": UPLOAD_CHUNK_SIZE}
+
+
+def get_session(upload_id: str) -> Optional[Dict[str, Any]]:
+    with found.db_connection() as conn:
+        ensure_upload_table(conn)
+        row = conn.execute(
+            "SELECT * FROM upload_sessions WHERE upload_id = ?", (upload_id,)
+        ).fetchone()
+    return dict(row) if row else None
+
+
+def write_chunk(upload_folder: str, upload_id: str, offset: int, stream: BinaryIO, length: int) -> int:
+    """把请求体流式写入 offset 处，返回新的偏移"""
+    if length <= 0 or length > UPLOAD_MAX_CHUNK_SIZE:
+        raise ValueError("分塊大小無效")
+    with _session_lock(upload_id):
+        session = get_session(upload_id)
+        if session is None or session['status'] != 'uploading':
+            raise LookupError("上傳會話不存在或已完成")
+        if offset != session['received']:
+            raise UploadOffsetMismatch(session['received'])
+        if offset + length > session['size']:
+            raise ValueError("超出文件大小")
+
+        hasher_offset, hasher = _hashers.get(upload_id, (-1, None))
+        written = 0
+        with open(_partial_path(upload_folder, upload_id), 'r+b') as f:
+            f.seek(offset)
+            f.truncate()  # 丢弃上次中断时写了一半的数据
+            while written < length:
+                data = stream.read(min(UPLOAD_BUFFER_SIZE, length - written))
+                if not data:
+                    break
+                f.write(data)
+                if hasher_offset == offset:
+                    hasher.update(data)
+                written += len(data)
+        if written != length:
+            # 连接中断：已写入的部分不计入，下次从原偏移重传本块；hash 改为完成时从磁盘重算
+            _hashers.pop(upload_id, None)
+            raise ValueError("分塊不完整")
+
+        new_offset = offset + written
+        if hasher_offset == offset:
+            _hashers[upload_id] = (new_offset, hasher)
+        with found.db_connection() as conn:
+            conn.execute(
+                "UPDATE upload_sessions SET received = ?, updated_at = ? WHERE upload_id = ?",
+                (new_offset, time.time(), upload_id)
+            )
+        return new_offset
+
+
+def _file_sha256(path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(UPLOAD_BUFFER_SIZE), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def complete_session(upload_folder: str, upload_id: str, sha256: Optional[str] = None) -> Dict[str, Any]:
+    """校验大小与 SHA-256 后把文件移入媒体存储，返回最终路径"""
+    with _session_lock(upload_id):
+        session = get_session(upload_id)
+        if session is None:
+            raise LookupError("上傳會話不存在")
+        if session['status'] == 'done':
+            return {"path": session['final_path'], "sha256": session['sha256'], "size": session['size']}
+        if session['received'] != session['size']:
+            raise UploadOffsetMismatch(session['received'])
+
+        partial = _partial_path(upload_folder, upload_id)
+        hasher_offset, hasher = _hashers.pop(upload_id, (-1, None))
+        digest = hasher.hexdigest() if hasher_offset == session['size'] else _file_sha256(partial)
+        expected = (sha256 or session['sha256'] or '').lower()
+        if expected and expected != digest:
+            raise ValueError("校驗和不符")
+
+        final_path = media_store.adopt_file(upload_folder, partial, digest, session['filename'])
+        with found.db_connection() as conn:
+            conn.execute("""
+                UPDATE upload_sessions
+                SET status = 'done', sha256 = ?, final_path = ?, updated_at = ?
+                WHERE upload_id = ?
+            """, (digest, final_path, time.time(), upload_id))
+    with _session_locks_guard:
+        _session_locks.pop(upload_id, None)
+    return {"path": final_path, "sha256": digest, "size": session['size']}
+
+
+def completed_path(upload_id: str) -> Optional[str]:
+    """已完成上传的最终路径（建立 / 编辑歌曲时引用上传会话用）"""
+    session = get_session(upload_id) if upload_id else None
+    if session and session['status'] == 'done':
+        return session['final_path']
+    return None
@@ -1,5 +1,7 @@
-from app import app
+from app import create_app
 from flask import Flask, redirect
+app = create_app()
+
 #@app.errorhandler(404)
 def page_not_found(e):
     #返回到登录页面